@@ -10,12 +10,18 @@ __email__ = "josenavasmolina@gmail.com"
 __status__ = "Development"
 
 __all__ = ['add_counts_to_mapping',
+    'beta_significance_cache',
+    'condensed_matrix',
+    'distance_matrix_cache',
+    'html_writer',
     'make_beta_significance_heatmap',
     'make_distance_matrix_heatmap',
     'make_heatmap',
+    'make_heatmap_tiles',
     'make_html_heatmap',
     'make_pcoa_html',
     'make_sample_counts_html',
     'make_unifrac_significance_each_sample_html',
     'newick_to_asciiArt',
+    'otu_table_cache',
     'parse']
\ No newline at end of file
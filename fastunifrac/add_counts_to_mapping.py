@@ -14,6 +14,8 @@ from biom.parse import parse_biom_table
 from qiime.parse import parse_mapping_file
 # from convert_category_map_to_id_map import write_corrected_file
 from qiime.check_id_map import write_corrected_mapping
+from fastunifrac.sample_id_map_otu_table_conversion import \
+    SAMPLE_ID_SANITIZER
 
 def add_counts_to_mapping(biom_lines, mapping_lines, otu_counts, output_fp):
     """Counts the number of seqs/OTUs per sample and add its to the mapping file
@@ -32,10 +34,16 @@ def add_counts_to_mapping(biom_lines, mapping_lines, otu_counts, output_fp):
     min_count, max_count, median_count, mean_count, counts_per_sample =\
         compute_counts_per_sample_stats(biom, binary_counts=otu_counts)
     # Add the counts to the mapping data
+    # The sample ids of a biom table converted from a sample mapping file are
+    # MIENS compliant, so a mapping sample id which is not in the table is
+    # looked up by its MIENS compliant version
     index = len(headers) - 1
     headers.insert(index, "NumIndividuals")
     for row in map_data:
-        row.insert(index, str(counts_per_sample[row[0]]))
+        sample_id = row[0]
+        if sample_id not in counts_per_sample:
+            sample_id = SAMPLE_ID_SANITIZER(sample_id)
+        row.insert(index, str(counts_per_sample[sample_id]))
     # # Add the '#' character to the first header
     # headers[0] = '#' + headers[0]
     # # Add headers to the data
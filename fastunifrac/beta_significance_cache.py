@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+__author__ = "Jose Antonio Navas Molina"
+__copyright__ = "Copyright 2013, The FastUniFrac Project"
+__credits__ = ["Jose Antonio Navas Molina"]
+__license__ = "GPL"
+__version__ = "1.7.0-dev"
+__maintainer__ = "Jose Antonio Navas Molina"
+__email__ = "josenavasmolina@gmail.com"
+__status__ = "Development"
+
+from os import close, remove, rename
+from os.path import dirname, basename, exists, getmtime
+from tempfile import mkstemp
+from zipfile import BadZipfile
+from numpy import array, savez, load
+from fastunifrac.parse import parse_beta_significance_output_pairwise_columns
+
+# Suffix of the binary file written next to the beta significance output
+BS_BINARY_SUFFIX = '.npz'
+# Names of the arrays stored in the binary file
+BS_ARRAYS = ['sample_ids', 'pairs', 'p_values', 'censored', 'test_name']
+
+def get_binary_fp(bs_fp):
+    """Returns the filepath of the binary file of a beta significance output
+    """
+    return bs_fp + BS_BINARY_SUFFIX
+
+def is_binary_up_to_date(bs_fp):
+    """Returns True if the binary file of bs_fp exists and is newer than it"""
+    binary_fp = get_binary_fp(bs_fp)
+    return exists(binary_fp) and getmtime(binary_fp) >= getmtime(bs_fp)
+
+def write_pairwise_binary(bs_fp, sample_ids, pairs, p_values, censored,
+    test_name):
+    """Writes the binary file of a pairwise beta significance output
+
+    Inputs:
+        bs_fp: filepath of the beta significance output text file
+        sample_ids, pairs, p_values, censored, test_name: parsed output (see
+            parse.parse_beta_significance_output_pairwise_columns)
+
+    The file is written to a temporary file which is then renamed to its
+        final name, so readers never see a partially written file.
+    """
+    binary_fp = get_binary_fp(bs_fp)
+    fd, tmp_fp = mkstemp(prefix='.' + basename(binary_fp),
+        dir=dirname(binary_fp) or '.')
+    close(fd)
+    try:
+        # savez adds the .npz extension to the filenames without it
+        out = open(tmp_fp, 'wb')
+        try:
+            savez(out, sample_ids=array(sample_ids, dtype=str), pairs=pairs,
+                p_values=p_values, censored=censored,
+                test_name=array(test_name, dtype=str))
+        finally:
+            out.close()
+        rename(tmp_fp, binary_fp)
+    finally:
+        if exists(tmp_fp):
+            remove(tmp_fp)
+
+def load_pairwise_binary(bs_fp):
+    """Loads the binary file of a pairwise beta significance output
+
+    Inputs:
+        bs_fp: filepath of the beta significance output text file
+
+    Returns the same values as parse_beta_significance_output_pairwise_columns
+    """
+    data = load(get_binary_fp(bs_fp))
+    try:
+        arrays = dict([(name, data[name]) for name in BS_ARRAYS])
+    finally:
+        data.close()
+    return (arrays['sample_ids'].tolist(), arrays['pairs'],
+        arrays['p_values'], arrays['censored'], str(arrays['test_name']))
+
+def load_beta_significance_output_pairwise(bs_fp, use_binary=True):
+    """Loads a pairwise beta significance output file using its binary file
+
+    Inputs:
+        bs_fp: filepath of the beta significance output text file
+        use_binary: if False, the text file is parsed and no binary file is
+            read or written
+
+    Returns the same values as parse_beta_significance_output_pairwise_columns
+
+    The text file is parsed only once: the parsed columns are stored next to
+        it in a binary file (bs_fp + BS_BINARY_SUFFIX), which is loaded by the
+        next calls as long as it is newer than the text file. If the binary
+        file can not be written, the text file is parsed every time.
+
+    Only this function uses the binary file. The parsers in fastunifrac.parse
+        take open file objects and always parse the text.
+    """
+    if use_binary and is_binary_up_to_date(bs_fp):
+        try:
+            return load_pairwise_binary(bs_fp)
+        except (IOError, OSError, ValueError, KeyError, BadZipfile):
+            # The binary file is corrupted, write it again
+            pass
+    bs_lines = open(bs_fp, 'U')
+    try:
+        result = parse_beta_significance_output_pairwise_columns(bs_lines)
+    finally:
+        bs_lines.close()
+    if not use_binary:
+        return result
+    try:
+        write_pairwise_binary(bs_fp, *result)
+    except (IOError, OSError):
+        # The directory of the beta significance output is not writable
+        pass
+    return result
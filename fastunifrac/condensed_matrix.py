@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+__author__ = "Jose Antonio Navas Molina"
+__copyright__ = "Copyright 2013, The FastUniFrac Project"
+__credits__ = ["Jose Antonio Navas Molina"]
+__license__ = "GPL"
+__version__ = "1.7.0-dev"
+__maintainer__ = "Jose Antonio Navas Molina"
+__email__ = "josenavasmolina@gmail.com"
+__status__ = "Development"
+
+from numpy import asarray, asanyarray, empty, zeros, isnan, triu_indices, nan
+from numpy.ma import masked_array, getmaskarray
+
+# Default number of rows of the blocks read by CondensedMatrix.iter_row_blocks
+DEFAULT_BLOCK_ROWS = 256
+
+def get_condensed_size(n):
+    """Returns the number of values in the upper triangle (without diagonal)
+        of a n x n matrix
+    """
+    return n * (n - 1) / 2
+
+def condensed_index(n, i, j):
+    """Returns the position of the cell (i, j) in the condensed vector
+
+    Inputs:
+        n: number of rows (and columns) of the matrix
+        i, j: row and column of the cell, with i < j. They can be integers or
+            integer arrays
+
+    The upper triangle is stored row by row, so the row i starts after the
+        n - 1, n - 2, ..., n - i values of the previous rows.
+    """
+    return n * i - i * (i + 1) / 2 + j - i - 1
+
+class CondensedMatrix(object):
+    """Upper triangle of a symmetric matrix stored as a condensed vector
+
+    Only the N(N-1)/2 values above the diagonal are stored, as a float64
+        (or float32) array. The diagonal and the lower triangle are not
+        stored, and behave as the None values of the list of lists returned by
+        make_distance_matrix_heatmap.get_upper_triangle. The values can be a
+        memory-mapped array, which is then read in blocks of rows.
+    """
+
+    def __init__(self, n, values):
+        """Builds the condensed matrix
+
+        Inputs:
+            n: number of rows (and columns) of the matrix
+            values: N(N-1)/2 values of the upper triangle, row by row. Float
+                arrays (including memory-mapped ones) are not copied
+
+        Note: raises a ValueError if the number of values does not match n
+        """
+        values = asanyarray(values)
+        if values.dtype.kind != 'f':
+            values = values.astype(float)
+        if values.shape != (get_condensed_size(n),):
+            raise ValueError, "A %d x %d matrix has %d values above the " \
+                "diagonal, got %s" % (n, n, get_condensed_size(n),
+                values.shape)
+        self.n = n
+        self.values = values
+
+    @classmethod
+    def from_matrix(cls, matrix):
+        """Builds the condensed matrix from the upper triangle of 'matrix'
+
+        Inputs:
+            matrix: square 2D array (or list of lists)
+        """
+        matrix = asarray(matrix, dtype=float)
+        n = len(matrix)
+        values = empty(get_condensed_size(n), dtype=float)
+        # Copy row by row, so no index arrays of the full size are built
+        start = 0
+        for i in range(n - 1):
+            stop = start + n - i - 1
+            values[start:stop] = matrix[i, i + 1:]
+            start = stop
+        return cls(n, values)
+
+    @property
+    def shape(self):
+        """Shape of the full matrix"""
+        return (self.n, self.n)
+
+    def __len__(self):
+        return self.n
+
+    def get_value(self, i, j):
+        """Returns the value of the cell (i, j), or None if it is not in the
+            upper triangle or it is NaN
+        """
+        if i >= j:
+            return None
+        value = self.values[condensed_index(self.n, i, j)]
+        return None if isnan(value) else value
+
+    def get_cells(self):
+        """Returns the rows and the columns of the cells with a value, as
+            two integer arrays ordered row by row
+        """
+        rows, cols = triu_indices(self.n, 1)
+        present = ~isnan(self.values)
+        return rows[present], cols[present]
+
+    def get_row_start(self, i):
+        """Returns the position in the condensed vector of the first value
+            of the row i
+        """
+        return self.n * i - i * (i + 1) / 2
+
+    def iter_row_blocks(self, block_rows=DEFAULT_BLOCK_ROWS):
+        """Iterates over the upper triangle in blocks of rows
+
+        Inputs:
+            block_rows: number of rows of each block
+
+        Yields (start_row, stop_row, values), where values are the condensed
+            values of the rows in [start_row, stop_row). The values are a view
+            of the matrix values, so only the rows of a block are read from a
+            memory-mapped file at a time.
+        """
+        for start_row in range(0, max(self.n - 1, 0), block_rows):
+            stop_row = min(start_row + block_rows, self.n)
+            yield start_row, stop_row, self.values[
+                self.get_row_start(start_row):self.get_row_start(stop_row)]
+
+    def _fill_rows(self, result, start_row, stop_row, values):
+        """Copies the condensed values of the rows in [start_row, stop_row)
+            to the upper triangle of the 2D array 'result'. 'values' starts at
+            the first value of start_row
+        """
+        start = 0
+        for i in range(start_row, min(stop_row, self.n - 1)):
+            stop = start + self.n - i - 1
+            result[i, i + 1:] = values[start:stop]
+            start = stop
+
+    def expand(self, values=None, fill_value=nan):
+        """Expands a condensed vector to the full 2D array
+
+        Inputs:
+            values: condensed vector (or masked array) with the values of the
+                upper triangle. If None, the matrix values are used
+            fill_value: value of the diagonal and the lower triangle
+
+        Returns a 2D array, or a masked array if 'values' is masked. The
+            diagonal and the lower triangle are not masked.
+        """
+        if values is None:
+            values = self.values
+        result = empty(self.shape, dtype=asarray(values).dtype)
+        result.fill(fill_value)
+        if not isinstance(values, masked_array):
+            self._fill_rows(result, 0, self.n, values)
+            return result
+        mask = zeros(self.shape, dtype=bool)
+        self._fill_rows(result, 0, self.n, values.data)
+        self._fill_rows(mask, 0, self.n, getmaskarray(values))
+        return masked_array(result, mask=mask)
+
+    def expand_blocks(self, function, fill_value, dtype,
+        block_rows=DEFAULT_BLOCK_ROWS):
+        """Expands the result of 'function' on each block of rows
+
+        Inputs:
+            function: function which takes the condensed values of a block of
+                rows and returns an array with the same length
+            fill_value: value of the diagonal and the lower triangle
+            dtype: data type of the result
+            block_rows: number of rows of each block
+
+        Returns the 2D array with the results of 'function' in the upper
+            triangle. The matrix values are read one block at a time.
+        """
+        result = empty(self.shape, dtype=dtype)
+        result.fill(fill_value)
+        for start_row, stop_row, values in self.iter_row_blocks(block_rows):
+            self._fill_rows(result, start_row, stop_row, function(values))
+        return result
+
+    def tolist(self):
+        """Returns the list of lists with the upper triangle values and None
+            in the diagonal, the lower triangle and the NaN cells
+        """
+        result = []
+        start = 0
+        for i in range(self.n):
+            stop = start + self.n - i - 1
+            result.append([None] * (i + 1) + [None if isnan(value) else value
+                for value in self.values[start:stop]])
+            start = stop
+        return result
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+
+__author__ = "Jose Antonio Navas Molina"
+__copyright__ = "Copyright 2013, The FastUniFrac Project"
+__credits__ = ["Jose Antonio Navas Molina"]
+__license__ = "GPL"
+__version__ = "1.7.0-dev"
+__maintainer__ = "Jose Antonio Navas Molina"
+__email__ = "josenavasmolina@gmail.com"
+__status__ = "Development"
+
+from os import close, remove, rename
+from os.path import dirname, basename, exists, getmtime
+from tempfile import mkstemp
+from numpy import array, empty, save, load
+from numpy.lib.format import open_memmap
+from fastunifrac.condensed_matrix import CondensedMatrix, get_condensed_size
+
+# Suffixes of the binary files written next to the distance matrix file
+DM_VALUES_SUFFIX = '.condensed.npy'
+DM_IDS_SUFFIX = '.ids.npy'
+# Data types which can be used to store the distance matrix values
+DM_DTYPES = ['float64', 'float32']
+
+def get_binary_fps(dm_fp):
+    """Returns the filepaths of the binary files of a distance matrix
+
+    Inputs:
+        dm_fp: filepath of the distance matrix text file
+
+    Returns:
+        values_fp: filepath of the condensed upper triangle values
+        ids_fp: filepath of the sample ids
+    """
+    return dm_fp + DM_VALUES_SUFFIX, dm_fp + DM_IDS_SUFFIX
+
+def parse_distmat_header(line):
+    """Returns the list of sample ids of a distance matrix header line"""
+    return [sample_id.strip() for sample_id in line.split('\t')[1:]]
+
+def parse_distmat_to_condensed(lines, out=None, dtype='float64'):
+    """Parses a distance matrix keeping only its upper triangle
+
+    Inputs:
+        lines: distance matrix open file object (the output of
+            beta_diversity.py). The header line must be the first one
+        out: array of N(N-1)/2 values where the upper triangle is stored, or a
+            function which takes the number of values and returns that array.
+            If None, a new array is created
+        dtype: data type of the new array
+
+    Returns:
+        sample_ids: list with the sample ids
+        values: condensed upper triangle values (see CondensedMatrix)
+
+    The rows are parsed one by one and only the values above the diagonal
+        are converted, so the full matrix is never held in memory.
+
+    Note: raises a ValueError if the number of rows does not match the header
+    """
+    lines = (line.rstrip('\r\n') for line in lines)
+    lines = (line for line in lines if line.strip())
+    try:
+        header = lines.next()
+    except StopIteration:
+        raise ValueError, "The distance matrix file is empty"
+    if header[0] != '\t':
+        raise ValueError, "The first line of the distance matrix must be " \
+            "the header"
+    sample_ids = parse_distmat_header(header)
+    n = len(sample_ids)
+    size = get_condensed_size(n)
+    if out is None:
+        values = empty(size, dtype=dtype)
+    elif callable(out):
+        values = out(size)
+    else:
+        values = out
+
+    start = 0
+    i = -1
+    for i, line in enumerate(lines):
+        if i >= n:
+            raise ValueError, "The distance matrix has more rows than samples"
+        # The sample id and the values up to the diagonal are not converted
+        fields = line.split('\t', i + 2)
+        stop = start + n - i - 1
+        if stop > start:
+            row = fields[i + 2].split('\t') if len(fields) == i + 3 else []
+            if len(row) != stop - start:
+                raise ValueError, "Row %d of the distance matrix does not " \
+                    "have %d values" % (i + 1, n)
+            values[start:stop] = array(row, dtype=float)
+        start = stop
+    if i + 1 != n:
+        raise ValueError, "The distance matrix has %d rows but %d samples" % \
+            (i + 1, n)
+    return sample_ids, values
+
+def is_binary_up_to_date(dm_fp):
+    """Returns True if the binary files of dm_fp exist and are newer than it
+    """
+    values_fp, ids_fp = get_binary_fps(dm_fp)
+    if not (exists(values_fp) and exists(ids_fp)):
+        return False
+    dm_mtime = getmtime(dm_fp)
+    return getmtime(values_fp) >= dm_mtime and getmtime(ids_fp) >= dm_mtime
+
+def write_distmat_binary(dm_fp, dtype='float64'):
+    """Parses a distance matrix file into its binary files
+
+    Inputs:
+        dm_fp: filepath of the distance matrix text file
+        dtype: data type of the stored values (see DM_DTYPES)
+
+    The values are written to a temporary memory-mapped file while the text
+        file is parsed, which is then renamed to its final name, so readers
+        never see a partially written file.
+    """
+    values_fp, ids_fp = get_binary_fps(dm_fp)
+    tmp_fps = []
+    def make_tmp_fp(fp):
+        fd, tmp_fp = mkstemp(prefix='.' + basename(fp), dir=dirname(fp) or '.')
+        close(fd)
+        tmp_fps.append(tmp_fp)
+        return tmp_fp
+
+    try:
+        tmp_values_fp = make_tmp_fp(values_fp)
+        def open_values(size):
+            return open_memmap(tmp_values_fp, mode='w+', dtype=dtype,
+                shape=(size,))
+        dm_f = open(dm_fp, 'U')
+        try:
+            sample_ids, values = parse_distmat_to_condensed(dm_f, open_values)
+        finally:
+            dm_f.close()
+        values.flush()
+        del values
+
+        tmp_ids_fp = make_tmp_fp(ids_fp)
+        # save adds the .npy extension to the filenames without it
+        ids_f = open(tmp_ids_fp, 'wb')
+        save(ids_f, array(sample_ids, dtype=str))
+        ids_f.close()
+        # The ids go first, so up to date values always have up to date ids
+        rename(tmp_ids_fp, ids_fp)
+        rename(tmp_values_fp, values_fp)
+    finally:
+        for tmp_fp in tmp_fps:
+            if exists(tmp_fp):
+                remove(tmp_fp)
+
+def load_distmat_binary(dm_fp):
+    """Loads the binary files of a distance matrix
+
+    Inputs:
+        dm_fp: filepath of the distance matrix text file
+
+    Returns:
+        sample_ids: list with the sample ids
+        matrix: CondensedMatrix whose values are memory-mapped from the
+            binary file
+    """
+    values_fp, ids_fp = get_binary_fps(dm_fp)
+    sample_ids = load(ids_fp).tolist()
+    values = load(values_fp, mmap_mode='r')
+    return sample_ids, CondensedMatrix(len(sample_ids), values)
+
+def load_distmat(dm_fp, dtype='float64'):
+    """Loads a distance matrix file using its binary files
+
+    Inputs:
+        dm_fp: filepath of the distance matrix text file
+        dtype: data type of the stored values (see DM_DTYPES)
+
+    Returns:
+        sample_ids: list with the sample ids
+        matrix: CondensedMatrix with the upper triangle of the distance matrix
+
+    The text file is parsed only once: its upper triangle is stored next to it
+        in a binary file which is memory-mapped by the next calls, as long as
+        it is newer than the text file and has the requested data type. If the
+        binary files can not be written, the text file is parsed into memory.
+    """
+    if is_binary_up_to_date(dm_fp):
+        try:
+            sample_ids, matrix = load_distmat_binary(dm_fp)
+            if matrix.values.dtype == dtype:
+                return sample_ids, matrix
+        except (IOError, OSError, ValueError):
+            # The binary files are corrupted, write them again
+            pass
+    try:
+        write_distmat_binary(dm_fp, dtype)
+    except (IOError, OSError):
+        # The directory of the distance matrix is not writable
+        dm_f = open(dm_fp, 'U')
+        try:
+            sample_ids, values = parse_distmat_to_condensed(dm_f,
+                dtype=dtype)
+        finally:
+            dm_f.close()
+        return sample_ids, CondensedMatrix(len(sample_ids), values)
+    return load_distmat_binary(dm_fp)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+__author__ = "Jose Antonio Navas Molina"
+__copyright__ = "Copyright 2013, The FastUniFrac Project"
+__credits__ = ["Jose Antonio Navas Molina"]
+__license__ = "GPL"
+__version__ = "1.7.0-dev"
+__maintainer__ = "Jose Antonio Navas Molina"
+__email__ = "josenavasmolina@gmail.com"
+__status__ = "Development"
+
+from StringIO import StringIO
+from os import remove
+
+# Minimum size (in characters) of the chunks written to the output file
+HTML_BUFFER_SIZE = 2 ** 16
+
+class BufferedHtmlWriter(object):
+    """Writes the html code to a file object in large chunks
+
+    The strings are accumulated in a list and written to the file object once
+        they add up to 'buffer_size' characters, so the full page is never
+        held in memory and the pieces are joined only once.
+    """
+    def __init__(self, out, buffer_size=HTML_BUFFER_SIZE):
+        """Inputs:
+            out: file object where the html code is written
+            buffer_size: minimum size of the chunks written to 'out'
+        """
+        self.out = out
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._buffered = 0
+
+    def write(self, s):
+        """Adds the string 's' to the output"""
+        self._buffer.append(s)
+        self._buffered += len(s)
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+    def writelines(self, strings):
+        """Adds all the strings in the iterable 'strings' to the output"""
+        for s in strings:
+            self.write(s)
+
+    def flush(self):
+        """Writes the buffered strings to the output"""
+        if self._buffer:
+            self.out.write(''.join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+
+def split_template(template):
+    """Splits an html template in the literal text between its placeholders
+
+    Inputs:
+        template: string with '%s' placeholders (and '%%' escaped percents)
+
+    Returns the list of strings between the placeholders, with the escaped
+        percents already translated to '%'
+    """
+    return [piece.replace('%%', '%') for piece in template.split('%s')]
+
+def write_template(writer, template, *parts):
+    """Writes an html template filling its placeholders with 'parts'
+
+    Inputs:
+        writer: BufferedHtmlWriter where the html code is written
+        template: string with one '%s' placeholder per part
+        parts: values of the placeholders. Each part can be a string, a
+            function which writes its html code to the writer or an iterable
+            of strings
+
+    The output is the same as the one of template % parts, but the parts are
+        written to the writer as they are generated.
+    """
+    pieces = split_template(template)
+    if len(pieces) != len(parts) + 1:
+        raise ValueError, "The template has %d placeholders but %d parts " \
+            "were provided" % (len(pieces) - 1, len(parts))
+    for piece, part in zip(pieces, parts):
+        writer.write(piece)
+        if isinstance(part, basestring):
+            writer.write(part)
+        elif callable(part):
+            part(writer)
+        else:
+            writer.writelines(part)
+    writer.write(pieces[-1])
+
+def render_to_string(write_function, *args):
+    """Returns the html code written by write_function(writer, *args)"""
+    out = StringIO()
+    writer = BufferedHtmlWriter(out)
+    write_function(writer, *args)
+    writer.flush()
+    return out.getvalue()
+
+def render_to_file(write_function, html_fp, *args):
+    """Writes the html code of write_function(writer, *args) to html_fp
+
+    If write_function fails, the partially written file is removed.
+    """
+    out = open(html_fp, 'w')
+    try:
+        writer = BufferedHtmlWriter(out)
+        write_function(writer, *args)
+        writer.flush()
+    except:
+        out.close()
+        remove(html_fp)
+        raise
+    out.close()
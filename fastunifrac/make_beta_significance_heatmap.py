@@ -10,10 +10,14 @@ __email__ = "josenavasmolina@gmail.com"
 __status__ = "Development"
 
 from qiime.parse import parse_mapping_file_to_dict
-from fastunifrac.parse import parse_beta_significance_output_pairwise
+from fastunifrac.parse import parse_beta_significance_output_pairwise_columns
+from fastunifrac.beta_significance_cache import (
+    load_beta_significance_output_pairwise)
 from fastunifrac.make_html_heatmap import (make_html_file, LD_NAME, LD_HEADERS,
     LD_HEADERS_VER, LD_HEADERS_HOR, LD_MATRIX, LD_TRANSFORM_VALUES,
     LD_TABLE_TITLE)
+from fastunifrac.make_heatmap import DEFAULT_IMAGE_FORMATS
+from numpy import array, arange, empty, zeros, isnan, nan
 
 DICT_TRANS_VALUES = {(None, None) : (0, ""),
             (None, 0.001): (1, "(<0.001)\nHighly\nsignificant"),
@@ -22,6 +26,77 @@ DICT_TRANS_VALUES = {(None, None) : (0, ""),
             (0.05, 0.1): (4, "(0.05-0.1)\nSuggestive"),
             (0.1, None): (5, "(>0.1)\nNot\nsignificant")}
 
+def generate_headers_and_matrices_from_columns(sample_ids, pairs, p_values):
+    """Generates the headers and the raw and corrected matrix values
+
+    Inputs:
+        sample_ids: list with the sample ids
+        pairs: int array of shape (n_pairs, 2) with the indices in
+            'sample_ids' of sample 1 and sample 2
+        p_values: float array of shape (n_pairs, 2) with the p value and the
+            p value corrected of each pair
+
+    Returns:
+        headers: dict of: {HEADERS_VER:[], HEADERS_HOR:[]}
+        raw: 2D array with the p values
+        corrected: 2D array with the corrected p values
+
+    The rows are the samples which appear as sample 1 and the columns all the
+        samples, both sorted. The position of each sample in the rows and in
+        the columns is looked up in an index array, so both matrices are
+        filled at once for all the pairs, in any order. The cells without a
+        pair are NaN.
+    """
+    n_samples = len(sample_ids)
+    is_ver = zeros(n_samples, dtype=bool)
+    is_ver[pairs[:, 0]] = True
+    is_hor = is_ver.copy()
+    is_hor[pairs[:, 1]] = True
+    ver = sorted([s for s, used in zip(sample_ids, is_ver) if used])
+    hor = sorted([s for s, used in zip(sample_ids, is_hor) if used])
+
+    # Position of each sample id in the rows and the columns
+    sample_pos = dict([(s, i) for i, s in enumerate(sample_ids)])
+    ver_pos = empty(n_samples, dtype=int)
+    ver_pos[[sample_pos[s] for s in ver]] = arange(len(ver))
+    hor_pos = empty(n_samples, dtype=int)
+    hor_pos[[sample_pos[s] for s in hor]] = arange(len(hor))
+
+    rows = ver_pos[pairs[:, 0]]
+    cols = hor_pos[pairs[:, 1]]
+    raw = empty((len(ver), len(hor)), dtype=float)
+    raw.fill(nan)
+    corrected = raw.copy()
+    raw[rows, cols] = p_values[:, 0]
+    corrected[rows, cols] = p_values[:, 1]
+
+    headers = {LD_HEADERS_VER: ver, LD_HEADERS_HOR: hor}
+    return headers, raw, corrected
+
+def generate_headers_and_matrices(d_data):
+    """Generates the headers and the raw and corrected matrix values
+
+    Inputs:
+        d_data: dict of: {(sample 1, sample 2),(p value, p value corrected)}
+
+    Returns:
+        headers: dict of: {HEADERS_VER:[], HEADERS_HOR:[]}
+        raw: 2D array with the p values
+        corrected: 2D array with the corrected p values
+
+    See generate_headers_and_matrices_from_columns
+    """
+    sample_index = {}
+    for s1, s2 in d_data:
+        sample_index.setdefault(s1, len(sample_index))
+        sample_index.setdefault(s2, len(sample_index))
+    sample_ids = sorted(sample_index, key=sample_index.get)
+    pairs = array([(sample_index[s1], sample_index[s2])
+        for s1, s2 in d_data], dtype=int).reshape(-1, 2)
+    p_values = array(d_data.values(), dtype=float).reshape(-1, 2)
+    return generate_headers_and_matrices_from_columns(sample_ids, pairs,
+        p_values)
+
 def generate_headers_and_matrix(d_data, index):
     """Generates the headers and the matrix values for plotting
 
@@ -32,35 +107,17 @@ def generate_headers_and_matrix(d_data, index):
         Returns:
             headers: dict of: {HEADERS_VER:[], HEADERS_HOR:[]}
             result: list of lists containing the float values to plot
+
+    Note: use generate_headers_and_matrices to get both matrices at once
     """
     # Check that index is one of the supported values
     if index != 0 and index != 1:
         raise ValueError, "Index must be 0 or 1!"
 
-    sorted_keys = d_data.keys()
-    sorted_keys.sort()
-
-    headers = {LD_HEADERS_VER:[], LD_HEADERS_HOR:[]}
-    headers[LD_HEADERS_VER].append(sorted_keys[0][0])
-    headers[LD_HEADERS_HOR].append(sorted_keys[0][0])
-    result = []
-    row = []
-    row.append(None)
-    none_ct = 1
-    for key in sorted_keys:
-        s1, s2 = key
-        value = d_data[key][index]
-        if headers[LD_HEADERS_VER][none_ct-1] != s1:
-            result.append(row)
-            none_ct += 1
-            headers[LD_HEADERS_VER].append(s1)
-            row = [None for i in range(none_ct)]
-        if s2 not in headers[LD_HEADERS_HOR]:
-            headers[LD_HEADERS_HOR].append(s2)
-        row.append(value)
-    result.append(row)
-
-    return headers, result
+    headers, raw, corrected = generate_headers_and_matrices(d_data)
+    matrix = (raw, corrected)[index]
+    return headers, [[None if isnan(value) else value for value in row]
+        for row in matrix.tolist()]
 
 def generate_dict_data(name, headers, matrix, test_name):
     """Generates a dict with the info needed for the plots
@@ -68,7 +125,8 @@ def generate_dict_data(name, headers, matrix, test_name):
     Inputs:
         name: str with the title of the plot
         headers: dict of: {HEADERS_VER:[], HEADERS_HOR:[]}
-        matrix: list of lists containing the float values to plot
+        matrix: list of lists (or 2D array with NaN for the missing values)
+            containing the float values to plot
         test_name: str with the conducted test name
 
     Return dict of:
@@ -94,6 +152,27 @@ def generate_dict_data(name, headers, matrix, test_name):
     return result
 
 
+def get_data_make_html(sample_ids, pairs, p_values, test_name):
+    """Generates the list of dicts with the plot info from the parsed results
+
+    Inputs:
+        sample_ids, pairs, p_values, test_name: parsed beta significance
+            results (see parse.parse_beta_significance_output_pairwise_columns)
+
+    Returns the list of dicts described in generate_data_make_html
+    """
+    result = []
+
+    headers, raw_matrix, corr_matrix = \
+        generate_headers_and_matrices_from_columns(sample_ids, pairs, p_values)
+
+    result.append(generate_dict_data("Raw values", headers, raw_matrix,
+        test_name))
+    result.append(generate_dict_data("Corrected values", headers,
+        corr_matrix, test_name))
+
+    return result
+
 def generate_data_make_html(bs_lines):
     """Parses the beta significance file and returns the info in a list of dicts
 
@@ -104,31 +183,40 @@ def generate_data_make_html(bs_lines):
         {
             LD_NAME: plot_name,
             LD_HEADERS: {LD_HEADERS_VER:[], LD_HEADERS_HOR:[]},
-            LD_MATRIX : list of lists containing the float values to plot
+            LD_MATRIX : 2D array containing the float values to plot, with
+                NaN in the cells without value
             LD_TRANSFORM_VALUES: {(val1, val2) : (plot_value, label)}
                 must have a key of form (None, None)
                 Is a dictionary which allows to transform the continue
                 matrix values into a discrete values to plot.
             LD_TABLE_TITLE: table_title
         }
-        Contains all the needed information to generate the html file.
+        Contains all the needed information to generate the html file. The
+        raw and corrected values share the headers dict.
     """
-    result = []
-
-    dict_data, test_name = parse_beta_significance_output_pairwise(bs_lines)
+    sample_ids, pairs, p_values, censored, test_name = \
+        parse_beta_significance_output_pairwise_columns(bs_lines)
+    return get_data_make_html(sample_ids, pairs, p_values, test_name)
 
-    raw_headers, raw_matrix = generate_headers_and_matrix(dict_data, 0)
-    corr_headers, corr_matrix = generate_headers_and_matrix(dict_data, 1)
+def generate_data_make_html_from_fp(bs_fp, use_binary=True):
+    """Parses the beta significance file and returns the info in a list of dicts
 
-    result.append(generate_dict_data("Raw values", raw_headers, raw_matrix,
-        test_name))
-    result.append(generate_dict_data("Corrected values", corr_headers,
-        corr_matrix, test_name))
+    Inputs:
+        bs_fp: beta significance results filepath
+        use_binary: if False, bs_fp is parsed and no binary file is used
 
-    return result
+    Returns the list of dicts described in generate_data_make_html. The
+        results are loaded from the binary file written next to bs_fp the
+        first time it is used (see
+        beta_significance_cache.load_beta_significance_output_pairwise).
+    """
+    sample_ids, pairs, p_values, censored, test_name = \
+        load_beta_significance_output_pairwise(bs_fp, use_binary)
+    return get_data_make_html(sample_ids, pairs, p_values, test_name)
 
 def make_beta_significance_heatmap(beta_significance_fp, mapping_fp, html_fp,
-    output_dir):
+    output_dir, scalable=False, image_formats=DEFAULT_IMAGE_FORMATS,
+    workers=1, use_binary=True):
     """Creates an html file with the heatmaps of beta significance analysis
     
     Inputs:
@@ -136,11 +224,19 @@ def make_beta_significance_heatmap(beta_significance_fp, mapping_fp, html_fp,
         mapping_fp: mapping filepath
         html_fp: output html filepath
         output_dir: output directory where the aux html files will be stored
+        scalable: if True, use the client-side image map of heatmap_map.js
+        image_formats: list of formats of the heatmap images (see
+            make_heatmap.IMAGE_FORMATS). Must contain 'png'
+        workers: number of processes used to render the raw and corrected
+            values heatmaps
+        use_binary: if True, the parsed results are stored in a binary file
+            next to beta_significance_fp (<beta_significance_fp>.npz) and
+            loaded from it by the next runs
     """
-    bs_lines = open(beta_significance_fp, 'U')
-
-    l_data = generate_data_make_html(bs_lines)
+    l_data = generate_data_make_html_from_fp(beta_significance_fp,
+        use_binary)
 
     mapping_data = parse_mapping_file_to_dict(open(mapping_fp, 'U'))
 
-    make_html_file(l_data, mapping_data, html_fp, output_dir)
\ No newline at end of file
+    make_html_file(l_data, mapping_data, html_fp, output_dir, scalable,
+        image_formats, workers)
\ No newline at end of file
@@ -9,11 +9,16 @@ __maintainer__ = "Jose Antonio Navas Molina"
 __email__ = "josenavasmolina@gmail.com"
 __status__ = "Development"
 
-from qiime.parse import parse_distmat, parse_mapping_file_to_dict
-from numpy import median
+from qiime.parse import parse_mapping_file_to_dict
+from numpy import array, asarray, empty, isnan, partition
 from fastunifrac.make_html_heatmap import (make_html_file, LD_NAME, LD_HEADERS,
     LD_HEADERS_VER, LD_HEADERS_HOR, LD_MATRIX, LD_TRANSFORM_VALUES,
     LD_TABLE_TITLE)
+from fastunifrac.make_heatmap import DEFAULT_IMAGE_FORMATS
+from fastunifrac.make_heatmap_tiles import make_tiled_heatmap
+from fastunifrac.condensed_matrix import CondensedMatrix
+from fastunifrac.distance_matrix_cache import (parse_distmat_to_condensed,
+    load_distmat)
 
 def get_upper_triangle(matrix):
     """Sets the lower triangle and the diagonal of 'matrix' to None
@@ -37,11 +42,22 @@ def get_upper_triangle(matrix):
 
     return result
 
-def compute_quartiles(data):
+def _get_median_positions(start, length):
+    """Returns the positions in a sorted array of the values whose mean is
+        the median of the 'length' values starting at 'start'
+    """
+    middle = start + length / 2
+    if length % 2 == 0:
+        return [middle - 1, middle]
+    return [middle]
+
+def compute_quartiles(data, overwrite_input=False):
     """Compute the quartiles of data
 
     Input:
         data: array
+        overwrite_input: if True and data is a float array, it is partially
+            sorted in place instead of copied
 
     Returns:
         lq: lower quartile
@@ -50,28 +66,36 @@ def compute_quartiles(data):
 
     Note: Uses method described by Moore and McCabe
     Note: raises a ValueError if data have less than 4 elements
+
+    The data is not sorted: the order statistics needed by the three
+        quartiles are selected with a single call to numpy.partition.
     """
-    if len(data) < 4:
+    len_data = len(data)
+    if len_data < 4:
         raise ValueError, "Not enough values to compute quartiles!"
 
-    data.sort()
-    q_median = median(data)
-    len_data = len(data)
-    m_ix = len_data / 2
-    if len_data % 2 == 0:
-        lq = median(data[0:m_ix])
-        uq = median(data[m_ix:])
+    # The lower and upper halves do not include the median when len_data is
+    # odd, so both have len_data / 2 values
+    half = len_data / 2
+    lq_pos = _get_median_positions(0, half)
+    mq_pos = _get_median_positions(0, len_data)
+    uq_pos = _get_median_positions(len_data - half, half)
+    kth = sorted(set(lq_pos + mq_pos + uq_pos))
+    values = asarray(data, dtype=float)
+    if overwrite_input:
+        values.partition(kth)
     else:
-        lq = median(data[0:m_ix])
-        uq = median(data[m_ix+1:])
+        values = partition(values, kth)
 
+    lq, q_median, uq = [values[pos].mean() for pos in (lq_pos, mq_pos, uq_pos)]
     return lq, q_median, uq
 
 def make_quartiles(dist_mat):
     """Creates a dictionary with the quartile ranges and its label in the plot
 
     Inputs:
-        dist_mat: distance matrix values (list of lists)
+        dist_mat: distance matrix values (list of lists, array or
+            CondensedMatrix). The None (or NaN) values are ignored
 
     Returns dict of: {(value1, value2),(plot_value, label)}
         where:
@@ -80,16 +104,23 @@ def make_quartiles(dist_mat):
             label is the label to use in the heatmap plot for this interval
     """
     # Create a 1D array with the non-None data
-    data = []
-    for row in dist_mat:
-        for item in row:
-            if item is not None:
-                data.append(item)
+    if isinstance(dist_mat, CondensedMatrix):
+        # Copy the values block by block, so no full size mask is built
+        data = empty(len(dist_mat.values), dtype=float)
+        size = 0
+        for start_row, stop_row, values in dist_mat.iter_row_blocks():
+            values = values[~isnan(values)]
+            data[size:size + len(values)] = values
+            size += len(values)
+        data = data[:size]
+    else:
+        data = array(dist_mat, dtype=float).ravel()
+        data = data[~isnan(data)]
     # Compute quartiles
-    min_val = min(data)
-    max_val = max(data)
+    min_val = float(data.min())
+    max_val = float(data.max())
     try:
-        lq, mq, uq = compute_quartiles(data)
+        lq, mq, uq = compute_quartiles(data, overwrite_input=True)
     except ValueError, e:
         lq = mq = uq = 0
     # Crate and return the dictionary with the quartiles ranges
@@ -103,7 +134,7 @@ def generate_trans_values_dict(dist_mat):
     """Generates a dictionary for translate the matrix values to plot values
 
     Inputs:
-        dist_mat: distance matrix values (list of lists)
+        dist_mat: distance matrix values (list of lists or CondensedMatrix)
 
     Returns dict of: {(value1, value2),(plot_value, label)}
         Is a dictionary which allows to transform the continue matrix 
@@ -114,6 +145,30 @@ def generate_trans_values_dict(dist_mat):
     trans_values[(None, None)] = (0, "")
     return trans_values
 
+def get_data_make_html(header, dist_mat):
+    """Generates a dictionary from the parsed distance matrix with the plot info
+
+    Inputs:
+        header: list with the sample ids
+        dist_mat: CondensedMatrix with the upper triangle values
+
+    Returns the dict described in generate_data_make_html
+    """
+    # Generate the dictionary
+    result = {}
+    result[LD_NAME] = "Distance matrix"
+    # In this case, the headers are symmetric
+    headers = {}
+    headers[LD_HEADERS_HOR] = header
+    headers[LD_HEADERS_VER] = header
+
+    result[LD_HEADERS] = headers
+    result[LD_MATRIX] = dist_mat
+    result[LD_TRANSFORM_VALUES] = generate_trans_values_dict(dist_mat)
+    result[LD_TABLE_TITLE] = "Distance matrix"
+
+    return result
+
 def generate_data_make_html(dm_lines):
     """Generates a dictionary from the distance matrix with the plot info
 
@@ -124,7 +179,7 @@ def generate_data_make_html(dm_lines):
         {
             LD_NAME: plot_name,
             LD_HEADERS: {LD_HEADERS_VER:[], LD_HEADERS_HOR:[]},
-            LD_MATRIX : list of lists containing the float values to plot
+            LD_MATRIX : CondensedMatrix with the upper triangle values
             LD_TRANSFORM_VALUES: {(val1, val2) : (plot_value, label)}
                 must have a key of form (None, None)
                 Is a dictionary which allows to transform the continue matrix 
@@ -133,36 +188,59 @@ def generate_data_make_html(dm_lines):
         }
         Contains all the needed information to generate the html file.
     """
-    header, dist_mat = parse_distmat(dm_lines)
-    # Distance matrix are symmetric, get only the upper triangle
-    dist_mat = get_upper_triangle(dist_mat)
-    # Generate the dictionary
-    result = {}
-    result[LD_NAME] = "Distance matrix"
-    # In this case, the headers are symmetric
-    headers = {}
-    headers[LD_HEADERS_HOR] = header
-    headers[LD_HEADERS_VER] = header
+    # Distance matrix are symmetric, parse only the upper triangle
+    header, dist_mat = parse_distmat_to_condensed(dm_lines)
+    return get_data_make_html(header, CondensedMatrix(len(header), dist_mat))
 
-    result[LD_HEADERS] = headers
-    result[LD_MATRIX] = dist_mat
-    result[LD_TRANSFORM_VALUES] = generate_trans_values_dict(dist_mat)
-    result[LD_TABLE_TITLE] = "Distance matrix"
+def generate_data_make_html_from_fp(dm_fp, dtype='float64'):
+    """Generates a dictionary from the distance matrix file with the plot info
 
-    return result
+    Inputs:
+        dm_fp: distance matrix filepath
+        dtype: data type of the distance matrix values (see
+            distance_matrix_cache.DM_DTYPES)
 
-def make_distance_matrix_heatmap(dm_lines, mapping_lines, html_fp, output_dir):
+    Returns the dict described in generate_data_make_html. The values are
+        memory-mapped from the binary file written next to dm_fp the first
+        time it is used (see distance_matrix_cache.load_distmat).
+    """
+    header, dist_mat = load_distmat(dm_fp, dtype)
+    return get_data_make_html(header, dist_mat)
+
+def make_distance_matrix_heatmap(dm_lines, mapping_lines, html_fp, output_dir,
+    scalable=False, image_formats=DEFAULT_IMAGE_FORMATS, tiled=False,
+    dtype='float64'):
     """Create an html with a heatmap of the distance matrix
 
     Inputs:
-        dm_lines: distance matrix open file object
+        dm_lines: distance matrix open file object, or the distance matrix
+            filepath to load it through its binary file (see
+            generate_data_make_html_from_fp)
         mapping_lines: mapping open file object
         html_fp: filepath of the output html file
         output_dir: path of the output directory which will contain the aux
             html files
+        scalable: if True, use the client-side image map of heatmap_map.js
+        image_formats: list of formats of the heatmap images (see
+            make_heatmap.IMAGE_FORMATS). Must contain 'png'
+        tiled: if True, the heatmap is stored as a pyramid of tiles browsed
+            with heatmap_tiles.js, instead of a single image. Use it for
+            very large distance matrices. 'scalable' and 'image_formats' are
+            ignored in this mode
+        dtype: data type of the distance matrix values when dm_lines is a
+            filepath
     """
     # Parse input files
-    data = generate_data_make_html(dm_lines)
+    if isinstance(dm_lines, basestring):
+        data = generate_data_make_html_from_fp(dm_lines, dtype)
+    else:
+        data = generate_data_make_html(dm_lines)
     mapping_data = parse_mapping_file_to_dict(mapping_lines)
     # Create the html file
-    make_html_file([data], mapping_data, html_fp, output_dir)
\ No newline at end of file
+    if tiled:
+        make_tiled_heatmap(data[LD_NAME], data[LD_HEADERS], data[LD_MATRIX],
+            data[LD_TRANSFORM_VALUES], mapping_data, data[LD_TABLE_TITLE],
+            html_fp, output_dir)
+    else:
+        make_html_file([data], mapping_data, html_fp, output_dir, scalable,
+            image_formats)
\ No newline at end of file
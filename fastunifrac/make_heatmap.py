@@ -10,14 +10,61 @@ __email__ = "josenavasmolina@gmail.com"
 __status__ = "Development"
 
 from numpy import flipud
-from matplotlib.pylab import *
-from commands import getoutput
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.cm import get_cmap
+from numpy import array, searchsorted, isnan, inf
+from numpy.ma import masked_array
+from bisect import bisect_left
+from gzip import GzipFile
+from io import BytesIO
+from threading import Thread
 import os
+from fastunifrac.condensed_matrix import CondensedMatrix
 
 #Keywords for headers dict
 HEADERS_VER = 'vertical'
 HEADERS_HOR = 'horizontal'
 
+# Resolution of the heatmap figures (the html image maps depend on it)
+HEATMAP_DPI = 80
+
+# Image formats written by default: the png for the html page and the
+# compressed eps for downloading
+DEFAULT_IMAGE_FORMATS = ['png', 'eps.gz']
+# Image formats which can be written. Any of them but 'png' can be
+# compressed by adding the GZIP_SUFFIX
+IMAGE_FORMATS = ['png', 'eps', 'svg', 'pdf']
+GZIP_SUFFIX = '.gz'
+# Compression level of the gzipped images (the gzip command line default)
+GZIP_COMPRESS_LEVEL = 6
+
+def split_image_format(image_format):
+    """Splits an image format in its matplotlib format and compression
+
+    Inputs:
+        image_format: one of IMAGE_FORMATS, optionally followed by GZIP_SUFFIX
+
+    Returns:
+        the matplotlib format
+        True if the image must be gzipped, False otherwise
+
+    Note: raises a ValueError if the format is not supported
+    """
+    gzipped = image_format.endswith(GZIP_SUFFIX)
+    fmt = image_format[:-len(GZIP_SUFFIX)] if gzipped else image_format
+    if fmt not in IMAGE_FORMATS or (gzipped and fmt == 'png'):
+        raise ValueError, "Image format not supported: %s" % image_format
+    return fmt, gzipped
+
+def write_gzip_file(fp, data):
+    """Writes the string 'data' gzipped to the file 'fp'"""
+    out = GzipFile(fp, 'wb', GZIP_COMPRESS_LEVEL)
+    try:
+        out.write(data)
+    finally:
+        out.close()
+
 def get_info_from_dict(trans_values):
     """Get plotting information from the translation dictionary
 
@@ -75,6 +122,135 @@ def get_matrix_value(value, trans_values):
             if val1 < value and value <= val2:
                 return trans_values[(val1, val2)][0]
 
+class IntervalClassifier(object):
+    """Classifies values in the intervals of a translation dictionary
+
+    The intervals are sorted and validated once, so every lookup is a binary
+    search instead of a scan of all the dictionary keys. Single values are
+    classified with __call__ and whole matrices with 'classify'.
+    """
+
+    def __init__(self, trans_values):
+        """Builds the classifier
+
+        Inputs:
+            trans_values: dict of: {(val1, val2): (plot_value, label)}
+                Is a dictionary which allows to transform the continue matrix
+                values into a discrete values. The intervals are (val1, val2],
+                where a None val1 (val2) means no lower (upper) bound. The key
+                (None, None) gives the value used for None values.
+
+        Note: raises a ValueError if the intervals overlap. The intervals may
+            leave gaps between them: as with get_matrix_value, the values in
+            a gap do not belong to any interval. Empty intervals
+            (val1 == val2) are ignored, as they can never be matched.
+        """
+        intervals = []
+        for (val1, val2), (plot_value, label) in trans_values.iteritems():
+            if val1 is None and val2 is None:
+                continue
+            lower = -inf if val1 is None else val1
+            upper = inf if val2 is None else val2
+            if lower < upper:
+                intervals.append((lower, upper, plot_value))
+        intervals.sort()
+
+        for (l1, u1, v1), (l2, u2, v2) in zip(intervals[:-1], intervals[1:]):
+            if u1 > l2:
+                raise ValueError, "Intervals (%s, %s] and (%s, %s] overlap" % \
+                    (l1, u1, l2, u2)
+
+        self.lower = [i[0] for i in intervals]
+        self.upper = [i[1] for i in intervals]
+        self.plot_values = [i[2] for i in intervals]
+        self.none_value = trans_values[(None, None)][0] \
+            if (None, None) in trans_values else None
+        # Arrays for the bulk lookups: the None value goes at the end
+        self._lower_array = array(self.lower, dtype=float)
+        self._upper_array = array(self.upper, dtype=float)
+        self._plot_values_array = array(self.plot_values + [self.none_value])
+
+    def __call__(self, value):
+        """Returns the plot value of the interval which contains 'value'
+
+        Returns the value of the (None, None) key if 'value' is None, and None
+            if 'value' does not belong to any interval.
+        """
+        if value is None:
+            return self.none_value
+        i = bisect_left(self.upper, value)
+        if i == len(self.upper) or not self.lower[i] < value:
+            return None
+        return self.plot_values[i]
+
+    def classify_indices(self, matrix):
+        """Returns the index of the plot value of all the values in 'matrix'
+
+        Inputs:
+            matrix: list of lists (or array) containing the float values to
+                classify. None (or NaN) values get the (None, None) value
+
+        Returns an int array with the position in 'plot_values' of the plot
+            value of each value. None (or NaN) values get len(plot_values),
+            and the values which do not belong to any interval get -1.
+        """
+        values = array(matrix, dtype=float)
+        none_values = isnan(values)
+        # Avoid comparisons with NaN, None values are not matched anyway
+        values[none_values] = inf
+        n_intervals = len(self.upper)
+        # Index of the first interval whose upper bound is >= value
+        bins = searchsorted(self._upper_array, values, side='left')
+        # The value still has to be inside the interval, as there are no
+        # intervals below the first one or above the last one
+        matched = bins < n_intervals
+        bins[~matched] = 0
+        if n_intervals:
+            matched &= (self._lower_array[bins] < values)
+        bins[~matched] = -1
+        bins[none_values] = n_intervals
+        return bins
+
+    def classify(self, matrix):
+        """Returns the plot values of all the values in 'matrix'
+
+        Inputs:
+            matrix: list of lists (or array) containing the float values to
+                classify. None (or NaN) values get the (None, None) value
+
+        Returns a masked array containing the plot values. The values which
+            do not belong to any interval are masked.
+        """
+        bins = self.classify_indices(matrix)
+        unmatched = bins < 0
+        bins[unmatched] = 0
+        return masked_array(self._plot_values_array[bins], mask=unmatched)
+
+def make_plot_array(matrix, trans_values):
+    """Get the plot values array of the matrix values
+
+    Inputs:
+        matrix: list of lists (or array) containing the float values to plot.
+            None (or NaN) values are transformed using the (None, None) key.
+            It can also be a CondensedMatrix, whose diagonal and lower
+            triangle are transformed as None values
+        trans_values: dict of: {(val1, val2): (plot_value, label)}
+            must have a key of form (None, None) used for asign value to None
+            values. Is a dictionary which allows to transform the continue
+            matrix values into a discrete values to plot.
+
+    Returns a masked array containing the discrete values to plot after apply
+        'trans_values' to 'matrix'. The values which do not belong to any
+        interval of 'trans_values' are masked.
+    """
+    classifier = IntervalClassifier(trans_values)
+    if isinstance(matrix, CondensedMatrix):
+        # Only the condensed values are classified, the full 2D array is
+        # built with the plot values
+        return matrix.expand(classifier.classify(matrix.values),
+            classifier.none_value)
+    return classifier.classify(matrix)
+
 def make_plot_data(matrix, trans_values):
     """Get the plot values matrix of the matrix values
 
@@ -88,17 +264,201 @@ def make_plot_data(matrix, trans_values):
     Returns: list of lists containing the discrete values to plot after apply
         'trans_values' to 'matrix'
     """
-    result = []
-    # Loop through all the matrix values and construct the new matrix
-    for row in matrix:
-        new_row = []
-        for elem in row:
-            new_row.append(get_matrix_value(elem, trans_values))
-        result.append(new_row)
+    return make_plot_array(matrix, trans_values).tolist()
+
+def get_figure_size(headers):
+    """Get the size in inches of the heatmap figure
+
+    Inputs:
+        headers: dict of: {HEADERS_VER:[], HEADERS_HOR:[]}
+
+    Returns:
+        width: figure width
+        height: figure height
+    """
+    width = (len(headers[HEADERS_HOR]) + 2) / 3 if \
+                len(headers[HEADERS_HOR]) > 10 else 10
+    height = (len(headers[HEADERS_VER]) + 2) / 3 if \
+                len(headers[HEADERS_VER]) > 10 else 10
+    return width, height
+
+class HeatmapRenderer(object):
+    """Draws heatmaps on explicitly created matplotlib figures
+
+    The figures are created with an Agg canvas, without the pylab state
+        machine, so they are not registered anywhere else and are released
+        as soon as the renderer drops them. The renderer keeps one figure per
+        figure size: a heatmap with the same size reuses the figure, and if it
+        also has the same headers and translation dictionary (as the raw and
+        corrected values of a significance test) only the image data is
+        replaced.
+    """
+
+    def __init__(self, max_figures=2):
+        """Builds the renderer
+
+        Inputs:
+            max_figures: maximum number of figures kept for reuse. When a new
+                figure size is needed, the least recently used one is released
+        """
+        self.max_figures = max_figures
+        # List of [size, figure, canvas, template key, image]
+        self._figures = []
+        # Threads compressing the images and errors raised by them
+        self._threads = []
+        self._errors = []
+
+    def _get_figure(self, size):
+        """Returns the cached entry for the figure size 'size'"""
+        for i, entry in enumerate(self._figures):
+            if entry[0] == size:
+                # Mark it as the most recently used
+                self._figures.append(self._figures.pop(i))
+                return entry
+        fig = Figure(figsize=size, dpi=HEATMAP_DPI)
+        entry = [size, fig, FigureCanvasAgg(fig), None, None]
+        self._figures.append(entry)
+        while len(self._figures) > self.max_figures:
+            self._release(self._figures.pop(0))
+        return entry
+
+    def _release(self, entry):
+        """Releases the figure of a cached entry"""
+        entry[1].clf()
+        entry[3] = entry[4] = None
+
+    def render(self, headers, matrix, trans_values):
+        """Draws the heatmap of the values in matrix
 
-    return result
+        Inputs:
+            headers: dict of: {HEADERS_VER:[], HEADERS_HOR:[]}
+            matrix: list of lists containing the float values to plot
+            trans_values: dict of: {(val1, val2): (plot_value, label)}
+                must have a key of form (None, None) used for asign value to
+                None values. Is a dictionary which allows to transform the
+                continue matrix values into a discrete values to plot.
 
-def plot_heatmap(plot_name, headers, matrix, trans_values, output_dir):
+        Returns:
+            width: figure width
+            height: figure height
+            canvas: FigureCanvasAgg with the heatmap
+            plot: heatmap plot
+
+        The returned figure is only valid until the next call to render with
+            the same figure size.
+        """
+        width, height = get_figure_size(headers)
+        entry = self._get_figure((width, height))
+        size, fig, canvas, template_key, plot = entry
+        # Get the plot values from the matrix
+        plot_data = make_plot_array(matrix, trans_values)
+
+        key = (tuple(headers[HEADERS_HOR]), tuple(headers[HEADERS_VER]),
+            tuple(sorted(trans_values.items())))
+        if key == template_key:
+            # Same axes, ticks and colorbar: only the image changes. The
+            # color limits are scaled to the new data, as imshow does
+            plot.set_data(plot_data)
+            plot.autoscale()
+            return width, height, canvas, plot
+
+        fig.clf()
+        n_values, boundaries, ticks, ticklabels = \
+            get_info_from_dict(trans_values)
+        # Only want a colormap with 'n_values' values in the look up table
+        my_cmap = get_cmap('spectral', n_values)
+        ax = fig.add_subplot(111)
+        # Plot data
+        plot = ax.imshow(plot_data, interpolation='nearest', cmap=my_cmap)
+        # Put x tick marks on top for showing labels on top
+        ax.xaxis.set_ticks_position('top')
+        # Turn off tick marks
+        ax.xaxis.set_ticks_position('none')
+        ax.yaxis.set_ticks_position('none')
+        #Add ticklabels to axes
+        ax.set_xticks(range(len(headers[HEADERS_HOR])))
+        ax.set_xticklabels(headers[HEADERS_HOR], rotation=90)
+        ax.set_yticks(range(len(headers[HEADERS_VER])))
+        ax.set_yticklabels(headers[HEADERS_VER])
+        #Add the colorbar
+        cb = fig.colorbar(plot, ax=ax, boundaries=boundaries, ticks=ticks,
+            orientation='horizontal')
+        cb.set_ticklabels(ticklabels)
+
+        entry[3] = key
+        entry[4] = plot
+        return width, height, canvas, plot
+
+    def _compress(self, fp, data):
+        """Writes the gzipped image, keeping the error to raise it in wait"""
+        try:
+            write_gzip_file(fp, data)
+        except Exception, e:
+            self._errors.append(e)
+
+    def save(self, canvas, plot_name, output_dir,
+        image_formats=DEFAULT_IMAGE_FORMATS):
+        """Saves the heatmap drawn in canvas in the given formats
+
+        Inputs:
+            canvas: FigureCanvasAgg returned by render
+            plot_name: plot name used for name the files
+            output_dir: output directory where to place the images
+            image_formats: list of image formats. The images are saved as
+                plot_name.format
+
+        The png image is written from a single Agg draw at the figure
+            resolution. The vector formats are written by their own backend
+            to memory, and the gzipped ones are compressed and written to disk
+            in a background thread while the next image is drawn. Call wait to
+            make sure all the images are on disk.
+        """
+        formats = [split_image_format(f) for f in image_formats]
+        for image_format, (fmt, gzipped) in zip(image_formats, formats):
+            image_fp = os.path.join(output_dir, plot_name + '.' + image_format)
+            # The vector formats use the default resolution for the embedded
+            # heatmap image
+            dpi = HEATMAP_DPI if fmt == 'png' else None
+            if not gzipped:
+                canvas.print_figure(image_fp, dpi=dpi, format=fmt)
+                continue
+            data = BytesIO()
+            canvas.print_figure(data, dpi=dpi, format=fmt)
+            thread = Thread(target=self._compress,
+                args=(image_fp, data.getvalue()))
+            thread.start()
+            self._threads.append(thread)
+
+    def wait(self):
+        """Waits until all the images are written
+
+        Note: raises the first error found while writing the gzipped images
+        """
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self._errors:
+            error = self._errors[0]
+            self._errors = []
+            raise error
+
+    def close(self):
+        """Waits for the pending images and releases all the figures"""
+        try:
+            self.wait()
+        finally:
+            for entry in self._figures:
+                self._release(entry)
+            self._figures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def plot_heatmap(plot_name, headers, matrix, trans_values, output_dir,
+    renderer=None, image_formats=DEFAULT_IMAGE_FORMATS):
     """Creates the heatmap figure for the values in matrix
 
     Inputs:
@@ -110,56 +470,29 @@ def plot_heatmap(plot_name, headers, matrix, trans_values, output_dir):
             values. Is a dictionary which allows to transform the continue
             matrix values into a discrete values to plot.
         output_dir: output directory where to place the images
+        renderer: HeatmapRenderer used to draw the heatmap. If None, a new
+            one is used. Otherwise, the gzipped images may still be being
+            written when this function returns (see HeatmapRenderer.wait)
+        image_formats: list of formats of the images (see IMAGE_FORMATS)
 
     Returns:
         width: figure width
         height: figure height
-        headers: input headers with some modifications applied
-            (Concretely: headers['HEADERS_VER'] is reversed)
-        matrix: input matrix with some modifications applied
-            (Concretely: matrix is fliped up to down)
         plot: heatmap plot
 
-    Creates a heatmap and save it as plot_name.png and plot_name.eps.gz
-        in the given directory 'output_dir'.
+    Creates a heatmap and save it as plot_name.png and plot_name.eps.gz (or
+        the formats listed in 'image_formats') in the given directory
+        'output_dir'.
     
     Code adapted from Dan Knights' code in make_otu_heatmap.py
     """
-    # Get figure size
-    n_values, boundaries, ticks, ticklabels = get_info_from_dict(trans_values)
-    width = (len(headers[HEADERS_HOR]) + 2) / 3 if \
-                len(headers[HEADERS_HOR]) > 10 else 10
-    height = (len(headers[HEADERS_VER]) + 2) / 3 if \
-                len(headers[HEADERS_VER]) > 10 else 10
-    fig = figure(figsize=(width, height))
-
-    # Only want a colormap with 'n_values' values in the look up table
-    my_cmap = get_cmap('spectral', n_values)
-    # Get the plot values from the matrix
-    plot_data = make_plot_data(matrix, trans_values)
-    # Plot data
-    plot = imshow(plot_data, interpolation='nearest', cmap=my_cmap)
-    ax = fig.axes[0]
-    # Put x tick marks on top for showing labels on top
-    ax.xaxis.set_ticks_position('top')
-    # Turn off tick marks
-    ax.xaxis.set_ticks_position('none')
-    ax.yaxis.set_ticks_position('none')
-    #Add ticklabels to axes
-    xticks(arange(len(headers[HEADERS_HOR])), headers[HEADERS_HOR])
-    yticks(arange(len(headers[HEADERS_VER])), headers[HEADERS_VER])
-    #Rotate x ticklabels
-    for label in ax.xaxis.get_ticklabels():
-        label.set_rotation(90)
-    #grab the Colorbar instance
-    cb = colorbar(boundaries=boundaries, ticks=ticks, orientation='horizontal')
-    cb.set_ticklabels(ticklabels)
-    #save figure as '.png' format file
-    heatmap_fp = os.path.join(output_dir, plot_name + '.png')
-    savefig(heatmap_fp, dpi=80, format='png')
-    #save figure as '.eps.gz' format file
-    eps_fp = os.path.join(output_dir, plot_name + '.eps.gz')
-    savefig(eps_fp, format='eps')
-    out = getoutput("gzip -f" + eps_fp)
+    own_renderer = renderer is None
+    if own_renderer:
+        renderer = HeatmapRenderer(max_figures=1)
+    width, height, canvas, plot = renderer.render(headers, matrix,
+        trans_values)
+    renderer.save(canvas, plot_name, output_dir, image_formats)
+    if own_renderer:
+        renderer.wait()
     # Return image size and the plot object
-    return width, height, plot
\ No newline at end of file
+    return width, height, plot
@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+
+__author__ = "Jose Antonio Navas Molina"
+__copyright__ = "Copyright 2013, The FastUniFrac Project"
+__credits__ = ["Jose Antonio Navas Molina"]
+__license__ = "GPL"
+__version__ = "1.7.0-dev"
+__maintainer__ = "Jose Antonio Navas Molina"
+__email__ = "josenavasmolina@gmail.com"
+__status__ = "Development"
+
+from os import mkdir
+from os.path import join, dirname, exists
+from shutil import copyfile
+from json import dumps
+from numpy import (array, arange, isnan, unique, searchsorted, zeros, uint8,
+    int16, ndarray)
+from numpy.ma import getmaskarray
+from matplotlib.cm import get_cmap
+from matplotlib.colors import rgb2hex
+from matplotlib.image import imsave
+from fastunifrac.make_heatmap import (IntervalClassifier, get_info_from_dict,
+    HEADERS_VER, HEADERS_HOR)
+from fastunifrac.html_writer import write_template, render_to_file
+from fastunifrac.condensed_matrix import CondensedMatrix
+
+# Size in pixels of the (square) tiles
+TILE_SIZE = 256
+# Maximum size in pixels of a cell at the deepest zoom level
+MAX_CELL_PIXELS = 8
+# Suffix of the directory which contains the tiles of a heatmap
+TILES_DIR_SUFFIX = '_tiles'
+# Directory (inside the tiles directory) which contains the cell values
+VALUES_DIR = 'values'
+# Number of matrix rows stored in each file of cell values
+VALUE_BLOCK_ROWS = 32
+# heatmap_tiles.js path (tile viewer)
+HEATMAP_TILES_JS = "support_files/heatmap_tiles.js"
+# overlib.js path
+OVERLIB_JS = "support_files/overlib.js"
+
+# HTML strings
+TILES_DATA_SRC = """heatmapTilesRegister(%s);\n"""
+VALUES_DATA_SRC = """heatmapTilesValues(%d, %s);\n"""
+
+LEGEND_ROW_HTML = """<tr><td style="background-color:%s;">&nbsp;&nbsp;&nbsp;&nbsp;</td><td class="normal">%s</td></tr>\n"""
+
+TILES_PAGE_HTML = """
+<html>
+<head>
+<style type="text/css">
+.normal { color: black; font-family:Arial,Verdana; font-size:12; font-weight:normal;}
+.header { color: white; font-family:Arial,Verdana; font-size:12; font-weight:bold; background-color:#2C3143;}
+#tiles_viewport { width:800px; height:800px; overflow:auto; border:1px solid #2C3143;}
+#tiles_canvas { position:relative; background-repeat:no-repeat;}
+#tiles_canvas img { position:absolute;}
+</style>
+<script type="text/javascript" src="overlib.js"></script>
+<script type="text/javascript" src="heatmap_tiles.js"></script>
+<script type="text/javascript" src="%s"></script>
+<title>Fastunifrac</title>
+</head>
+<body onload="heatmapTilesInit();">
+<div id="overDiv" style="position:absolute; visibility:hidden; z-index:1000;"></div>
+<table cellpading=0 cellspacing=0 border=1>
+<tr><th align=center colspan=2 border=0 class="header">%s</th></tr>
+<tr>
+<td class="normal" align=center border=0>
+<input type="button" value="Zoom out" onclick="heatmapTilesZoom(-1);" />
+<input type="button" value="Zoom in" onclick="heatmapTilesZoom(1);" />
+<span id="tiles_level"></span>
+<div id="tiles_viewport"><div id="tiles_canvas"></div></div>
+</td>
+<td class="normal" valign=top border=0>
+<table cellpadding=2 cellspacing=2 border=0>
+%s</table>
+</td>
+</tr>
+</table>
+</body>
+</html>
+"""
+
+def get_num_levels(n_cells, tile_size=TILE_SIZE,
+    max_cell_pixels=MAX_CELL_PIXELS):
+    """Get the number of zoom levels of the tile pyramid
+
+    Inputs:
+        n_cells: number of cells of the longest side of the matrix
+        tile_size: size in pixels of the tiles
+        max_cell_pixels: maximum size in pixels of a cell
+
+    Returns the number of levels. The level z is tile_size * 2**z pixels
+        wide, so the level 0 (the overview) fits in a single tile and the
+        deepest level is the first one whose cells are at least
+        max_cell_pixels / 2 pixels wide.
+    """
+    levels = 1
+    while tile_size * 2 ** (levels - 1) * 2 <= n_cells * max_cell_pixels:
+        levels += 1
+    return levels
+
+def get_color_codes(matrix, trans_values):
+    """Get the colors of the heatmap and the color code of each cell
+
+    Inputs:
+        matrix: list of lists (or array) containing the float values to plot.
+            None (or NaN) values are not drawn. It can also be a
+            CondensedMatrix, whose diagonal and lower triangle are not drawn
+        trans_values: dict of: {(val1, val2): (plot_value, label)}
+            must have a key of form (None, None)
+
+    Returns:
+        codes: int16 array with the index in 'colors' of each cell
+        colors: uint8 array of RGBA colors. The last one is transparent and is
+            used for the None values and the values out of the intervals
+
+    The colors are the ones used by plot_heatmap when all the plot values are
+        present in the matrix.
+    """
+    n_values = len(trans_values)
+    classifier = IntervalClassifier(trans_values)
+    # Position of each plot value in the sorted list of plot values
+    plot_values = unique([plot_value for plot_value, label in
+        trans_values.itervalues()])
+
+    def get_codes(values):
+        values = array(values, dtype=float)
+        plot_array = classifier.classify(values)
+        codes = searchsorted(plot_values, plot_array.filled(plot_values[0]))
+        codes = codes.astype(int16)
+        codes[getmaskarray(plot_array) | isnan(values)] = len(plot_values)
+        return codes
+
+    if isinstance(matrix, CondensedMatrix):
+        # The values are classified in blocks of rows and only the codes are
+        # expanded to the full matrix
+        codes = matrix.expand_blocks(get_codes, len(plot_values), int16)
+    else:
+        codes = get_codes(matrix)
+
+    cmap = get_cmap('spectral', n_values)
+    colors = zeros((len(plot_values) + 1, 4), dtype=uint8)
+    span = float(plot_values[-1] - plot_values[0]) or 1.0
+    for i, plot_value in enumerate(plot_values):
+        rgba = cmap((plot_value - plot_values[0]) / span)
+        colors[i] = [int(round(c * 255)) for c in rgba]
+    return codes, colors
+
+def get_pixel_cells(start, stop, level_size, n_cells):
+    """Get the cell shown by each pixel of a level
+
+    Inputs:
+        start, stop: range of pixels
+        level_size: size in pixels of the level
+        n_cells: number of cells of the longest side of the matrix
+
+    Returns an array with the cell index of each pixel in [start, stop)
+    """
+    return arange(start, stop) * n_cells // level_size
+
+def render_tile(codes, colors, level_size, tile_row, tile_col,
+    tile_size=TILE_SIZE):
+    """Renders a tile of the heatmap
+
+    Inputs:
+        codes: array with the color code of each cell (see get_color_codes)
+        colors: array of RGBA colors
+        level_size: size in pixels of the level of the tile
+        tile_row, tile_col: position of the tile in the level
+        tile_size: size in pixels of the tiles
+
+    Returns a uint8 RGBA array with the tile image, or None if the tile does
+        not show any value. The tiles in the border of the level are
+        cropped to the size of the heatmap.
+    """
+    n_rows, n_cols = codes.shape
+    n_cells = max(n_rows, n_cols)
+    height = -(-n_rows * level_size // n_cells)
+    width = -(-n_cols * level_size // n_cells)
+    y0 = tile_row * tile_size
+    x0 = tile_col * tile_size
+    rows = get_pixel_cells(y0, min(y0 + tile_size, height), level_size, n_cells)
+    cols = get_pixel_cells(x0, min(x0 + tile_size, width), level_size, n_cells)
+    tile_codes = codes[rows[:, None], cols[None, :]]
+    if (tile_codes == len(colors) - 1).all():
+        return None
+    return colors[tile_codes]
+
+def write_tiles(codes, colors, tiles_dir, tile_size=TILE_SIZE,
+    max_cell_pixels=MAX_CELL_PIXELS):
+    """Writes the tile pyramid of a heatmap
+
+    Inputs:
+        codes: array with the color code of each cell (see get_color_codes)
+        colors: array of RGBA colors
+        tiles_dir: directory where the tiles are written, as
+            tiles_dir/level/row_col.png
+        tile_size: size in pixels of the tiles
+        max_cell_pixels: maximum size in pixels of a cell
+
+    Returns the number of levels. The tiles which do not show any value are
+        not written.
+    """
+    n_rows, n_cols = codes.shape
+    n_cells = max(n_rows, n_cols)
+    levels = get_num_levels(n_cells, tile_size, max_cell_pixels)
+    for level in range(levels):
+        level_dir = join(tiles_dir, str(level))
+        if not exists(level_dir):
+            mkdir(level_dir)
+        level_size = tile_size * 2 ** level
+        height = -(-n_rows * level_size // n_cells)
+        width = -(-n_cols * level_size // n_cells)
+        for tile_row in range(-(-height // tile_size)):
+            for tile_col in range(-(-width // tile_size)):
+                tile = render_tile(codes, colors, level_size, tile_row,
+                    tile_col, tile_size)
+                if tile is not None:
+                    imsave(join(level_dir, "%d_%d.png" % (tile_row,
+                        tile_col)), tile)
+    return levels
+
+def get_json_values(values):
+    """Returns the list of values with None in place of the NaN values
+
+    Inputs:
+        values: list (or list of lists, or array) of float values or None
+    """
+    result = []
+    for value in values:
+        if isinstance(value, (list, tuple, ndarray)):
+            result.append(get_json_values(value))
+        elif value is None or isnan(value):
+            result.append(None)
+        else:
+            result.append(float(value))
+    return result
+
+def write_value_blocks(matrix, tiles_dir, block_rows=VALUE_BLOCK_ROWS):
+    """Writes the cell values of a heatmap in blocks of rows
+
+    Inputs:
+        matrix: list of lists (or array) containing the float values to plot,
+            or a CondensedMatrix
+        tiles_dir: directory where the values are written, as
+            tiles_dir/values/block.js
+        block_rows: number of rows of each block
+
+    Each file registers the values of the rows in
+        [block * block_rows, (block + 1) * block_rows) with heatmapTilesValues.
+        The values of a CondensedMatrix are stored as the slice of its
+        condensed vector for those rows, so the diagonal and the lower triangle
+        are not stored. The tile viewer only loads the blocks of the rows
+        under the mouse, so the page stays small for big matrices.
+    """
+    values_dir = join(tiles_dir, VALUES_DIR)
+    if not exists(values_dir):
+        mkdir(values_dir)
+    if isinstance(matrix, CondensedMatrix):
+        blocks = (values for start_row, stop_row, values in
+            matrix.iter_row_blocks(block_rows))
+    else:
+        blocks = (matrix[start_row:start_row + block_rows]
+            for start_row in range(0, len(matrix), block_rows))
+    for block, values in enumerate(blocks):
+        out = open(join(values_dir, "%d.js" % block), 'w')
+        out.write(VALUES_DATA_SRC % (block, dumps(get_json_values(values),
+            separators=(',', ':'))))
+        out.close()
+
+def make_tiled_heatmap(plot_name, headers, matrix, trans_values, mapping_data,
+    table_title, html_fp, output_dir, tile_size=TILE_SIZE,
+    max_cell_pixels=MAX_CELL_PIXELS):
+    """Creates a tiled heatmap and the html page to browse it
+
+    Inputs:
+        plot_name: plot name used for name the files
+        headers: dict of: {HEADERS_VER:[], HEADERS_HOR:[]}
+        matrix: list of lists containing the float values to plot, or a
+            CondensedMatrix
+        trans_values: dict of: {(val1, val2): (plot_value, label)}
+            must have a key of form (None, None)
+        mapping_data: dictionary with the mapping file information
+        table_title: title shown in the html page
+        html_fp: file path where the html file will be created
+        output_dir: output directory where the tiles and scripts will be saved
+        tile_size: size in pixels of the tiles
+        max_cell_pixels: maximum size in pixels of a cell
+
+    The heatmap is stored as a pyramid of fixed-size tiles in
+        output_dir/plot_name_tiles, where the level 0 is a downsampled
+        overview of the whole matrix. The html page only loads the tiles
+        visible at the current zoom level, and the cell values of the rows
+        under the mouse (see write_value_blocks), so very large matrices can
+        be browsed.
+    """
+    codes, colors = get_color_codes(matrix, trans_values)
+    tiles_name = plot_name + TILES_DIR_SUFFIX
+    tiles_dir = join(output_dir, tiles_name)
+    if not exists(tiles_dir):
+        mkdir(tiles_dir)
+    levels = write_tiles(codes, colors, tiles_dir, tile_size, max_cell_pixels)
+    write_value_blocks(matrix, tiles_dir)
+
+    n_values, boundaries, ticks, ticklabels = get_info_from_dict(trans_values)
+    legend = [(rgb2hex(color[:3] / 255.0), label.replace('\n', ' '))
+        for color, label in zip(colors[1:-1], ticklabels)]
+    samples = set(headers[HEADERS_VER]) | set(headers[HEADERS_HOR])
+    tiles_data = {
+        'path': tiles_name + '/',
+        'tile_size': tile_size,
+        'levels': levels,
+        'n_rows': codes.shape[0],
+        'n_cols': codes.shape[1],
+        'background': rgb2hex(colors[0][:3] / 255.0),
+        'block_rows': VALUE_BLOCK_ROWS,
+        'condensed': isinstance(matrix, CondensedMatrix),
+        'ver': headers[HEADERS_VER],
+        'hor': headers[HEADERS_HOR],
+        'desc': dict([(sample, mapping_data[0][sample]['Description'])
+            for sample in samples])
+    }
+    tiles_data_name = join(tiles_name, 'tiles.js')
+    out = open(join(output_dir, tiles_data_name), 'w')
+    out.write(TILES_DATA_SRC % dumps(tiles_data, separators=(',', ':')))
+    out.close()
+
+    render_to_file(write_template, html_fp, TILES_PAGE_HTML, tiles_data_name,
+        table_title, [LEGEND_ROW_HTML % row for row in legend])
+    for js in [OVERLIB_JS, HEATMAP_TILES_JS]:
+        copyfile(join(dirname(__file__), js), join(output_dir,
+            js.split('/')[-1]))
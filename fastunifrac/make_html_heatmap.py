@@ -9,12 +9,22 @@ __maintainer__ = "Jose Antonio Navas Molina"
 __email__ = "josenavasmolina@gmail.com"
 __status__ = "Development"
 
-from make_heatmap import plot_heatmap, HEADERS_VER, HEADERS_HOR
+from make_heatmap import (plot_heatmap, HeatmapRenderer, HEADERS_VER,
+    HEADERS_HOR, DEFAULT_IMAGE_FORMATS)
+from html_writer import write_template, render_to_string, render_to_file
 from shutil import copyfile
 from os.path import join, dirname
+from json import dumps
+from multiprocessing import Pool
+from numpy import array, isnan, ndarray
+from condensed_matrix import CondensedMatrix
 
 # overlib.js path
 OVERLIB_JS = "support_files/overlib.js"
+# heatmap_map.js path (client-side image map used by the scalable mode)
+HEATMAP_MAP_JS = "support_files/heatmap_map.js"
+# Suffix of the data files read by heatmap_map.js
+MAP_DATA_SUFFIX = '_map.js'
 
 # Keywords for dicts in 'list_data'
 LD_NAME = 'name'
@@ -27,6 +37,8 @@ LD_TABLE_TITLE = 'table_title'
 
 # HTML strings
 # (adapted from Jesse Stombaugh and Micah Hamady's code in make_2d_plots.py)
+CELL_DESC = "<b>%s vs %s:</b> %s<br><br><i>%s:</i> %s<br><br><i>%s:</i> %s"
+
 AREA_SRC = """<AREA shape="circle" coords="%d,%d,%d" href="#%s"  onmouseover="return overlib('%s');" onmouseout="return nd();">\n"""
 
 IMG_MAP_SRC = """<img src="%s" border="0" ismap usemap="#points%s" width="%d" height="%d" />\n"""
@@ -37,6 +49,12 @@ MAP_SRC = """
 </MAP>
 """
 
+IMG_SCALABLE_SRC = """<img src="%s" border="0" width="%d" height="%d" onmousemove="return heatmapOver(event, '%s');" onmouseout="return heatmapOut('%s');" />\n"""
+
+SCRIPT_SRC = """<script type="text/javascript" src="%s"></script>\n"""
+
+MAP_DATA_SRC = """heatmapRegister(%s, %s);\n"""
+
 DOWNLOAD_LINK = """<a href="%s" >%s</a>"""
 
 TABLE_HTML = """<table cellpading=0 cellspacing=0 border=1>
@@ -65,6 +83,67 @@ PAGE_HTML = """
 </html>
 """
 
+def get_cell_coords(headers, matrix, plot):
+    """Get XY plot coordinates of the heatmap cells with a value
+
+    Inputs:
+        headers: {LD_HEADERS_VER:[], LD_HEADERS_HOR:[]}
+        matrix: list of lists containing the float values plotted, a 2D array
+            with NaN in the cells without value or a CondensedMatrix
+        plot: heatmap source. Used to get the html coordinates of the map
+
+    Returns:
+        cells: ordered list of (i, j) with the column and row of the cells
+        all_xcoords: ordered list with all the map x coordinates
+        all_ycoords: ordered list with all the map y coordinates
+    """
+    # Collect the upper triangle cells
+    # Matplotlib interprets rows as columns, so the cells are stored as (i, j)
+    if isinstance(matrix, CondensedMatrix):
+        rows, cols = matrix.get_cells()
+        cells = zip(cols.tolist(), rows.tolist())
+    elif isinstance(matrix, ndarray):
+        rows, cols = (~isnan(matrix)).nonzero()
+        cells = zip(cols.tolist(), rows.tolist())
+    else:
+        cells = [(i, j) for j in range(len(headers[LD_HEADERS_VER]))
+            for i in range(len(headers[LD_HEADERS_HOR]))
+            if matrix[j][i] is not None]
+    if not cells:
+        return [], [], []
+    # Get the plot's tansform function
+    plot.set_transform(plot.axes.transData)
+    trans = plot.get_transform()
+    # Transform all the cells at once
+    coords = trans.transform(array(cells, dtype=float))
+    return cells, coords[:, 0].tolist(), coords[:, 1].tolist()
+
+def get_cell_descriptions(headers, matrix, mapping_data, cells):
+    """Get the map labels of the heatmap cells
+
+    Inputs:
+        headers: {LD_HEADERS_VER:[], LD_HEADERS_HOR:[]}
+        matrix: list of lists containing the float values plotted, a 2D array
+            with NaN in the cells without value or a CondensedMatrix
+        mapping_data: dictionary with the mapping file information
+        cells: list of (i, j) with the column and row of the cells
+
+    Returns the ordered list with the labels, which contain the value of the
+        cell and the descriptions of both samples
+    """
+    hor = headers[LD_HEADERS_HOR]
+    ver = headers[LD_HEADERS_VER]
+    descs = mapping_data[0]
+    if isinstance(matrix, CondensedMatrix):
+        values = [matrix.get_value(j, i) for i, j in cells]
+    elif isinstance(matrix, ndarray):
+        values = [matrix[j, i].item() for i, j in cells]
+    else:
+        values = [matrix[j][i] for i, j in cells]
+    return [CELL_DESC % (ver[j], hor[i], value, ver[j],
+        descs[ver[j]]['Description'], hor[i], descs[hor[i]]['Description'])
+        for (i, j), value in zip(cells, values)]
+
 def get_coords(headers, matrix, plot, mapping_data):
     """Get XY plot coordinates for showing labels
 
@@ -83,35 +162,27 @@ def get_coords(headers, matrix, plot, mapping_data):
 
     Adapted from Jesse Stombaugh and Micah Hamady's code in make_2d_plots.py
     """
-    all_cids = []
-    all_xcoords = []
-    all_ycoords = []
-    # Get the plot's tansform function
-    plot.set_transform(plot.axes.transData)
-    trans = plot.get_transform()
-    # Loop through the upper triangle cells
-    for j in range(len(headers[LD_HEADERS_VER])):
-        for i in range(len(headers[LD_HEADERS_HOR])):
-            if matrix[j][i] is not None:
-                # Matplotlib interprets rows as columns, so we flip i, j
-                icoord = trans.transform((i,j))
-                xcoord, ycoord = icoord
-                # Build the string with the descriptions of the samples
-                sampleID_1 = headers[LD_HEADERS_VER][j]
-                sampleID_2 = headers[LD_HEADERS_HOR][i]
-                str_desc = "<b>" + sampleID_1 + " vs " + sampleID_2 + \
-                    ":</b> " + str(matrix[j][i])
-                str_desc += "<br><br><i>" + sampleID_1 + ":</i> " + \
-                    mapping_data[0][sampleID_1]['Description']
-                str_desc += "<br><br><i>" + sampleID_2 + ":</i> " + \
-                    mapping_data[0][sampleID_2]['Description']
-                # Add current data to lists
-                all_cids.append(str_desc)
-                all_xcoords.append(xcoord)
-                all_ycoords.append(ycoord)
-
+    cells, all_xcoords, all_ycoords = get_cell_coords(headers, matrix, plot)
+    all_cids = get_cell_descriptions(headers, matrix, mapping_data, cells)
     return all_cids, all_xcoords, all_ycoords
 
+def build_xmap(img_height, headers, all_cids, all_xcoords, all_ycoords):
+    """Builds the AREA html tags for pop-up labels
+
+    Inputs:
+        img_height: image height
+        headers: {LD_HEADERS_VER:[], LD_HEADERS_HOR:[]}
+        all_cids: orderd list with all the map labels
+        all_xcoords: ordered list with all the map x coordinates
+        all_ycoords: ordered list with all the map y coordinates
+
+    Returns a list with AREA html string for the map
+    """
+    z = 6 if len(headers[HEADERS_HOR]) > 10 else 15
+    # Since all_cids, all_xcoords, all_ycoords are ordered lists we can zip them
+    return [AREA_SRC % (x, img_height - y, z, cid, cid)
+        for cid, x, y in zip(all_cids, all_xcoords, all_ycoords)]
+
 def generate_xmap(x_len, y_len, headers, matrix, plot, mapping_data):
     """Generates the AREA html tag for pop-up labels
 
@@ -140,17 +211,168 @@ def generate_xmap(x_len, y_len, headers, matrix, plot, mapping_data):
     img_height = x_len * 80
     img_width = y_len * 80
 
-    xmap = []
-    z = 6 if len(headers[HEADERS_HOR]) > 10 else 15
-    # Since all_cids, all_xcoords, all_ycoords are ordered lists we can zip them
-    for cid, x, y in zip(all_cids, all_xcoords, all_ycoords):
-        xmap.append(AREA_SRC % (x, img_height - y, z, cid, cid))
+    xmap = build_xmap(img_height, headers, all_cids, all_xcoords, all_ycoords)
 
     return xmap, img_height, img_width
 
-def get_html_table_string(data, mapping_data, output_dir):
-    """Creates an HTML table with the plot on it
+def get_cell_geometry(plot, img_height):
+    """Get the image coordinates of the heatmap cells
+
     Inputs:
+        plot: heatmap source. Used to get the html coordinates of the map
+        img_height: image height
+
+    Returns:
+        x0, y0: image coordinates of the center of the first cell
+        dx, dy: distance between the centers of two consecutive cells
+    """
+    plot.set_transform(plot.axes.transData)
+    (x0, y0), (x1, y1) = plot.get_transform().transform(
+        array([[0, 0], [1, 1]], dtype=float))
+    # The image y axis goes from top to bottom
+    return x0, img_height - y0, x1 - x0, y0 - y1
+
+def write_map_data_file(data, mapping_data, geometry, output_dir):
+    """Writes the data file used by the client-side image map
+
+    Inputs:
+        data: dict with the heatmap information (see write_html_table)
+        mapping_data: dictionary with the mapping file information
+        geometry: (x0, y0, dx, dy) as returned by get_cell_geometry
+        output_dir: output directory where the data file will be saved
+
+    Returns the name of the data file
+
+    The cell values and the sample descriptions are stored once in a JSON
+        object, so the size of the page does not grow with the number of
+        cells as the AREA tags of generate_xmap do. The values of a
+        CondensedMatrix are stored as its condensed vector.
+    """
+    headers = data[LD_HEADERS]
+    samples = set(headers[LD_HEADERS_VER]) | set(headers[LD_HEADERS_HOR])
+    x0, y0, dx, dy = geometry
+    map_data = {
+        'x0': x0, 'y0': y0, 'dx': dx, 'dy': dy,
+        'ver': headers[LD_HEADERS_VER],
+        'hor': headers[LD_HEADERS_HOR],
+        'desc': dict([(sample, mapping_data[0][sample]['Description'])
+            for sample in samples])
+    }
+    matrix = data[LD_MATRIX]
+    if isinstance(matrix, CondensedMatrix):
+        map_data['condensed'] = [None if isnan(value) else value
+            for value in matrix.values.tolist()]
+    elif isinstance(matrix, ndarray):
+        map_data['values'] = [[None if isnan(value) else value
+            for value in row] for row in matrix.tolist()]
+    else:
+        map_data['values'] = matrix
+    map_data_name = data[LD_NAME] + MAP_DATA_SUFFIX
+    out = open(join(output_dir, map_data_name), 'w')
+    out.write(MAP_DATA_SRC % (dumps(data[LD_NAME]),
+        dumps(map_data, separators=(',', ':'))))
+    out.close()
+    return map_data_name
+
+def render_heatmap(data, output_dir, renderer=None,
+    image_formats=DEFAULT_IMAGE_FORMATS, scalable=False):
+    """Creates the heatmap images and gets the positions of its cells
+
+    Inputs:
+        data: dict with the heatmap information (see write_html_table)
+        output_dir: output directory where the images will be saved
+        renderer: HeatmapRenderer used to draw the heatmap. If None, a new
+            one is used
+        image_formats: list of formats of the heatmap images. Must contain
+            'png', which is the one shown in the page
+        scalable: if True, only the cell geometry is computed, as the
+            client-side image map does not use the coordinates of each cell
+
+    Returns:
+        img_width: image width
+        img_height: image height
+        cells, all_xcoords, all_ycoords: as returned by get_cell_coords, or
+            None if 'scalable' is True
+        geometry: (x0, y0, dx, dy) as returned by get_cell_geometry
+
+    Only plain data is returned, so the heatmaps can be rendered in other
+        processes.
+    """
+    if 'png' not in image_formats:
+        raise ValueError, "The png image is needed for the html page"
+    # Create the heatmap
+    width, height, plot = plot_heatmap(data[LD_NAME], data[LD_HEADERS],
+        data[LD_MATRIX], data[LD_TRANSFORM_VALUES], output_dir, renderer,
+        image_formats)
+    # Although width and height are figure sizes, we flip them
+    # due to Matplotlib interprets rows as columns (see generate_xmap)
+    img_height = height * 80
+    img_width = width * 80
+    geometry = get_cell_geometry(plot, img_height)
+    if scalable:
+        return img_width, img_height, None, None, None, geometry
+    cells, all_xcoords, all_ycoords = get_cell_coords(data[LD_HEADERS],
+        data[LD_MATRIX], plot)
+    return img_width, img_height, cells, all_xcoords, all_ycoords, geometry
+
+def render_heatmap_worker(args):
+    """Renders a heatmap in a worker process
+
+    Inputs:
+        args: (data, output_dir, image_formats, scalable)
+
+    Returns the result of render_heatmap, once the images are on disk
+    """
+    data, output_dir, image_formats, scalable = args
+    with HeatmapRenderer(max_figures=1) as renderer:
+        return render_heatmap(data, output_dir, renderer, image_formats,
+            scalable)
+
+def render_heatmaps(list_data, output_dir, image_formats, workers,
+    scalable=False):
+    """Renders all the heatmaps in 'list_data' in a pool of processes
+
+    Inputs:
+        list_data: list of dicts with the heatmaps information
+        output_dir: output directory where the images will be saved
+        image_formats: list of formats of the heatmap images
+        workers: number of processes
+        scalable: if True, the workers only return the image sizes and the
+            cell geometries (see render_heatmap)
+
+    Returns the list of results of render_heatmap, in the order of list_data
+    """
+    pool = Pool(min(workers, len(list_data)) or 1)
+    try:
+        return pool.map(render_heatmap_worker,
+            [(data, output_dir, image_formats, scalable)
+                for data in list_data])
+    finally:
+        pool.close()
+        pool.join()
+
+def get_download_links(plot_name, image_formats):
+    """Get the html links to download the images of a heatmap
+
+    Inputs:
+        plot_name: plot name used for name the files
+        image_formats: list of formats of the heatmap images
+
+    Returns a list with a link for each image format but 'png', which is the
+        one shown in the page
+    """
+    formats = [fmt for fmt in image_formats if fmt != 'png']
+    if len(formats) == 1:
+        return [DOWNLOAD_LINK % (plot_name + '.' + formats[0],
+            "Download Figure")]
+    return [DOWNLOAD_LINK % (plot_name + '.' + fmt, "Download Figure (%s)" %
+        fmt) for fmt in formats]
+
+def write_html_table(writer, data, mapping_data, output_dir, scalable=False,
+    renderer=None, image_formats=DEFAULT_IMAGE_FORMATS, rendered=None):
+    """Writes an HTML table with the plot on it
+    Inputs:
+        writer: BufferedHtmlWriter where the html code is written
         data: dict of:
             {
                 LD_NAME: plot_name,
@@ -164,33 +386,66 @@ def get_html_table_string(data, mapping_data, output_dir):
             }
         output_dir: output directory where the images and scripts will be saved
         mapping_data: dictionary with the mapping file information
-
-    Returns string with the html code
+        scalable: if True, the labels of the cells are stored in a data file
+            and shown by heatmap_map.js instead of using an AREA tag per cell
+        renderer: HeatmapRenderer used to draw the heatmap. If None, a new
+            one is used
+        image_formats: list of formats of the heatmap images. Must contain
+            'png', which is the one shown in the page
+        rendered: result of render_heatmap for 'data', with the same
+            'scalable'. If None, the heatmap is rendered here
 
     Based in Jesse Stombaugh and Micah Hamady's code in make_2d_plots.py
     """
     # Create the heatmap
-    width, height, plot = plot_heatmap(data[LD_NAME], data[LD_HEADERS],
-        data[LD_MATRIX], data[LD_TRANSFORM_VALUES], output_dir)
+    if rendered is None:
+        rendered = render_heatmap(data, output_dir, renderer, image_formats,
+            scalable)
+    img_width, img_height, cells, all_xcoords, all_ycoords, geometry = rendered
+    # Create the html download links for the other image formats
+    links = ["<br>" + link for link in get_download_links(data[LD_NAME],
+        image_formats)]
+    if scalable:
+        map_data_name = write_map_data_file(data, mapping_data, geometry,
+            output_dir)
+        img_src = IMG_SCALABLE_SRC % (data[LD_NAME] + '.png', img_width,
+            img_height, data[LD_NAME], data[LD_NAME])
+        write_template(writer, TABLE_HTML, data[LD_TABLE_TITLE],
+            [img_src, SCRIPT_SRC % map_data_name] + links)
+        return
     # Create the map for the heatmap image
-    xmap, img_height, img_width = generate_xmap(height, width, data[LD_HEADERS],
-        data[LD_MATRIX], plot, mapping_data)
+    all_cids = get_cell_descriptions(data[LD_HEADERS], data[LD_MATRIX],
+        mapping_data, cells)
+    xmap = build_xmap(img_height, data[LD_HEADERS], all_cids, all_xcoords,
+        all_ycoords)
     # Create the html string with the heatmap image source information
     img_src = IMG_MAP_SRC % (data[LD_NAME] + '.png', data[LD_NAME], img_width,
         img_height)
-    # Create the html string with the map information
-    img_map = MAP_SRC % (data[LD_NAME], ''.join(xmap))
-    # Create the html download link for the image in '.eps.tgz' format
-    eps_link = DOWNLOAD_LINK % (data[LD_NAME] + '.eps.gz', "Download Figure")
-    # Create the html table with the heatmap image and its map and add it to
-    # the string with previous tables
-    return TABLE_HTML % (data[LD_TABLE_TITLE], "<br>".join((img_src + img_map,
-        eps_link)))
-
-def get_html_page_string(list_data, mapping_data, output_dir):
-    """Creates the full HTML string of the page
+    # Write the html table with the heatmap image and its map, writing the
+    # AREA tags one by one
+    def write_cell(writer):
+        writer.write(img_src)
+        write_template(writer, MAP_SRC, data[LD_NAME], xmap)
+        writer.writelines(links)
+    write_template(writer, TABLE_HTML, data[LD_TABLE_TITLE], write_cell)
+
+def get_html_table_string(data, mapping_data, output_dir, scalable=False,
+    renderer=None, image_formats=DEFAULT_IMAGE_FORMATS):
+    """Creates an HTML table with the plot on it
+
+    Inputs: see write_html_table
+
+    Returns string with the html code
+    """
+    return render_to_string(write_html_table, data, mapping_data, output_dir,
+        scalable, renderer, image_formats)
+
+def write_html_page(writer, list_data, mapping_data, output_dir,
+    scalable=False, image_formats=DEFAULT_IMAGE_FORMATS, workers=1):
+    """Writes the full HTML code of the page
 
     Inputs:
+        writer: BufferedHtmlWriter where the html code is written
         list_data: list of dicts of:
             {
                 LD_NAME: plot_name,
@@ -206,19 +461,46 @@ def get_html_page_string(list_data, mapping_data, output_dir):
                 the heatmap
         mapping_data: dictionary with the mapping file information
         output_dir: output directory where the images and scripts will be saved
+        scalable: if True, use the client-side image map of heatmap_map.js
+        image_formats: list of formats of the heatmap images
+        workers: number of processes used to render the heatmaps
 
-    Returns string with the html code
+    With a single worker, all the heatmaps are drawn with the same
+        HeatmapRenderer. Otherwise, they are drawn concurrently in a pool of
+        processes and the tables are written in the order of 'list_data'.
 
     Based in Jesse Stombaugh and Micah Hamady's code in make_2d_plots.py
     """
-    out_table = ''
-    for item in list_data:
-        out_table += get_html_table_string(item, mapping_data, output_dir)
+    def write_tables(writer):
+        if scalable:
+            writer.write(SCRIPT_SRC % "heatmap_map.js")
+        if workers > 1 and len(list_data) > 1:
+            all_rendered = render_heatmaps(list_data, output_dir,
+                image_formats, workers, scalable)
+            for item, rendered in zip(list_data, all_rendered):
+                write_html_table(writer, item, mapping_data, output_dir,
+                    scalable, image_formats=image_formats, rendered=rendered)
+            return
+        with HeatmapRenderer() as renderer:
+            for item in list_data:
+                write_html_table(writer, item, mapping_data, output_dir,
+                    scalable, renderer, image_formats)
+    # Write the complete html code
+    write_template(writer, PAGE_HTML, write_tables)
+
+def get_html_page_string(list_data, mapping_data, output_dir, scalable=False,
+    image_formats=DEFAULT_IMAGE_FORMATS, workers=1):
+    """Creates the full HTML string of the page
+
+    Inputs: see write_html_page
 
-    # Create the complete html string
-    return PAGE_HTML % (out_table)
+    Returns string with the html code
+    """
+    return render_to_string(write_html_page, list_data, mapping_data,
+        output_dir, scalable, image_formats, workers)
 
-def make_html_file(list_data, mapping_data, html_fp, output_dir):
+def make_html_file(list_data, mapping_data, html_fp, output_dir,
+    scalable=False, image_formats=DEFAULT_IMAGE_FORMATS, workers=1):
     """Creates the HTML file with the heatmap images
 
     Inputs:
@@ -238,17 +520,25 @@ def make_html_file(list_data, mapping_data, html_fp, output_dir):
         mapping_data: dictionary with the mapping file information
         html_fp: file path where the html file will be created
         output_dir: output directory where the images and scripts will be saved
+        scalable: if True, the labels of the cells are stored in data files
+            read by heatmap_map.js instead of using an AREA tag per cell. Use
+            it for heatmaps with a large number of samples.
+        image_formats: list of formats of the heatmap images. Must contain
+            'png'. By default, the png and a gzipped eps are generated
+        workers: number of processes used to render the heatmaps
+            concurrently
 
         Generates an html file with all the heatmaps listed in 'list_data'.
         The generated html file will be saved as 'html_fp' and the images and
         the scripts will be saved in 'output_dir'
     """
-    # Get the HTML string
-    page_html_string = get_html_page_string(list_data, mapping_data, output_dir)
+    # Write the html code straight to the html file
+    render_to_file(write_html_page, html_fp, list_data, mapping_data,
+        output_dir, scalable, image_formats, workers)
     # Move 'overlib.js' to the output_dir
     overlib_js_fp = join(dirname(__file__), OVERLIB_JS)
     copyfile(overlib_js_fp, join(output_dir, "overlib.js"))
-    # Save the html file
-    out = open(html_fp, "w+")
-    out.write(page_html_string)
-    out.close()
\ No newline at end of file
+    if scalable:
+        # Move 'heatmap_map.js' to the output_dir
+        heatmap_map_js_fp = join(dirname(__file__), HEATMAP_MAP_JS)
+        copyfile(heatmap_map_js_fp, join(output_dir, "heatmap_map.js"))
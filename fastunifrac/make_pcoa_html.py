@@ -11,6 +11,8 @@ __status__ = "Development"
 
 from os.path import join, isdir, isfile
 from os import listdir
+from fastunifrac.html_writer import (write_template, render_to_string,
+    render_to_file)
 
 PCOA_2D_CONTINUOUS_INDEX = 0
 PCOA_2D_DISCRETE_INDEX = 1
@@ -115,6 +117,24 @@ def get_dict_links(pcoa_dir):
                     title = ' '.join(name.split('_')[:-1])
     return links, title
 
+def write_html_table_links(writer, links_dict, title):
+    """Writes the HTML table of links
+
+    Inputs:
+        writer: BufferedHtmlWriter where the html code is written
+        links_dict: dict of: {index: html_link}
+            where:
+                index: sets the index order to show the link
+                html_link: string which contains the html link
+        title: string with the metric used in beta diversity
+    """
+    # Sort the keys to retrieve them in the correct order
+    sorted_keys = links_dict.keys()
+    sorted_keys.sort()
+    # Write the HTML code of the table
+    write_template(writer, TABLE_HTML, title,
+        (ROW_TABLE_HTML % links_dict[key] for key in sorted_keys))
+
 def get_html_table_links(links_dict, title):
     """Get the HTML string with the table of links
 
@@ -128,32 +148,30 @@ def get_html_table_links(links_dict, title):
     Returns a string which contains all the html links in links_dict
         orderer by their indexes.
     """
-    # Sort the keys to retrieve them in the correct order
-    sorted_keys = links_dict.keys()
-    sorted_keys.sort()
-    # Create the html string for the table rows
-    html_rows_string = ""
-    for key in sorted_keys:
-        html_rows_string += ROW_TABLE_HTML % links_dict[key]
-    # Create the HTML string with the table
-    return TABLE_HTML % (title, html_rows_string)
+    return render_to_string(write_html_table_links, links_dict, title)
 
-def get_html_string(pcoa_dir):
-    """Creates the full HTML string of the page
+def write_html_page(writer, pcoa_dir):
+    """Writes the full HTML code of the page
 
     Inputs:
+        writer: BufferedHtmlWriter where the html code is written
         pcoa_dir: PCoA output directory
-
-    Returns a string which contains the full page html code.
     """
     # Get a dict of {index, link} with the html links
     links, title = get_dict_links(pcoa_dir)
+    # Write the table with all the links ordered by index
+    write_template(writer, PAGE_HTML,
+        lambda writer: write_html_table_links(writer, links, title))
 
-    # Get the html string with all the links ordered by index
-    html_table_links_string = get_html_table_links(links, title)
+def get_html_string(pcoa_dir):
+    """Creates the full HTML string of the page
+
+    Inputs:
+        pcoa_dir: PCoA output directory
 
-    # Return the string with the full page html code
-    return PAGE_HTML % (html_table_links_string)
+    Returns a string which contains the full page html code.
+    """
+    return render_to_string(write_html_page, pcoa_dir)
 
 def make_html_file(pcoa_dir, html_fp):
     """Creates the HTML file with a table to the PCoA result links
@@ -164,9 +182,5 @@ def make_html_file(pcoa_dir, html_fp):
 
     Generates the html file.
     """ 
-    # Get the html string
-    html_string = get_html_string(pcoa_dir)
-    # Save the html file
-    out = open(html_fp, 'w')
-    out.write(html_string)
-    out.close()
\ No newline at end of file
+    # Write the html code straight to the html file
+    render_to_file(write_html_page, html_fp, pcoa_dir)
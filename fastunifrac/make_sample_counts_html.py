@@ -10,6 +10,8 @@ __email__ = "josenavasmolina@gmail.com"
 __status__ = "Development"
 
 from qiime.parse import parse_mapping_file_to_dict
+from fastunifrac.html_writer import (write_template, render_to_string,
+    render_to_file)
 
 ROW_TABLE_HTML = """<tr>
     <td class="row_header">%s</td>
@@ -47,6 +49,25 @@ PAGE_HTML = """
 </html>
 """
 
+def write_html_table(writer, map_dict):
+    """Writes the HTML table with the summary
+
+    Inputs:
+        writer: BufferedHtmlWriter where the html code is written
+        map_dict: dictionary with the mapping file info
+
+    Writes the HTML table code containing the Sample IDs, the counts and the
+        sample Description.
+    """
+    def write_rows(writer):
+        total = 0.0
+        for key in map_dict.keys():
+            writer.write(ROW_TABLE_HTML % (key,
+                map_dict[key]['NumIndividuals'], map_dict[key]['Description']))
+            total += float(map_dict[key]['NumIndividuals'])
+        writer.write(ROW_TABLE_HTML % ('Total', int(total), ''))
+    write_template(writer, TABLE_HTML, write_rows)
+
 def get_html_table(map_dict):
     """Get the HTML table string with the summary
 
@@ -56,14 +77,17 @@ def get_html_table(map_dict):
     Returns a string with the HTML table code containing the Sample IDs, the
         counts and the sample Description.
     """
-    table_rows = ""
-    total = 0.0
-    for key in map_dict.keys():
-        table_rows += ROW_TABLE_HTML % (key, map_dict[key]['NumIndividuals'],
-            map_dict[key]['Description'])
-        total += float(map_dict[key]['NumIndividuals'])
-    table_rows += ROW_TABLE_HTML % ('Total', int(total), '')
-    return TABLE_HTML % table_rows
+    return render_to_string(write_html_table, map_dict)
+
+def write_html_page(writer, map_dict):
+    """Writes the full HTML code of the page
+
+    Inputs:
+        writer: BufferedHtmlWriter where the html code is written
+        map_dict: dictionary with the mapping file info
+    """
+    write_template(writer, PAGE_HTML,
+        lambda writer: write_html_table(writer, map_dict))
 
 def get_html_page_string(map_dict):
     """Creates the full HTML string of the page
@@ -73,9 +97,7 @@ def get_html_page_string(map_dict):
 
     Returns a string which contains the full page html code.
     """
-    table_html = get_html_table(map_dict)
-
-    return PAGE_HTML % table_html
+    return render_to_string(write_html_page, map_dict)
 
 def make_html_file(lines, html_fp):
     """Creates the HTML file with a table with the sample counts
@@ -88,9 +110,5 @@ def make_html_file(lines, html_fp):
     """
     # Parse the mapping file
     (map_dict, list_c) = parse_mapping_file_to_dict(lines)
-    # Generate the string containing the html code
-    page_html_string = get_html_page_string(map_dict)
-    #Save the html file
-    out = open(html_fp, 'w')
-    out.write(page_html_string)
-    out.close()
\ No newline at end of file
+    # Write the html code straight to the html file
+    render_to_file(write_html_page, html_fp, map_dict)
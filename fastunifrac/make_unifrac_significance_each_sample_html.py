@@ -9,7 +9,9 @@ __maintainer__ = "Jose Antonio Navas Molina"
 __email__ = "josenavasmolina@gmail.com"
 __status__ = "Development"
 
-from fastunifrac.make_heatmap import get_matrix_value
+from fastunifrac.make_heatmap import IntervalClassifier
+from fastunifrac.html_writer import (write_template, render_to_string,
+    render_to_file)
 
 """ Html code adapted from Micah Hamady's Fastunifrac code """
 
@@ -78,16 +80,14 @@ PAGE_HTML = """
 </html>
 """
 
-def get_html_table(d_data, title, index):
-    """Get the HTML table with the p values colored by significance
+def write_html_table(writer, d_data, title, index):
+    """Writes the HTML table with the p values colored by significance
 
     Inputs:
+        writer: BufferedHtmlWriter where the html code is written
         d_data: dict of: {sample: (p value, p value corrected)}
         title: string which contains the table title
         index: 0 indicates p value and 1 indicates p value corrected
-
-    Returns a string which contains the html code of a table where the p values
-        are colored by significance.
     """
     # Check the index is in the expected range
     if index != 0 and index != 1:
@@ -95,28 +95,60 @@ def get_html_table(d_data, title, index):
     # Sort the sample names
     sorted_samples = d_data.keys()
     sorted_samples.sort()
-    # Generate the HTML string with the rows code
-    rows = ''
-    for sample in sorted_samples:
-        v = d_data[sample][index]
-        c = get_matrix_value(v, DICT_TRANS_VALUES)
-        rows += ROW_TABLE_HTML % (sample, c, v)
-    # Generate the HTML string with the table code
-    return TABLE_HTML % (title, rows)
+    # Generate the HTML code of the rows
+    classifier = IntervalClassifier(DICT_TRANS_VALUES)
+    def write_rows(writer):
+        for sample in sorted_samples:
+            v = d_data[sample][index]
+            writer.write(ROW_TABLE_HTML % (sample, classifier(v), v))
+    # Write the HTML code of the table
+    write_template(writer, TABLE_HTML, title, write_rows)
 
-def get_html_legend_table():
-    """Get the HTML table with the color legend"""
+def get_html_table(d_data, title, index):
+    """Get the HTML table with the p values colored by significance
+
+    Inputs:
+        d_data: dict of: {sample: (p value, p value corrected)}
+        title: string which contains the table title
+        index: 0 indicates p value and 1 indicates p value corrected
+
+    Returns a string which contains the html code of a table where the p values
+        are colored by significance.
+    """
+    return render_to_string(write_html_table, d_data, title, index)
+
+def write_html_legend_table(writer):
+    """Writes the HTML table with the color legend"""
     # Sort the ranges
     sorted_keys = DICT_TRANS_VALUES.keys()
     sorted_keys.sort()
-    # Generate the HTML string with the rows code
-    rows = ''
-    for key in sorted_keys[1:]:
-        color = DICT_TRANS_VALUES[key][0]
-        desc = DICT_TRANS_VALUES[key][1]
-        rows += ROW_TABLE_LEGEND_HTML % (color, desc)
-    # Generate the HTML string with the table code
-    return TABLE_LEGEND_HTML % (rows)
+    # Generate the HTML code of the rows
+    rows = [ROW_TABLE_LEGEND_HTML % DICT_TRANS_VALUES[key][:2]
+        for key in sorted_keys[1:]]
+    # Write the HTML code of the table
+    write_template(writer, TABLE_LEGEND_HTML, rows)
+
+def get_html_legend_table():
+    """Get the HTML table with the color legend"""
+    return render_to_string(write_html_legend_table)
+
+def write_html_page(writer, d_data, test_name):
+    """Writes the full HTML code of the page
+
+    Inputs:
+        writer: BufferedHtmlWriter where the html code is written
+        d_data: dict of: {sample: (p value, p value corrected)}
+        test_name: string which contains the name of the test realized
+    """
+    write_template(writer, PAGE_HTML,
+        # Table with the raw values
+        lambda writer: write_html_table(writer, d_data,
+            test_name + ": Raw values", 0),
+        # Table with the corrected values
+        lambda writer: write_html_table(writer, d_data,
+            test_name + ": Corrected values", 1),
+        # Table with the color legend
+        write_html_legend_table)
 
 def get_html_page_string(d_data, test_name):
     """Creates the full HTML string of the page
@@ -127,14 +159,7 @@ def get_html_page_string(d_data, test_name):
 
     Returns a string which contains the full page html code.
     """
-    # Get the table with the raw values
-    raw_table = get_html_table(d_data, test_name + ": Raw values", 0)
-    # Get the table with the corrected values
-    corrected_table = get_html_table(d_data, test_name + ": Corrected values",1)
-    # Get the table with the color legend
-    leg_table = get_html_legend_table()
-    # Return the string with the full page html code
-    return PAGE_HTML % (raw_table, corrected_table, leg_table)
+    return render_to_string(write_html_page, d_data, test_name)
 
 def make_html_file(d_data, test_name, html_fp):
     """Creates the HTML file with the unifrac significance results
@@ -146,9 +171,5 @@ def make_html_file(d_data, test_name, html_fp):
 
     Generates the html file with the unifrac results colored by significance
     """
-    #Generate the html string
-    page_html_string = get_html_page_string(d_data, test_name)
-    #Save the html file
-    out = open(html_fp, 'w')
-    out.write(page_html_string)
-    out.close()
\ No newline at end of file
+    # Write the html code straight to the html file
+    render_to_file(write_html_page, html_fp, d_data, test_name)
@@ -9,13 +9,19 @@ __maintainer__ = "Jose Antonio Navas Molina"
 __email__ = "josenavasmolina@gmail.com"
 __status__ = "Development"
 
-from make_heatmap import get_matrix_value
+from make_heatmap import IntervalClassifier
+from numpy import (array, asarray, empty, zeros, concatenate, isnan, nan,
+    int16, int32, unique)
 from shutil import copyfile
+from json import dumps
 import os
-from os.path import join, dirname
+import re
+from os.path import join, dirname, basename, splitext, exists
 
 # overlib.js path
 OVERLIB_JS = "support_files/overlib.js"
+# tree_tooltips.js path: delegated tooltips of the compact trees
+TREE_TOOLTIPS_JS = "support_files/tree_tooltips.js"
 
 """Html code adapted from Micah Hamady's code at Fastunifrac website"""
 
@@ -23,6 +29,50 @@ INTERACTIVE_ID_HTML = """<a href="#" onmouseover="return overlib('<b>Sample ID:<
 
 FORMATED_HTML = """<a href="#" onmouseover="return overlib('<b>Jackknife Count:</b> %.3f<br><b>Jackknife Fraction:</b> %.3f');" onmouseout="return nd();"><font style="BACKGROUND-COLOR:%s">%s</font></a>"""
 
+# Compact html code: the glyphs and the sample ids are only tagged, and their
+# pop up messages are built by tree_tooltips.js from the table registered in
+# TREE_DATA_HTML. The shortest valid tags are used, as there is one per glyph
+COMPACT_ID_HTML = """<b class=s>%s</b>"""
+
+COMPACT_GLYPH_HTML = """<b class=c%d data-n=%d>%s</b>"""
+
+COMPACT_PRE_HTML = """<pre onmouseover="return treeOver(event);" onmouseout="return treeOut(event);">"""
+
+TREE_DATA_HTML = """<script type="text/javascript">treeRegister(%s);</script>"""
+
+COMPACT_STYLE_HTML = """<script type="text/javascript" src="tree_tooltips.js"></script>
+<style type="text/css">
+pre b { font-weight:normal; }
+pre b.s { color:blue; text-decoration:underline; cursor:pointer; }
+%s
+</style>
+"""
+
+# Lazily expanded trees: each collapsed subtree is written to a fragment file,
+# which is loaded by tree_fragments.js when the subtree is expanded
+TREE_FRAGMENTS_JS = "support_files/tree_fragments.js"
+
+FRAGMENTS_SUFFIX = "_fragments"
+
+LAZY_SCRIPT_HTML = """<script type="text/javascript" src="tree_fragments.js"></script>
+"""
+
+COLLAPSED_HTML = """<span id="t%d">%s&#62;<a href="#" onclick="return treeExpand('%s', %d);">[+] %d samples</a></span>"""
+
+FRAGMENT_JS = """treeFragment(%d, %s, %s);
+"""
+
+# Data type of the glyph records of the HTML-ASCII lines: the char, the
+# jackknife support shown by the char, the index of its color in the glyph
+# palette, or PLAIN_GLYPH if the char is not colored, and the postorder
+# position of the node drawn by the char, or -1
+GLYPH_DTYPE = [('char', 'S1'), ('support', float), ('color', int16),
+    ('node', int32)]
+PLAIN_GLYPH = -1
+
+# Glyph of an HTML-ASCII string: an html anchor or a single char
+HTML_GLYPH_RE = re.compile(r'<a\b.*?</a>|.', re.DOTALL)
+
 ROW_TABLE_LEGEND_HTML = """<tr>
 <td class="normal" bgcolor="%s" nowrap>&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;</td>
 <td class="row_header">%s</td>
@@ -46,77 +96,300 @@ PAGE_HTML = """
 .header { color: white; font-family:Arial,Verdana; font-size:12; font-weight:bold; background-color:#2C3143;}
 .row_header { color: black; font-family:Arial,Verdana; font-size:12; font-weight:bold; background-color:#C1C9E5;}
 </style>
-</head>
+%s</head>
 <body>
 %s
 </body>
 </html>
 """
 
+def get_tree_layout(tree, char1='-', lengths=None):
+    """Computes the position of every node in the ASCII representation of tree
+
+    Inputs:
+        tree: cogent's tree object
+        char1: char to use in the root branch
+        lengths: list with the branch length of each node in postorder. If
+            None, the branch lengths of the tree are used
+
+    Returns dict of: {
+        'nodes': list with the nodes of 'tree' in postorder,
+        'x': list with the first column of the branch of each node,
+        'length': list with the number of columns of the branch of each node,
+        'mid': list with the row of each node,
+        'span': list with the rows of the first and the last children of each
+            node, or None for the tips,
+        'char': list with the char which starts the branch of each node,
+        'parent': list with the position of the parent of each node, or -1,
+        'tips': list with the positions of the tips, in row order,
+        'preorder': list with the positions of the nodes in preorder}
+        The rest of lists are indexed by the position of the node in postorder.
+
+    The tree is traversed once in postorder with an explicit stack, so deep
+        trees do not hit the recursion limit. The columns are computed
+        afterwards from the branch lengths (see set_layout_lengths).
+    """
+    layout = {'nodes': [], 'mid': [], 'span': [], 'char': [], 'parent': [],
+        'tips': []}
+    nodes = layout['nodes']
+    mids = layout['mid']
+    parents = layout['parent']
+    tips = layout['tips']
+    preorder_ranks = []
+    # Stack of [node, char, index of the next child, children positions,
+    # preorder rank]
+    stack = [[tree, char1, 0, [], 0]]
+    num_visited = 1
+    while stack:
+        entry = stack[-1]
+        node, char, i, children, rank = entry
+        if i < len(node.Children):
+            entry[2] = i + 1
+            if i == 0:
+                child_char = '/'
+            elif i == len(node.Children) - 1:
+                child_char = '\\'
+            else:
+                child_char = '-'
+            stack.append([node.Children[i], child_char, 0, [], num_visited])
+            num_visited += 1
+            continue
+        stack.pop()
+        position = len(nodes)
+        nodes.append(node)
+        preorder_ranks.append(rank)
+        layout['char'].append(char)
+        parents.append(-1)
+        if children:
+            low_mid = mids[children[0]]
+            high_mid = mids[children[-1]]
+            mids.append((low_mid + high_mid) / 2)
+            layout['span'].append((low_mid, high_mid))
+            for child in children:
+                parents[child] = position
+        else:
+            mids.append(len(tips))
+            layout['span'].append(None)
+            tips.append(position)
+        if stack:
+            stack[-1][3].append(position)
+    preorder = [0] * len(nodes)
+    for position, rank in enumerate(preorder_ranks):
+        preorder[rank] = position
+    layout['preorder'] = preorder
+
+    if lengths is None:
+        lengths = [node.Length for node in nodes]
+    return set_layout_lengths(layout, lengths)
+
+def set_layout_lengths(layout, lengths):
+    """Returns a copy of a tree layout with other branch lengths
+
+    Inputs:
+        layout: tree layout (see get_tree_layout)
+        lengths: list with the branch length of each node in postorder
+
+    The columns of the branches are computed from the root to the tips: the
+        parents go after their children in postorder, so the positions are
+        visited backwards.
+    """
+    result = dict(layout)
+    # Get the length of the branches - minimum 2 for extra chars
+    result['length'] = [length or 2 for length in lengths]
+    parents = layout['parent']
+    xs = [0] * len(lengths)
+    for position in xrange(len(lengths) - 1, -1, -1):
+        parent = parents[position]
+        if parent >= 0:
+            xs[position] = xs[parent] + result['length'][parent]
+    result['x'] = xs
+    return result
+
+def scale_branch_lengths(layout, lengths, max_length=100):
+    """Scales the branch lengths of a tree to integers for the ASCII output
+
+    Inputs:
+        layout: tree layout (see get_tree_layout)
+        lengths: list with the branch length of each node in postorder
+        max_length: scaled length from the root to the most distant tip
+
+    Returns a list with the scaled length of each node in postorder. They are
+        the lengths which tree.scaleBranchLengths(max_length,
+        ultrametric=True) sets on the tree, but the tree is not modified.
+    """
+    parents = layout['parent']
+    spans = layout['span']
+    num_nodes = len(parents)
+    # Distance from each node to its most distant tip
+    tip_distances = [0 if span is None else None for span in spans]
+    for position in xrange(num_nodes):
+        parent = parents[position]
+        if parent >= 0:
+            distance = lengths[position] + tip_distances[position]
+            if tip_distances[parent] is None or \
+                distance > tip_distances[parent]:
+                tip_distances[parent] = distance
+    # Same maximum than cogent, which may be an int or a float when they tie
+    orig_max = max([tip_distances[position]
+        for position in layout['preorder']])
+    # Scaled distance from each node to the tips, so all the tips line up
+    distances_used = [0] * num_nodes
+    min_distances = [1] * num_nodes
+    for position in xrange(num_nodes):
+        if spans[position] is not None:
+            ideal_distance = int(round(tip_distances[position] / orig_max *
+                max_length))
+            distances_used[position] = max(min_distances[position],
+                ideal_distance)
+        parent = parents[position]
+        if parent >= 0:
+            min_distances[parent] = max(min_distances[parent],
+                distances_used[position] + 1)
+
+    result = list(lengths)
+    for position, parent in enumerate(parents):
+        if parent >= 0 and lengths[position] is not None:
+            result[position] = distances_used[parent] - \
+                distances_used[position]
+    return result
+
+class TreeLayout(object):
+    """Layout of the ASCII representation of a tree with scaled branches
+
+    The tree is traversed only once and its branch lengths are scaled into a
+    side list, so the tree is not modified and the same layout can be
+    rendered several times, by the plain and by the jackknife renderers.
+    """
+
+    def __init__(self, tree, max_length=100):
+        """Computes the layout of the tree
+
+        Inputs:
+            tree: cogent's tree object
+            max_length: scaled length from the root to the most distant tip
+        """
+        self.tree = tree
+        self.max_length = max_length
+        self.layout = get_tree_layout(tree)
+        self._scaled_layout = None
+        self._branch_scale = None
+
+    def get_scaled_layout(self):
+        """Returns the tree layout with the scaled branch lengths
+
+        The branch lengths are scaled the first time and then cached (see
+            scale_branch_lengths).
+        """
+        if self._scaled_layout is None:
+            lengths = [node.Length for node in self.layout['nodes']]
+            scaled_lengths = scale_branch_lengths(self.layout, lengths,
+                self.max_length)
+            tips = self.layout['tips']
+            unscaled_max_length = max([lengths[tip] for tip in tips])
+            scaled_max_length = max([scaled_lengths[tip] for tip in tips])
+            self._branch_scale = float(unscaled_max_length) / \
+                scaled_max_length
+            self._scaled_layout = set_layout_lengths(self.layout,
+                scaled_lengths)
+        return self._scaled_layout
+
+    def get_branch_scale(self):
+        """Returns the branch length units represented by each scaled unit"""
+        self.get_scaled_layout()
+        return self._branch_scale
+
+def get_tree_layout_object(tree):
+    """Returns a TreeLayout for 'tree'
+
+    Inputs:
+        tree: cogent's tree object or an already built TreeLayout, which is
+            returned as is
+    """
+    if isinstance(tree, TreeLayout):
+        return tree
+    return TreeLayout(tree)
+
+def get_tree_grid(layout, tip_char='>'):
+    """Writes the glyphs of a tree layout into a character grid
+
+    Inputs:
+        layout: tree layout (see get_tree_layout)
+        tip_char: char written between the branch of each tip and its name
+
+    Returns:
+        grid: char array of shape (number of tips, width) with the ASCII
+            representation of the tree, without the tip names. Row i
+            corresponds to the i-th tip
+        owners: int array of the same shape with the position of the node
+            whose jackknife support is shown by each glyph ('/' and '\\' show
+            the support of their parent node, and '|' the support of the node
+            whose children it joins), or -1 for the rest of glyphs
+        widths: int array with the number of columns used in each row
+    """
+    xs = layout['x']
+    lengths = layout['length']
+    mids = layout['mid']
+    tips = layout['tips']
+    widths = array([xs[tip] + lengths[tip] + 1 for tip in tips], dtype=int)
+    width = widths.max() if len(widths) else 0
+    grid = empty((len(tips), width), dtype='S1')
+    grid.fill(' ')
+    owners = empty((len(tips), width), dtype=int32)
+    owners.fill(-1)
+
+    for position, (x, length, mid, span, char, parent) in enumerate(zip(xs,
+        lengths, mids, layout['span'], layout['char'], layout['parent'])):
+        if span is None:
+            grid[mid, x + 1:x + length] = '-'
+            grid[mid, x + length] = tip_char
+        else:
+            # The pipe joins the mids of the first and the last children
+            low_mid, high_mid = span
+            grid[low_mid + 1:high_mid, x + length - 1] = '|'
+            owners[low_mid + 1:high_mid, x + length - 1] = position
+            grid[mid, x + 1:x + length - 1] = '-'
+        grid[mid, x] = char
+        owners[mid, x] = parent if char in '/\\' else -1
+    return grid, owners, widths
+
+def get_layout_lines(layout):
+    """Returns the list of strings of the ASCII representation of a layout
+
+    Inputs:
+        layout: tree layout (see get_tree_layout)
+    """
+    grid, owners, widths = get_tree_grid(layout, '>')
+    nodes = layout['nodes']
+    return [grid[row, :width].tostring() + nodes[tip].Name
+        for row, (tip, width) in enumerate(zip(layout['tips'], widths))]
+
 def asciiArt_length(tree, char1='-'):
     """Creates a list with an ASCII representation of the tree
 
     Inputs:
         tree: cogent's tree object
-        char1: first char to use in the current branch
+        char1: first char to use in the root branch
 
     Returns:
         result: list containing the strings which represents the tree rooted
             at 'tree'
         mid: integer which means the middle line of 'result'
     """
-    # Get the length of the current branch - minimum 2 for extra chars
-    LEN = tree.Length or 2
-    # tree is not a tip
-    if tree.Children:
-        result = []
-        mids = []
-        # Loop through the tree's children
-        for child in tree.Children:
-            if child is tree.Children[0]:
-                char2 = '/'
-            elif child is tree.Children[-1]:
-                char2 = '\\'
-            else:
-                char2 = '-'
-            # Create ASCII representation of current child
-            (child_lines, child_mid) = asciiArt_length(child, char2)
-            mids.append(len(result) + child_mid)
-            result.extend(child_lines)
-        # Compute mid of tree
-        low_mid = mids[0]
-        high_mid = mids[-1]
-        mid = (high_mid + low_mid) / 2
-        # Add ASCII prefixes to the children's representations
-        space_str = ' ' * LEN
-        space_pipe_str = ' ' * (LEN - 1) + '|'
-        prefixes = [space_str] * (low_mid + 1) + [space_pipe_str] * (high_mid - 
-            low_mid - 1) + [space_str] * (len(result) - high_mid)
-        if LEN < 2:
-            prefixes[mid] = char1
-        else:
-            prefixes[mid] = char1 + '-' * (LEN - 2) + prefixes[mid][-1]
-        result = [ p + l for (p, l) in zip(prefixes, result)]
-        return (result, mid)
-    else:
-        return ([char1 + '-' * (LEN - 1) + '>' + tree.Name], 0)
+    layout = get_tree_layout(tree, char1)
+    return (get_layout_lines(layout), layout['mid'][-1])
 
 def get_tree_by_length_string(tree):
     """Generates a string with an ASCII representation of tree
 
     Inputs:
-        tree: cogent's tree object
+        tree: cogent's tree object or its TreeLayout. The tree is not modified
     """
-    # Scale branch lengths
-    unscaled_max_length = max([node.Length for node in tree.tips()])
-    tree.scaleBranchLengths(max_length=100, ultrametric=True)
-    scaled_max_length = max([node.Length for node in tree.tips()])
-    branch_scale = float(unscaled_max_length) / scaled_max_length
-    # Get string lines of ASCII representation of tree
-    (lines, mid) = asciiArt_length(tree)
+    tree_layout = get_tree_layout_object(tree)
+    # Get string lines of ASCII representation of tree, with scaled branches
+    lines = get_layout_lines(tree_layout.get_scaled_layout())
     output = []
     output.append("Scale: 1 dash, slash, backslash ~ %.4f branch length units" %
-        branch_scale)
+        tree_layout.get_branch_scale())
     output.extend(lines)
     return output
 
@@ -132,32 +405,158 @@ def add_interactive_sample_id(line, mapping_data, separator):
     return before + "&#62;" + INTERACTIVE_ID_HTML % (after,
         mapping_data[0][after]['Description'], after)
 
-def make_interactive_sample_id_tree_file(tree, mapping_data, html_fp,
-    output_dir):
-    """Creates the html file with the ASCII representation of the tree
+def add_compact_sample_id(line, separator):
+    """Tags the SampleID string so tree_tooltips.js shows its description
+
+    Inputs:
+        line: string containing the sample ID to tag
+        separator: char used to separate the sample id from the line
+    """
+    before, sep, after = line.partition(separator)
+    return before + "&#62;" + COMPACT_ID_HTML % after
+
+def get_tree_data(mapping_data, sample_ids, num_trees_considered=None,
+    node_support=None, positions=None):
+    """Returns the table of a compact tree
 
     Inputs:
-        tree: cogent's tree object
         mapping_data: dictionary with the mapping file data
-        html_fp: filepath for the output html file
+        sample_ids: list with the sample ids shown in the tree
+        num_trees_considered: number of trees used for the jackknife
+        node_support: array with the jackknife support of the nodes of the
+            tree in postorder (see get_node_support)
+        positions: postorder positions of the nodes whose support is stored.
+            If None, the support of all the nodes is stored
+
+    Returns a dict with the description of each sample and, if node_support
+        is given, the jackknife support of each node, indexed by the "data-n"
+        attribute of the glyphs: a list, or a dict keyed by the positions.
+        NaN supports are stored as None.
+    """
+    data = {'desc': dict([(sample_id,
+        mapping_data[0][sample_id]['Description'])
+        for sample_id in sample_ids])}
+    if node_support is not None:
+        node_support = asarray(node_support, dtype=float)
+        if positions is not None:
+            node_support = node_support[array(positions, dtype=int)]
+        values = [None if isnan(value) else value
+            for value in node_support.tolist()]
+        data['trees'] = num_trees_considered
+        if positions is None:
+            data['support'] = values
+        else:
+            data['support'] = dict(zip([str(position)
+                for position in positions], values))
+    return data
+
+def get_tree_data_json(data):
+    """Serializes the table of a compact tree to JSON
+
+    The '</' sequences are escaped so the table can not close the script tag
+        which contains it.
+    """
+    return dumps(data, separators=(',', ':'), sort_keys=True).replace('</',
+        '<\\/')
+
+def get_tree_data_html(mapping_data, sample_ids, num_trees_considered=None,
+    node_support=None):
+    """Returns the html code which registers the table of a compact tree
+
+    Inputs: see get_tree_data
+
+    Returns a script tag which registers the table in tree_tooltips.js
+    """
+    return TREE_DATA_HTML % get_tree_data_json(get_tree_data(mapping_data,
+        sample_ids, num_trees_considered, node_support))
+
+def get_compact_style_html(palette=()):
+    """Returns the html head code of the compact trees
+
+    Inputs:
+        palette: list of colors indexed by the glyph records (see
+            get_glyph_palette). Glyphs of color i have the class "ci", and
+            the None colors are left unstyled
+    """
+    rules = ["pre b.c%d { background-color:%s; }" % (i, color)
+        for i, color in enumerate(palette) if color is not None]
+    return COMPACT_STYLE_HTML % "\n".join(rules)
+
+def copy_support_files(output_dir, compact=False, lazy=False):
+    """Copies the javascript files used by the tree pages to output_dir
+
+    Inputs:
         output_dir: path to the directory where to store the aux html files
+        compact: if True, tree_tooltips.js is copied too
+        lazy: if True, tree_tooltips.js and tree_fragments.js are copied too
+    """
+    support_files = [OVERLIB_JS]
+    if compact or lazy:
+        support_files.append(TREE_TOOLTIPS_JS)
+    if lazy:
+        support_files.append(TREE_FRAGMENTS_JS)
+    for support_file in support_files:
+        copyfile(join(dirname(__file__), support_file),
+            join(output_dir, os.path.basename(support_file)))
+
+def get_interactive_sample_id_tree_html_string(tree, mapping_data,
+    compact=False):
+    """Generates the full page html code of the ASCII representation of tree
+
+    Inputs:
+        tree: cogent's tree object or its TreeLayout
+        mapping_data: dictionary with the mapping file data
+        compact: if True, the sample ids are only tagged and their
+            descriptions are stored once in a table read by tree_tooltips.js
     """
     # Get the ASCII representation of the tree
     tree_lines = get_tree_by_length_string(tree)
     # Transform the ASCII representation to HTML with interactive sample ids.
     tree_html_lines = [tree_lines[0] + "<br>"]
-    tree_html_lines.extend([add_interactive_sample_id(line, mapping_data, '>')
-        for line in tree_lines[1:]])
-
-    html_lines = ["<pre>"]
+    if compact:
+        tree_html_lines.extend([add_compact_sample_id(line, '>')
+            for line in tree_lines[1:]])
+        html_lines = [COMPACT_PRE_HTML]
+    else:
+        tree_html_lines.extend([add_interactive_sample_id(line, mapping_data,
+            '>') for line in tree_lines[1:]])
+        html_lines = ["<pre>"]
     html_lines.extend(tree_html_lines)
     html_lines.append("</pre>")
+    head = ""
+    if compact:
+        html_lines.append(get_tree_data_html(mapping_data,
+            [line.partition('>')[2] for line in tree_lines[1:]]))
+        head = get_compact_style_html()
+
+    return PAGE_HTML % (head, "\n".join(html_lines))
+
+def make_interactive_sample_id_tree_file(tree, mapping_data, html_fp,
+    output_dir, compact=False, lazy_levels=None):
+    """Creates the html file with the ASCII representation of the tree
 
-    tree_text_html = PAGE_HTML % "\n".join(html_lines)
+    Inputs:
+        tree: cogent's tree object or its TreeLayout
+        mapping_data: dictionary with the mapping file data
+        html_fp: filepath for the output html file
+        output_dir: path to the directory where to store the aux html files
+        compact: if True, the sample ids are only tagged and their
+            descriptions are stored once in a table read by tree_tooltips.js
+        lazy_levels: if not None, only the top 'lazy_levels' levels of the
+            tree are shown, and the collapsed subtrees are loaded when they
+            are expanded (see draw_lazy_tree_html). Implies compact
+    """
+    if lazy_levels is not None:
+        tree_text_html = PAGE_HTML % (get_compact_style_html() +
+            LAZY_SCRIPT_HTML, draw_lazy_tree_html(tree, lazy_levels,
+            mapping_data, output_dir, get_fragments_name(html_fp)))
+    else:
+        tree_text_html = get_interactive_sample_id_tree_html_string(tree,
+            mapping_data, compact)
 
-    # Move 'overlib.js' to the output_dir
-    overlib_js_fp = join(dirname(__file__), OVERLIB_JS)
-    copyfile(overlib_js_fp, os.path.join(output_dir, "overlib.js"))
+    # Move 'overlib.js' (and 'tree_tooltips.js', 'tree_fragments.js') to the
+    # output_dir
+    copy_support_files(output_dir, compact, lazy_levels is not None)
 
     # Save the html file
     outf = open(html_fp, 'w')
@@ -169,6 +568,64 @@ def make_interactive_sample_id_tree_file(tree, mapping_data, html_fp,
 #  tree colored by Jackknife fraction                               #
 #####################################################################
 
+def get_interval_classifier(trans_values):
+    """Returns an IntervalClassifier for 'trans_values'
+
+    Inputs:
+        trans_values: dict of: {(val1, val2): (html_color, label)} or an
+            already built IntervalClassifier, which is returned as is
+    """
+    if isinstance(trans_values, IntervalClassifier):
+        return trans_values
+    return IntervalClassifier(trans_values)
+
+def get_node_support(tree, support=None):
+    """Returns the jackknife support of the nodes of tree in postorder
+
+    Inputs:
+        tree: cogent's tree object or its TreeLayout
+        support: dict of: { 'node_index': dict of {node_name: position},
+            'support': array with the support of each node} (see
+            parse.parse_jackknife_support_arrays), or dict of: {
+            'support_dict': dict of {node_name:float}}. If None, the support
+            of each internal node is taken from its name
+
+    Returns a float array with the support of each node of 'tree' at the
+        position of the node in tree.postorder(). The internal nodes which are
+        not in 'support' take the support from their name, and the rest of
+        nodes get NaN.
+    """
+    if isinstance(tree, TreeLayout):
+        nodes = tree.layout['nodes']
+    else:
+        nodes = list(tree.postorder())
+    result = empty(len(nodes), dtype=float)
+    result.fill(nan)
+    found = zeros(len(nodes), dtype=bool)
+    if support is not None:
+        if 'node_index' in support:
+            node_index = support['node_index']
+            values = asarray(support['support'])
+        else:
+            node_names = support['support_dict'].keys()
+            node_index = dict(zip(node_names, xrange(len(node_names))))
+            values = array([support['support_dict'][node_name]
+                for node_name in node_names], dtype=float)
+        positions = array([node_index.get(node.Name, -1) for node in nodes],
+            dtype=int)
+        found = positions >= 0
+        # The values are widened through their shortest decimal representation
+        # so the float32 values are classified and shown as in the file
+        result[found] = array(values[positions[found]].astype(str),
+            dtype=float)
+    for i, node in enumerate(nodes):
+        if node.Children and not found[i]:
+            try:
+                result[i] = float(node.Name)
+            except (TypeError, ValueError):
+                pass
+    return result
+
 def get_formated_char_html(char, num_trees_considered, fraction, trans_values):
     """Makes a char interactive and colors it by jackknife support
 
@@ -176,17 +633,30 @@ def get_formated_char_html(char, num_trees_considered, fraction, trans_values):
         char: character to format
         num_trees_considered: number of trees used for the jackknife
         fraction: jackknife fraction of the node that represented by 'char'
-        trans_values: dict of: {(val1, val2): (html_color, label)}
+        trans_values: dict of: {(val1, val2): (html_color, label)} or the
+            IntervalClassifier built from it
 
     Returns an html string which applies background color to the char and add a
         pop up message showing the jackknife count and fraction when the mouse
-        is over the char.
+        is over the char. A NaN fraction gets the color of the None values.
     """
     fraction = float(fraction)
     count = num_trees_considered * fraction
-    color = get_matrix_value(fraction, trans_values)
+    color = get_interval_classifier(trans_values)(
+        None if isnan(fraction) else fraction)
     return FORMATED_HTML % (count, fraction, color, char)
 
+def get_html_glyphs(html_string):
+    """Returns the list of glyphs of an HTML string
+
+    Inputs:
+        html_string: string which contains the html code to split
+
+    Returns a list with the html anchors and the single chars of
+        'html_string', in order. The string is scanned only once.
+    """
+    return HTML_GLYPH_RE.findall(html_string)
+
 def get_last_char_of_html_string(html_string):
     """Returns the last char of an HTML string
 
@@ -195,12 +665,10 @@ def get_last_char_of_html_string(html_string):
 
     Returns the last char of 'html_string' but taking in account the html tags
     """
-    if len(html_string) == 0:
+    glyphs = get_html_glyphs(html_string)
+    if not glyphs:
         return ""
-    if html_string[-1] == ">":
-        left, sep, right = html_string.rpartition("<a")
-        return sep + right
-    return html_string[-1]
+    return glyphs[-1]
 
 def remove_first_chars_of_html_string(html_string, num_chars):
     """Removes the X first chars of an HTML string
@@ -212,98 +680,211 @@ def remove_first_chars_of_html_string(html_string, num_chars):
     Returns the 'html_string' string but removing the 'num_chars' first chars
         taking in account the html tags
     """
-    if len(html_string) == 0:
+    return "".join(get_html_glyphs(html_string)[num_chars:])
+
+def get_glyph_palette(classifier):
+    """Returns the list of colors indexed by the glyph records
+
+    Inputs:
+        classifier: IntervalClassifier of the jackknife fractions
+
+    The colors are the plot values of the classifier, followed by the color of
+        the None values and by None, used for the values out of any interval.
+    """
+    return classifier.plot_values + [classifier.none_value, None]
+
+def get_glyph_grid(layout, node_support, classifier):
+    """Builds the glyph records of the HTML-ASCII representation of a tree
+
+    Inputs:
+        layout: tree layout (see get_tree_layout)
+        node_support: array with the jackknife support of the nodes of the
+            tree in postorder (see get_node_support)
+        classifier: IntervalClassifier of the jackknife fractions
+
+    Returns:
+        glyphs: GLYPH_DTYPE array of shape (number of tips, width) with the
+            glyph records of the tree, without the tip names. Row i
+            corresponds to the i-th tip
+        widths: int array with the number of columns used in each row
+    """
+    grid, owners, widths = get_tree_grid(layout, '+')
+    return get_glyph_records(grid, owners, node_support, classifier), widths
+
+def get_node_colors(node_support, classifier):
+    """Returns the index in the glyph palette of the color of each node
+
+    Inputs:
+        node_support: array with the jackknife support of the nodes of the
+            tree in postorder (see get_node_support)
+        classifier: IntervalClassifier of the jackknife fractions
+    """
+    node_colors = classifier.classify_indices(asarray(node_support,
+        dtype=float))
+    node_colors[node_colors < 0] = len(get_glyph_palette(classifier)) - 1
+    return node_colors
+
+def get_glyph_records(grid, owners, node_support, classifier,
+    node_colors=None):
+    """Builds the glyph records of a character grid
+
+    Inputs:
+        grid: char array with the ASCII representation of a tree
+        owners: int array with the position of the node whose jackknife
+            support is shown by each glyph, or -1 (see get_tree_grid)
+        node_support: array with the jackknife support of the nodes of the
+            tree in postorder (see get_node_support)
+        classifier: IntervalClassifier of the jackknife fractions
+        node_colors: colors of the nodes (see get_node_colors). If None,
+            they are computed from node_support
+
+    Returns a GLYPH_DTYPE array of the same shape as grid
+    """
+    glyphs = empty(grid.shape, dtype=GLYPH_DTYPE)
+    glyphs['char'] = grid
+    glyphs['support'] = nan
+    glyphs['color'] = PLAIN_GLYPH
+    glyphs['node'] = owners
+    # The support of each node is classified only once
+    node_support = asarray(node_support, dtype=float)
+    if node_colors is None:
+        node_colors = get_node_colors(node_support, classifier)
+    owned = owners >= 0
+    glyphs['support'][owned] = node_support[owners[owned]]
+    glyphs['color'][owned] = node_colors[owners[owned]]
+    return glyphs
+
+def get_glyph_line_html(glyphs, num_trees_considered, palette,
+    compact=False):
+    """Serializes a line of glyph records to html
+
+    Inputs:
+        glyphs: GLYPH_DTYPE array with the glyph records of the line
+        num_trees_considered: number of trees used for the jackknife
+        palette: list of colors indexed by the glyph records (see
+            get_glyph_palette)
+        compact: if True, the glyphs are only tagged with their color and
+            their node (see COMPACT_GLYPH_HTML) instead of holding their pop
+            up message
+
+    Returns the html string of the line. The adjacent glyphs with the same
+        color and support are merged in a single html anchor, as they show the
+        same pop up message.
+    """
+    if not len(glyphs):
         return ""
-    if num_chars == 0:
-        return html_string
-    if html_string[0] == "<":
-        left, sep, right = html_string.partition("</a>")
-        return remove_first_chars_of_html_string(right, num_chars-1)
-    return remove_first_chars_of_html_string(html_string[1:], num_chars-1)
-
-def asciiArt_length_html(tree, num_trees_considered, trans_values, char1="-"):
+    chars = glyphs['char'].tostring()
+    colors = glyphs['color']
+    support = glyphs['support']
+    same_support = (support[1:] == support[:-1]) | (isnan(support[1:]) &
+        isnan(support[:-1]))
+    same_glyph = (colors[1:] == colors[:-1]) & same_support
+    bounds = concatenate([[0], (~same_glyph).nonzero()[0] + 1, [len(glyphs)]])
+    pieces = []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        color = colors[start]
+        if color == PLAIN_GLYPH:
+            pieces.append(chars[start:stop])
+        elif compact:
+            pieces.append(COMPACT_GLYPH_HTML % (color, glyphs['node'][start],
+                chars[start:stop]))
+        else:
+            fraction = float(support[start])
+            pieces.append(FORMATED_HTML % (num_trees_considered * fraction,
+                fraction, palette[color], chars[start:stop]))
+    return "".join(pieces)
+
+def get_layout_html_lines(layout, num_trees_considered, trans_values,
+    node_support, compact=False):
+    """Returns the list of strings of the HTML-ASCII representation of a layout
+
+    Inputs:
+        layout: tree layout (see get_tree_layout)
+        num_trees_considered: number of trees used for the jackknife
+        trans_values: dict of: {(val1, val2): (html_color, label)} or the
+            IntervalClassifier built from it
+        node_support: array with the jackknife support of the nodes of the
+            tree in postorder (see get_node_support)
+        compact: if True, the glyphs are serialized in compact mode (see
+            get_glyph_line_html)
+    """
+    # Build the classifier only once for the whole tree
+    classifier = get_interval_classifier(trans_values)
+    glyphs, widths = get_glyph_grid(layout, node_support, classifier)
+    palette = get_glyph_palette(classifier)
+    nodes = layout['nodes']
+    return [get_glyph_line_html(glyphs[row, :width], num_trees_considered,
+        palette, compact) + nodes[tip].Name
+        for row, (tip, width) in enumerate(zip(layout['tips'], widths))]
+
+def asciiArt_length_html(tree, num_trees_considered, trans_values, char1="-",
+    node_support=None):
     """Creates a list with an HTML-ASCII representation of the tree
 
     Inputs:
         tree: cogent's tree object
         num_trees_considered: number of trees used for the jackknife
-        trans_values: dict of: {(val1, val2): (html_color, label)}
-        char1: first char to use in the current branch
+        trans_values: dict of: {(val1, val2): (html_color, label)} or the
+            IntervalClassifier built from it
+        char1: first char to use in the root branch
+        node_support: array with the jackknife support of the nodes of 'tree'
+            in postorder (see get_node_support). If None, the support of each
+            internal node is taken from its name
 
     Returns:
         result: list containing the strings which represents the tree rooted
             at 'tree'
         mid: integer which means the middle line of 'result'
     """
-    # Get the length of the current branch - minimum 2 for extra chars
-    LEN = tree.Length or 2
-    # tree is not a tip
-    if tree.Children:
-        result = []
-        mids = []
-        # Loop through the tree's children
-        for child in tree.Children:
-            if child is tree.Children[0]:
-                char2 = get_formated_char_html("/", num_trees_considered,
-                    tree.Name, trans_values)
-            elif child is tree.Children[-1]:
-                char2 = get_formated_char_html("\\", num_trees_considered,
-                    tree.Name, trans_values)
-            else:
-                char2 = '-'
-            # Create HTML-ASCII representation of current child
-            (child_lines, child_mid) = asciiArt_length_html(child,
-                num_trees_considered, trans_values, char2)
-            mids.append(len(result) + child_mid)
-            result.extend(child_lines)
-        # Compute mid of tree
-        low_mid = mids[0]
-        high_mid = mids[-1]
-        mid = (high_mid + low_mid) / 2
-        # Add HTML-ASCII prefixes to the children's representation
-        space_str = ' ' * LEN
-        space_pipe_str = ' ' * (LEN - 1) + get_formated_char_html("|",
-            num_trees_considered, tree.Name, trans_values)
-        prefixes = [space_str] * (low_mid + 1) + [space_pipe_str] * (high_mid -
-            low_mid - 1) + [space_str] * (len(result) - high_mid)
-        if LEN < 2:
-            prefixes[mid] = char1
-        else:
-            prefixes[mid] = char1 + '-' * (LEN - 2) + \
-                get_last_char_of_html_string(prefixes[mid])
-        result = [ p + l for (p, l) in zip(prefixes, result)]
-        return (result, mid)
-    else:
-        return ([char1 + '-' * (LEN-1) + '+' + tree.Name], 0)
+    if node_support is None:
+        node_support = get_node_support(tree)
+    layout = get_tree_layout(tree, char1)
+    return (get_layout_html_lines(layout, num_trees_considered, trans_values,
+        node_support), layout['mid'][-1])
 
 def draw_jackknife_tree_html(tree, num_trees_considered, trans_values,
-    mapping_data):
+    mapping_data, support=None, compact=False):
     """Generates a string with an HTML-ASCII representation of tree
 
     Inputs:
-        tree: cogent's tree object
+        tree: cogent's tree object or its TreeLayout. The tree is not modified
         num_trees_considered: number of trees used for the jackknife
         trans_values: dict of: {(val1, val2): (html_color, label)}
         mapping_data: dictionary with the mapping file data
+        support: parsed jackknife support file (see get_node_support). If
+            None, the support of each internal node is taken from its name
+        compact: if True, the glyphs and the sample ids are only tagged, and
+            the support of the nodes and the sample descriptions are stored
+            once in a table read by tree_tooltips.js. The page must include
+            get_compact_style_html in its head
 
     Returns a string wich contains the html code which shows the jackknife
         cluster samples tree colored by jackknife fraction.
     """
-    # Scale branch lengths
-    unscaled_max_length = max([node.Length for node in tree.tips()])
-    tree.scaleBranchLengths(max_length=100, ultrametric=True)
-    scaled_max_length = max([node.Length for node in tree.tips()])
-    branch_scale = float(unscaled_max_length) / scaled_max_length
-    # Get string lines of HTML-ASCII representation of tree
-    (lines, mid) = asciiArt_length_html(tree, num_trees_considered,
-        trans_values)
-    new_lines = [add_interactive_sample_id(line, mapping_data, '+')
-        for line in lines]
+    tree_layout = get_tree_layout_object(tree)
+    node_support = get_node_support(tree_layout, support)
+    # Get string lines of HTML-ASCII representation of tree, with scaled
+    # branches
+    lines = get_layout_html_lines(tree_layout.get_scaled_layout(),
+        num_trees_considered, trans_values, node_support, compact)
+    branch_scale = tree_layout.get_branch_scale()
+    if compact:
+        new_lines = [add_compact_sample_id(line, '+') for line in lines]
+        pre = COMPACT_PRE_HTML
+    else:
+        new_lines = [add_interactive_sample_id(line, mapping_data, '+')
+            for line in lines]
+        pre = "<pre>"
     output = []
-    output.append("<pre>Scale: 1 dash, slash, backslash ~ " + 
+    output.append(pre + "Scale: 1 dash, slash, backslash ~ " +
         "%.4f branch length units<br>" % branch_scale)
     output.extend(new_lines)
     output.append("</pre>")
+    if compact:
+        nodes = tree_layout.layout['nodes']
+        output.append(get_tree_data_html(mapping_data,
+            [nodes[tip].Name for tip in tree_layout.layout['tips']],
+            num_trees_considered, node_support))
     return "\n".join(output)
 
 def get_legend_table_html(trans_values):
@@ -328,49 +909,329 @@ def get_legend_table_html(trans_values):
     return TABLE_LEGEND_HTML % (rows)
 
 def get_jackknife_tree_html_string(tree, num_trees_considered, trans_values,
-    mapping_data):
+    mapping_data, support=None, compact=False):
     """Generates the full page html code
 
     Inputs:
-        tree: cogent's tree object
+        tree: cogent's tree object or its TreeLayout
         num_trees_considered: number of trees used for the jackknife
         trans_values: dict of: {(val1, val2): (html_color, label)}
         mapping_data: dictionary with the mapping file data
+        support: parsed jackknife support file (see get_node_support)
+        compact: if True, use the compact html code (see
+            draw_jackknife_tree_html)
 
     Returns a string wich contains the full html page code which shows the
         jackknife cluster samples tree colored by jackknife fraction.
     """
     # Get the html code of the tree
     html_string = draw_jackknife_tree_html(tree, num_trees_considered,
-        trans_values, mapping_data)
+        trans_values, mapping_data, support, compact)
     # Get the html code of the legend table
     html_string += get_legend_table_html(trans_values)
+    head = ""
+    if compact:
+        head = get_compact_style_html(get_glyph_palette(
+            get_interval_classifier(trans_values)))
     # Generate the HTML code of the full page
-    return PAGE_HTML % html_string
+    return PAGE_HTML % (head, html_string)
 
 def make_jackknife_tree_html_file(tree, support, trans_values, mapping_data,
-    html_fp, output_dir):
+    html_fp, output_dir, compact=False, lazy_levels=None):
     """Creates the HTML file with the HTML-ASCII representation of tree
 
     Inputs:
-        tree_fp: jackknife named nodes tree
+        tree: jackknife named nodes tree, or its TreeLayout
         support: dict of: { 'trees_considered': int,
-            'support_dict': dict of {node_name:float}}
+            'node_index': dict of {node_name: position},
+            'support': array with the support of each node} (see
+            parse.parse_jackknife_support_arrays) or dict of: {
+            'trees_considered': int, 'support_dict': dict of {node_name:float}}
         trans_values: dict of: {(val1, val2): (html_color, label)}
         mapping_data: dictionary with the mapping file data
         html_fp: output html filepath
         output_dir: output directory which will contains scripts and images
+        compact: if True, the pop up messages are built by tree_tooltips.js
+            from a single table instead of being inlined in every glyph
+        lazy_levels: if not None, only the top 'lazy_levels' levels of the
+            tree are shown, and the collapsed subtrees are loaded when they
+            are expanded (see draw_lazy_tree_html). Implies compact
 
     Generates a html file stored at 'html_fp' with the HTML-ASCII representation
     of 'tree' with the internal nodes colored by jackknife fraction.
     """
     # Generate the string which contains the full page html code
-    tree_text_html = get_jackknife_tree_html_string(tree,
-        support['trees_considered'], trans_values, mapping_data)
-    # Move 'overlib.js' to the output_dir
-    overlib_js_fp = join(dirname(__file__), OVERLIB_JS)
-    copyfile(overlib_js_fp, os.path.join(output_dir, "overlib.js"))
+    if lazy_levels is None:
+        tree_text_html = get_jackknife_tree_html_string(tree,
+            support['trees_considered'], trans_values, mapping_data, support,
+            compact)
+    else:
+        html_string = draw_lazy_tree_html(tree, lazy_levels, mapping_data,
+            output_dir, get_fragments_name(html_fp),
+            support['trees_considered'], trans_values, support)
+        html_string += get_legend_table_html(trans_values)
+        head = get_compact_style_html(get_glyph_palette(
+            get_interval_classifier(trans_values))) + LAZY_SCRIPT_HTML
+        tree_text_html = PAGE_HTML % (head, html_string)
+    # Move 'overlib.js' (and 'tree_tooltips.js', 'tree_fragments.js') to the
+    # output_dir
+    copy_support_files(output_dir, compact, lazy_levels is not None)
     # Save the html file
     outf = open(html_fp, 'w')
     outf.write(tree_text_html)
-    outf.close()
\ No newline at end of file
+    outf.close()
+
+#####################################################################
+#  Functions to get a html file with a lazily expanded tree, whose  #
+#  collapsed subtrees are loaded from fragment files                #
+#####################################################################
+
+def get_layout_children(layout):
+    """Returns the list with the positions of the children of each node
+
+    Inputs:
+        layout: tree layout (see get_tree_layout)
+    """
+    children = [[] for parent in layout['parent']]
+    for position, parent in enumerate(layout['parent']):
+        if parent >= 0:
+            children[parent].append(position)
+    return children
+
+def get_layout_tip_counts(layout):
+    """Returns the list with the number of tips under each node
+
+    Inputs:
+        layout: tree layout (see get_tree_layout)
+    """
+    tip_counts = [0] * len(layout['parent'])
+    for position, (span, parent) in enumerate(zip(layout['span'],
+        layout['parent'])):
+        if span is None:
+            tip_counts[position] += 1
+        if parent >= 0:
+            tip_counts[parent] += tip_counts[position]
+    return tip_counts
+
+def get_sub_layout(layout, root, levels, children=None):
+    """Returns the layout of the top levels of a subtree
+
+    Inputs:
+        layout: tree layout (see get_tree_layout)
+        root: position of the root of the subtree
+        levels: number of levels shown under the root
+        children: list with the positions of the children of each node (see
+            get_layout_children)
+
+    Returns a tree layout with the nodes of the subtree at most 'levels' levels
+        under 'root'. The internal nodes at the last level are shown as tips.
+        The columns are the same as in 'layout', and the layout has two more
+        keys: 'positions', the position in 'layout' of each node, and
+        'collapsed', the positions in the sub layout of the internal nodes
+        shown as tips. Only the shown nodes are visited.
+    """
+    if levels < 1:
+        raise ValueError, "At least one level must be shown: %d" % levels
+    if children is None:
+        children = get_layout_children(layout)
+    positions = []
+    expanded = set()
+    stack = [(root, 0)]
+    while stack:
+        position, depth = stack.pop()
+        positions.append(position)
+        if depth < levels and children[position]:
+            expanded.add(position)
+            stack.extend([(child, depth + 1) for child in children[position]])
+    # The nodes of a subtree are consecutive in postorder
+    positions.sort()
+    index = dict(zip(positions, xrange(len(positions))))
+
+    parents = layout['parent']
+    sub_layout = {'positions': positions, 'collapsed': [], 'mid': [],
+        'span': [], 'tips': []}
+    for key in ['nodes', 'x', 'length', 'char']:
+        sub_layout[key] = [layout[key][position] for position in positions]
+    sub_layout['parent'] = [index.get(parents[position], -1)
+        for position in positions]
+    mids = sub_layout['mid']
+    for i, position in enumerate(positions):
+        if position in expanded:
+            low_mid = mids[index[children[position][0]]]
+            high_mid = mids[index[children[position][-1]]]
+            mids.append((low_mid + high_mid) / 2)
+            sub_layout['span'].append((low_mid, high_mid))
+        else:
+            mids.append(len(sub_layout['tips']))
+            sub_layout['span'].append(None)
+            sub_layout['tips'].append(i)
+            if children[position]:
+                sub_layout['collapsed'].append(i)
+    return sub_layout
+
+def get_fragment_prefix(sub_layout, grid, owners, tip, page_prefix=None):
+    """Returns the first columns of the rows of a collapsed subtree
+
+    Inputs:
+        sub_layout: tree layout of a page (see get_sub_layout)
+        grid, owners: character grid of the page and the owners of its
+            glyphs, as positions in the full layout (see get_lazy_page_grid)
+        tip: position in sub_layout of the collapsed subtree
+        page_prefix: prefix of the page (see below), or None for the main page
+
+    Returns (chars, owners), two arrays with three rows: the rows above the
+        row of the root of the subtree when it is expanded, the row of the
+        root, and the rows below, up to the char which starts the branch of
+        the root, included. Only the row of the root uses this last column,
+        as the page of the subtree does not know the owner of the char. The
+        rows above and below show the pipes of the ancestors which cross the
+        subtree, computed from their spans: the chars of the row of the root
+        can hide them.
+    """
+    x = sub_layout['x'][tip]
+    row = sub_layout['mid'][tip]
+    chars = empty((3, x + 1), dtype='S1')
+    chars.fill(' ')
+    prefix_owners = empty((3, x + 1), dtype=int32)
+    prefix_owners.fill(-1)
+    chars[1] = grid[row, :x + 1]
+    prefix_owners[1] = owners[row, :x + 1]
+    if page_prefix is not None:
+        # The pipes of the ancestors of the root of the page
+        page_chars, page_owners = page_prefix
+        width = page_chars.shape[1] - 1
+        root_mid = sub_layout['mid'][-1]
+        for prefix_row, page_row in [(0, 0 if row <= root_mid else 2),
+            (2, 2 if row >= root_mid else 0)]:
+            chars[prefix_row, :width] = page_chars[page_row, :width]
+            prefix_owners[prefix_row, :width] = page_owners[page_row, :width]
+    # The pipes of the ancestors in the page
+    parent = sub_layout['parent'][tip]
+    while parent >= 0:
+        low_mid, high_mid = sub_layout['span'][parent]
+        column = sub_layout['x'][parent] + sub_layout['length'][parent] - 1
+        for prefix_row, crossed in [(0, low_mid < row <= high_mid),
+            (2, low_mid <= row < high_mid)]:
+            if crossed:
+                chars[prefix_row, column] = '|'
+                prefix_owners[prefix_row, column] = \
+                    sub_layout['positions'][parent]
+        parent = sub_layout['parent'][parent]
+    return chars, prefix_owners
+
+def get_lazy_page_grid(sub_layout, prefix=None):
+    """Writes the glyphs of a sub layout into a character grid
+
+    Inputs:
+        sub_layout: tree layout of a page (see get_sub_layout)
+        prefix: prefix of the root of the page in the page where it is
+            collapsed (see get_fragment_prefix), or None for the main page
+
+    Returns the same values as get_tree_grid, but the owners are positions in
+        the full layout, and the first columns show the pipes of the
+        ancestors of the root of the page.
+    """
+    grid, owners, widths = get_tree_grid(sub_layout, '>')
+    positions = array(sub_layout['positions'], dtype=int32)
+    owned = owners >= 0
+    owners[owned] = positions[owners[owned]]
+    if prefix is not None:
+        chars, prefix_owners = prefix
+        x = chars.shape[1] - 1
+        mid = sub_layout['mid'][-1]
+        grid[:mid, :x] = chars[0, :x]
+        owners[:mid, :x] = prefix_owners[0, :x]
+        grid[mid, :x + 1] = chars[1]
+        owners[mid, :x + 1] = prefix_owners[1]
+        grid[mid + 1:, :x] = chars[2, :x]
+        owners[mid + 1:, :x] = prefix_owners[2, :x]
+    return grid, owners, widths
+
+def get_fragments_name(html_fp):
+    """Returns the name of the directory of the fragments of a lazy tree"""
+    return splitext(basename(html_fp))[0] + FRAGMENTS_SUFFIX
+
+def draw_lazy_tree_html(tree, levels, mapping_data, output_dir,
+    fragments_name, num_trees_considered=None, trans_values=None,
+    support=None):
+    """Generates the html code of the top levels of tree and its fragments
+
+    Inputs:
+        tree: cogent's tree object or its TreeLayout. The tree is not modified
+        levels: number of levels shown in the page and in each fragment
+        mapping_data: dictionary with the mapping file data
+        output_dir: directory where the fragments directory is created
+        fragments_name: name of the fragments directory
+        num_trees_considered: number of trees used for the jackknife
+        trans_values: dict of: {(val1, val2): (html_color, label)}. If None,
+            the branches are not colored
+        support: parsed jackknife support file (see get_node_support)
+
+    Returns a string with the html code of the 'levels' top levels of the tree,
+        in compact mode (see draw_jackknife_tree_html). Each collapsed subtree
+        is written to 'fragments_name/<position>.js' in output_dir, with its
+        own 'levels' top levels, and is loaded by tree_fragments.js when it is
+        expanded. The html code of the page and of each fragment depends only
+        on the nodes shown in it.
+
+    Only the page is lazy: the fragments of every collapsed subtree, at any
+        depth, are written up front, as a static page can not ask for them
+        to be generated. The generation time and the size of the fragments
+        directory grow with the whole tree, not with the expanded levels.
+    """
+    tree_layout = get_tree_layout_object(tree)
+    layout = tree_layout.get_scaled_layout()
+    children = get_layout_children(layout)
+    tip_counts = get_layout_tip_counts(layout)
+    node_support = None
+    if trans_values is not None:
+        node_support = get_node_support(tree_layout, support)
+        classifier = get_interval_classifier(trans_values)
+        palette = get_glyph_palette(classifier)
+        node_colors = get_node_colors(node_support, classifier)
+    fragments_dir = join(output_dir, fragments_name)
+    if not exists(fragments_dir):
+        os.mkdir(fragments_dir)
+
+    # The main page and then the fragments, written as they are collapsed
+    main_html = None
+    pages = [(len(layout['nodes']) - 1, None)]
+    while pages:
+        root, prefix = pages.pop()
+        sub_layout = get_sub_layout(layout, root, levels, children)
+        grid, owners, widths = get_lazy_page_grid(sub_layout, prefix)
+        if node_support is not None:
+            glyphs = get_glyph_records(grid, owners, node_support, classifier,
+                node_colors)
+        lines = []
+        sample_ids = []
+        for row, (tip, width) in enumerate(zip(sub_layout['tips'], widths)):
+            # The tip char is replaced by the html code of the tip name
+            if node_support is None:
+                line = grid[row, :width - 1].tostring()
+            else:
+                line = get_glyph_line_html(glyphs[row, :width - 1],
+                    num_trees_considered, palette, True)
+            position = sub_layout['positions'][tip]
+            if children[position]:
+                pages.append((position, get_fragment_prefix(sub_layout,
+                    grid, owners, tip, prefix)))
+                lines.append(COLLAPSED_HTML % (position, line, fragments_name,
+                    position, tip_counts[position]))
+            else:
+                sample_id = sub_layout['nodes'][tip].Name
+                sample_ids.append(sample_id)
+                lines.append(line + "&#62;" + COMPACT_ID_HTML % sample_id)
+        data = get_tree_data(mapping_data, sample_ids, num_trees_considered,
+            node_support, unique(owners[owners >= 0]).tolist())
+        if prefix is None:
+            main_html = "\n".join([COMPACT_PRE_HTML +
+                "Scale: 1 dash, slash, backslash ~ " +
+                "%.4f branch length units<br>" % tree_layout.get_branch_scale()]
+                + lines + ["</pre>", TREE_DATA_HTML % get_tree_data_json(data)])
+        else:
+            outf = open(join(fragments_dir, "%d.js" % root), 'w')
+            outf.write(FRAGMENT_JS % (root, dumps("\n".join(lines)),
+                get_tree_data_json(data)))
+            outf.close()
+    return main_html
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+
+__author__ = "Jose Antonio Navas Molina"
+__copyright__ = "Copyright 2013, The FastUniFrac Project"
+__credits__ = ["Jose Antonio Navas Molina"]
+__license__ = "GPL"
+__version__ = "1.7.0-dev"
+__maintainer__ = "Jose Antonio Navas Molina"
+__email__ = "josenavasmolina@gmail.com"
+__status__ = "Development"
+
+from hashlib import sha256
+from os import listdir, rename, utime, fdopen, chmod, umask
+from os.path import join, isdir, isfile, getsize, getmtime
+from shutil import rmtree, copyfile
+from tempfile import mkdtemp, mkstemp
+from numpy import array, save, load
+from biom.table import table_factory
+from qiime.format import format_biom_table
+from fastunifrac.sample_id_map_otu_table_conversion import (
+    parse_sample_mapping_fp_to_coo, coo_to_biom_table, coo_to_csr,
+    csr_to_sparse_obj)
+
+# Default maximum size of the cache directory (in bytes)
+DEFAULT_MAX_CACHE_SIZE = 1024 ** 3
+# Size of the blocks read to compute the digest of the input files
+DIGEST_BLOCK_SIZE = 2 ** 20
+
+# Names of the arrays stored for each cached OTU table: the CSR arrays of its
+# sparse matrix (see coo_to_csr) and its ids
+CACHE_ARRAYS = ['indptr', 'indices', 'data', 'sample_ids', 'observation_ids']
+# Name of the file with the formatted biom table of a cache entry
+CACHE_BIOM_FILE = 'table.biom'
+# Prefix of the directories (and files) being written to the cache
+TMP_ENTRY_PREFIX = '.tmp'
+
+def compute_file_digest(fp):
+    """Computes the SHA-256 hex digest of the contents of a file
+
+    Inputs:
+        fp: filepath of the file
+    """
+    digest = sha256()
+    f = open(fp, 'rb')
+    block = f.read(DIGEST_BLOCK_SIZE)
+    while block:
+        digest.update(block)
+        block = f.read(DIGEST_BLOCK_SIZE)
+    f.close()
+    return digest.hexdigest()
+
+def get_umask_mode(mode):
+    """Returns 'mode' without the permission bits cleared by the umask
+
+    Inputs:
+        mode: permission bits, as passed to os.chmod
+
+    mkdtemp and mkstemp create their directories and files readable by the
+        owner only. The cache entries are given the permissions that mkdir
+        and open would have given them, so a cache directory shared by
+        several users can be read by all of them.
+    """
+    # The umask can only be read by setting it
+    current_umask = umask(0)
+    umask(current_umask)
+    return mode & ~current_umask
+
+def get_entry_size(entry_dir):
+    """Returns the size in bytes of a cache entry"""
+    return sum([getsize(join(entry_dir, name)) for name in listdir(entry_dir)])
+
+def load_cached_arrays(cache_dir, digest):
+    """Loads the arrays of a cached OTU table
+
+    Inputs:
+        cache_dir: cache directory
+        digest: digest of the sample mapping file
+
+    Returns a dict of {array name: memory-mapped array} or None if the table
+        is not in the cache. The entry is marked as the most recently used.
+    """
+    entry_dir = join(cache_dir, digest)
+    if not isdir(entry_dir):
+        return None
+    try:
+        arrays = dict([(name, load(join(entry_dir, name + '.npy'),
+            mmap_mode='r')) for name in CACHE_ARRAYS])
+        utime(entry_dir, None)
+    except (IOError, OSError, ValueError):
+        # The entry has been evicted or is corrupted
+        return None
+    return arrays
+
+def store_cached_arrays(cache_dir, digest, arrays):
+    """Stores the arrays of an OTU table in the cache
+
+    Inputs:
+        cache_dir: cache directory
+        digest: digest of the sample mapping file
+        arrays: dict of {array name: array}
+
+    The arrays are written to a temporary directory which is then renamed to
+        its final name, so readers never see a partially written entry.
+    """
+    tmp_dir = mkdtemp(prefix=TMP_ENTRY_PREFIX, dir=cache_dir)
+    for name in CACHE_ARRAYS:
+        save(join(tmp_dir, name + '.npy'), arrays[name])
+    chmod(tmp_dir, get_umask_mode(0777))
+    try:
+        rename(tmp_dir, join(cache_dir, digest))
+    except OSError:
+        # Another process already stored the same table
+        rmtree(tmp_dir, ignore_errors=True)
+
+def get_cached_biom_fp(cache_dir, digest):
+    """Returns the filepath of the formatted biom table of a cache entry
+
+    Inputs:
+        cache_dir: cache directory
+        digest: digest of the sample mapping file
+
+    Returns None if the entry or its formatted table are not in the cache.
+        The entry is marked as the most recently used.
+    """
+    entry_dir = join(cache_dir, digest)
+    biom_fp = join(entry_dir, CACHE_BIOM_FILE)
+    if not isfile(biom_fp):
+        return None
+    try:
+        utime(entry_dir, None)
+    except OSError:
+        # The entry has been evicted
+        return None
+    return biom_fp
+
+def store_cached_biom(cache_dir, digest, biom_string):
+    """Adds the formatted biom table to a cache entry
+
+    Inputs:
+        cache_dir: cache directory
+        digest: digest of the sample mapping file
+        biom_string: formatted biom table
+
+    The table is written to a temporary file which is then renamed to its
+        final name. Nothing is stored if the entry has been evicted.
+    """
+    entry_dir = join(cache_dir, digest)
+    try:
+        fd, tmp_fp = mkstemp(prefix=TMP_ENTRY_PREFIX, dir=entry_dir)
+    except OSError:
+        return
+    out = fdopen(fd, 'w')
+    out.write(biom_string)
+    out.close()
+    chmod(tmp_fp, get_umask_mode(0666))
+    try:
+        rename(tmp_fp, join(entry_dir, CACHE_BIOM_FILE))
+    except OSError:
+        # The entry has been evicted meanwhile
+        pass
+
+def evict_cache_entries(cache_dir, max_size):
+    """Removes the least recently used entries until the cache fits max_size
+
+    Inputs:
+        cache_dir: cache directory
+        max_size: maximum size of the cache in bytes
+    """
+    entries = []
+    total_size = 0
+    for name in listdir(cache_dir):
+        entry_dir = join(cache_dir, name)
+        if name.startswith(TMP_ENTRY_PREFIX) or not isdir(entry_dir):
+            continue
+        try:
+            size = get_entry_size(entry_dir)
+            entries.append((getmtime(entry_dir), size, entry_dir))
+        except OSError:
+            # The entry has been evicted by another process
+            continue
+        total_size += size
+
+    entries.sort()
+    for mtime, size, entry_dir in entries:
+        if total_size <= max_size:
+            break
+        rmtree(entry_dir, ignore_errors=True)
+        total_size -= size
+
+def sample_mapping_fp_to_biom_table(sample_mapping_fp, cache_dir=None,
+    max_cache_size=DEFAULT_MAX_CACHE_SIZE, workers=1):
+    """Converts the UniFrac sample mapping file to biom table object
+
+    Inputs:
+        sample_mapping_fp: filepath of the sample mapping file
+        cache_dir: directory of the cache of converted tables. If None, the
+            cache is not used
+        max_cache_size: maximum size of the cache in bytes
+        workers: number of processes used to parse the file
+
+    The converted tables are stored in 'cache_dir' as memory-mappable NumPy
+        arrays, keyed by the digest of the sample mapping file contents. The
+        arrays are the CSR arrays of the table matrix, which biom uses as
+        they are, so converting the same file again does not parse it nor
+        sort its values.
+    """
+    if cache_dir is None:
+        return coo_to_biom_table(*parse_sample_mapping_fp_to_coo(
+            sample_mapping_fp, workers))
+    return get_cached_biom_table(sample_mapping_fp, cache_dir,
+        compute_file_digest(sample_mapping_fp), max_cache_size, workers)
+
+def get_cached_biom_table(sample_mapping_fp, cache_dir, digest,
+    max_cache_size=DEFAULT_MAX_CACHE_SIZE, workers=1):
+    """Returns the biom table of a sample mapping file through the cache
+
+    Inputs:
+        sample_mapping_fp: filepath of the sample mapping file
+        cache_dir: directory of the cache of converted tables
+        digest: digest of the sample mapping file
+        max_cache_size: maximum size of the cache in bytes
+        workers: number of processes used to parse the file
+
+    See sample_mapping_fp_to_biom_table.
+    """
+    arrays = load_cached_arrays(cache_dir, digest)
+    if arrays is None:
+        rows, cols, values, sample_ids, observation_ids = \
+            parse_sample_mapping_fp_to_coo(sample_mapping_fp, workers)
+        indptr, indices, data = coo_to_csr(rows, cols, values,
+            (len(observation_ids), len(sample_ids)))
+        arrays = {'indptr': indptr, 'indices': indices, 'data': data,
+            'sample_ids': array(sample_ids, dtype=str),
+            'observation_ids': array(observation_ids, dtype=str)}
+        store_cached_arrays(cache_dir, digest, arrays)
+        evict_cache_entries(cache_dir, max_cache_size)
+
+    sample_ids = arrays['sample_ids'].tolist()
+    observation_ids = arrays['observation_ids'].tolist()
+    matrix = csr_to_sparse_obj(arrays['indptr'], arrays['indices'],
+        arrays['data'], (len(observation_ids), len(sample_ids)))
+    return table_factory(matrix, sample_ids, observation_ids)
+
+def sample_mapping_fp_to_biom_file(sample_mapping_fp, output_fp,
+    cache_dir=None, max_cache_size=DEFAULT_MAX_CACHE_SIZE, workers=1):
+    """Converts the UniFrac sample mapping file to a biom file
+
+    Inputs:
+        sample_mapping_fp: filepath of the sample mapping file
+        output_fp: filepath of the biom file
+        cache_dir: directory of the cache of converted tables. If None, the
+            cache is not used
+        max_cache_size: maximum size of the cache in bytes
+        workers: number of processes used to parse the file
+
+    Formatting a biom table costs more than parsing the sample mapping file,
+        so the formatted table is also stored in the cache entry and copied
+        to 'output_fp' when the same file is converted again.
+    """
+    if cache_dir is None:
+        table = sample_mapping_fp_to_biom_table(sample_mapping_fp,
+            workers=workers)
+        out = open(output_fp, 'w')
+        out.write(format_biom_table(table))
+        out.close()
+        return
+
+    digest = compute_file_digest(sample_mapping_fp)
+    biom_fp = get_cached_biom_fp(cache_dir, digest)
+    if biom_fp is not None:
+        copyfile(biom_fp, output_fp)
+        return
+
+    table = get_cached_biom_table(sample_mapping_fp, cache_dir, digest,
+        max_cache_size, workers)
+    biom_string = format_biom_table(table)
+    out = open(output_fp, 'w')
+    out.write(biom_string)
+    out.close()
+    store_cached_biom(cache_dir, digest, biom_string)
+    evict_cache_entries(cache_dir, max_cache_size)
@@ -9,32 +9,176 @@ __maintainer__ = "Jose Antonio Navas Molina"
 __email__ = "josenavasmolina@gmail.com"
 __status__ = "Development"
 
-def parse_jackknife_support_file(lines):
-    """Parses the jackknife support file
+from itertools import islice
+from numpy import array, empty, concatenate, column_stack, int32, float32
+
+# Number of lines of the beta significance output parsed at a time
+BS_CHUNK_LINES = 2 ** 16
+# Data type of the jackknife support values
+JACKKNIFE_SUPPORT_DTYPE = float32
+
+def parse_jackknife_support_arrays(lines, dtype=JACKKNIFE_SUPPORT_DTYPE):
+    """Parses the jackknife support file into a node index and a support array
 
     Inputs:
         lines: jackknife support open file object
+        dtype: data type of the support array
 
     Returns dict of: { 'trees_considered': int,
-                        'support_dict': dict of {node_name:float}}
+                        'node_index': dict of {node_name: position},
+                        'support': array with the support of each node}
+
+    The comment lines are set apart and the support values of all the node
+        lines are converted at once, instead of line by line.
+
+    Note: raises a ValueError if the number of trees considered is missing,
+        if a node line does not have 2 fields (naming the first such line) or
+        if a node is duplicated
     """
-    result = {}
-    dict_support = {}
-    # Loop through all the lines in the file
+    lines = [line.strip() for line in lines]
+    trees_considered = None
+    # In one of the comment lines there is the number of trees used
     for line in lines:
-        if line[0] == '#':
-            # In one of the comment lines there is the number of trees used
+        if line.startswith('#'):
+            comment, sep, num_trees = line.partition(':')
             try:
-                comment, num_trees = line.split(':')
-                result['trees_considered'] = int(num_trees)
-            except:
+                trees_considered = int(num_trees)
+            except ValueError:
                 continue
-        else:
-            node_name, value = line.split('\t')
-            dict_support[node_name] = float(value)
+    if trees_considered is None:
+        raise ValueError, "The number of trees considered is missing in the " \
+            "jackknife support file"
 
-    result['support_dict'] = dict_support
-    return result
+    # Node lines, with their line number in the file
+    rows = [(line_number, line.split('\t'))
+        for line_number, line in enumerate(lines, 1)
+        if line and not line.startswith('#')]
+    bad_rows = [line_number for line_number, fields in rows
+        if len(fields) != 2]
+    if bad_rows:
+        raise ValueError, "Line %d of the jackknife support file must have " \
+            "2 fields" % bad_rows[0]
+    node_names = [fields[0] for line_number, fields in rows]
+    node_index = dict(zip(node_names, xrange(len(node_names))))
+    if len(node_index) != len(node_names):
+        raise ValueError, "There are duplicated nodes in the jackknife " \
+            "support file"
+
+    return {'trees_considered': trees_considered,
+            'node_index': node_index,
+            'support': array([fields[1] for line_number, fields in rows],
+                dtype=dtype)}
+
+def parse_jackknife_support_file(lines):
+    """Parses the jackknife support file
+
+    Inputs:
+        lines: jackknife support open file object
+
+    Returns dict of: { 'trees_considered': int,
+                        'support_dict': dict of {node_name:float}}
+
+    See parse_jackknife_support_arrays to get the support in an array.
+    """
+    result = parse_jackknife_support_arrays(lines, float)
+    support = result['support'].tolist()
+    dict_support = dict([(node_name, support[i])
+        for node_name, i in result['node_index'].iteritems()])
+    return {'trees_considered': result['trees_considered'],
+            'support_dict': dict_support}
+
+def parse_p_values(values):
+    """Parses a list of p value strings
+
+    Inputs:
+        values: list of p value strings. The censored p values are written
+            as '<=value'
+
+    Returns:
+        p_values: float array with the p values
+        censored: bool array, True for the censored p values
+    """
+    censored = array([value[0] == '<' for value in values], dtype=bool)
+    p_values = array([value.split('=')[-1] if value[0] == '<' else value
+        for value in values], dtype=float)
+    return p_values, censored
+
+def parse_beta_significance_output_pairwise_columns(lines,
+    chunk_size=BS_CHUNK_LINES):
+    """Parses the pairwise beta significance output file in columns
+
+    Inputs:
+        lines: beta significance open file object
+        chunk_size: number of lines parsed at a time
+
+    Returns:
+        sample_ids: list with the sample ids, in order of appearance
+        pairs: int32 array of shape (n_pairs, 2) with the indices in
+            'sample_ids' of sample 1 and sample 2
+        p_values: float array of shape (n_pairs, 2) with the p value and the
+            p value corrected of each pair
+        censored: bool array of shape (n_pairs, 2), True where the p value
+            was written as an upper bound ('<=value')
+        test_name: string with the name of the test realized
+
+    The file is read in chunks of 'chunk_size' lines, and each chunk is
+        converted to arrays at once, so the pairs are never stored as Python
+        objects.
+
+    The file is always parsed. To reuse the parsed columns across runs, load
+        the file by its path with
+        beta_significance_cache.load_beta_significance_output_pairwise.
+
+    Note: raises a ValueError if a pair line does not have 4 fields
+    """
+    lines = iter(lines)
+    #Get comment line
+    comment = lines.next()
+    #Pass header line
+    lines.next()
+    sample_index = {}
+    sample_ids = []
+    def get_index(sample):
+        if sample not in sample_index:
+            sample_index[sample] = len(sample_ids)
+            sample_ids.append(sample)
+        return sample_index[sample]
+
+    pairs = []
+    p_values = []
+    censored = []
+    # Line number of the first line of the chunk (the pairs start on line 3)
+    line_number = 3
+    while True:
+        chunk = [line.rstrip('\r\n').split('\t')
+            for line in islice(lines, chunk_size)]
+        if not chunk:
+            break
+        if set(map(len, chunk)) != set([4]):
+            bad_row = [len(row) == 4 for row in chunk].index(False)
+            raise ValueError, "Line %d of the beta significance file must " \
+                "have 4 fields" % (line_number + bad_row)
+        line_number += len(chunk)
+        samples1, samples2, pvals, pvalscorr = zip(*chunk)
+        pairs.append(array([map(get_index, samples1),
+            map(get_index, samples2)], dtype=int32).T)
+        pval, pval_censored = parse_p_values(pvals)
+        pvalcorr, pvalcorr_censored = parse_p_values(pvalscorr)
+        p_values.append(column_stack([pval, pvalcorr]))
+        censored.append(column_stack([pval_censored, pvalcorr_censored]))
+
+    if pairs:
+        pairs = concatenate(pairs)
+        p_values = concatenate(p_values)
+        censored = concatenate(censored)
+    else:
+        pairs = empty((0, 2), dtype=int32)
+        p_values = empty((0, 2), dtype=float)
+        censored = empty((0, 2), dtype=bool)
+
+    test_name = str(comment[1:])
+    test_name = test_name.replace("\n", "")
+    return sample_ids, pairs, p_values, censored, test_name
 
 def parse_beta_significance_output_pairwise(lines):
     """Parses the pairwise beta significance output file
@@ -50,22 +194,14 @@ def parse_beta_significance_output_pairwise(lines):
         comment which indicates the test realized, and the second row contains
         the headers, which should be 'sample 1', 'sample 2', 'p value', 'p value
         (Bonferroni corrected)'. Thus, we start parsing the values on third row.
+        See parse_beta_significance_output_pairwise_columns to keep the
+        censored p values information.
     """
-    #Get comment line
-    comment = lines.next()
-    #Pass header line
-    lines.next()
+    sample_ids, pairs, p_values, censored, test_name = \
+        parse_beta_significance_output_pairwise_columns(lines)
     result = {}
-    for line in lines:
-        sample1, sample2, pval, pvalcorr = line.split('\t')
-        if pval[0] == '<':
-            sym, pval = pval.split('=')
-        if pvalcorr[0] == '<':
-            sym, pvalcorr = pvalcorr.split('=')
-        result[(sample1, sample2)] = (float(pval), float(pvalcorr))
-
-    test_name = str(comment[1:])
-    test_name = test_name.replace("\n", "")
+    for (s1, s2), (pval, pvalcorr) in zip(pairs.tolist(), p_values.tolist()):
+        result[(sample_ids[s1], sample_ids[s2])] = (pval, pvalcorr)
     return result, test_name
 
 def parse_beta_significance_output_each_sample(lines):
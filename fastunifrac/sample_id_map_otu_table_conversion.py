@@ -10,9 +10,23 @@ __maintainer__ = "Cathy Lozupone"
 __email__ = "lozupone@colorado.edu"
 __status__ = "Development"
 
-from biom.table import table_factory
+from biom.table import table_factory, SparseObj
 from string import letters, digits, maketrans
-from copy import deepcopy
+from numpy import (empty, concatenate, int32, uint32, int64, float64, arange,
+    searchsorted, diff)
+from multiprocessing import Pool
+from os.path import getsize
+from warnings import warn
+
+# Initial number of entries of the COO buffers used to build the biom table
+COO_CHUNK_SIZE = 4096
+# Number of bytes read at a time by the parallel parser
+LINE_BLOCK_SIZE = 2 ** 20
+# Maximum number of sanitized sample ids kept in each cache generation
+SAMPLE_ID_CACHE_SIZE = 65536
+# Attributes of an empty biom CSMat that hold its compressed arrays. They are
+# not part of the biom API, so they are checked before being assigned
+CSMAT_CSR_ATTRIBUTES = ['_pkd_ax', '_unpkd_ax', '_values', '_order']
 
 def build_sample_ids_transtable():
     """Build translation table for sample ids being MIENS compliant"""
@@ -24,90 +38,487 @@ def build_sample_ids_transtable():
         "."*len(non_valid_sample_id_chars))
     return trans_table
 
-def parse_sample_mapping(lines):
+class SampleIdSanitizer(object):
+    """Translates sample ids into MIENS compliant sample ids
+
+    The translation table is built only once and the translated ids are
+    cached by raw id, so a sample id repeated along a file is translated only
+    once. The cache keeps two generations of ids: when the current one is full
+    it replaces the old one, and ids found in the old one are moved back to the
+    current one. This approximates a LRU policy using plain dict lookups.
+    """
+
+    def __init__(self, max_size=SAMPLE_ID_CACHE_SIZE):
+        self.trans_table = build_sample_ids_transtable()
+        self.max_size = max_size
+        self._current = {}
+        self._old = {}
+
+    def __call__(self, raw_id, owners=None):
+        """Returns the MIENS compliant version of 'raw_id'
+
+        Inputs:
+            raw_id: sample id to translate
+            owners: optional dict of {MIENS id: raw id} with the ids already
+                translated from the same file. It is updated in place and used
+                to detect two different raw ids translated to the same MIENS id
+                (see check_sample_id_owner)
+        """
+        try:
+            sample_id = self._current[raw_id]
+        except KeyError:
+            try:
+                sample_id = self._old[raw_id]
+            except KeyError:
+                sample_id = raw_id.translate(self.trans_table)
+            if len(self._current) >= self.max_size:
+                self._old = self._current
+                self._current = {}
+            self._current[raw_id] = sample_id
+
+        if owners is not None:
+            check_sample_id_owner(owners, sample_id, raw_id)
+
+        return sample_id
+
+def check_sample_id_owner(owners, sample_id, raw_id):
+    """Records in 'owners' that 'raw_id' is translated to 'sample_id'
+
+    Inputs:
+        owners: dict of {MIENS id: raw id} with the ids already translated
+        sample_id: MIENS compliant id
+        raw_id: sample id translated to 'sample_id'
+
+    Issues a warning if a different raw id is already translated to
+        'sample_id'. The two raw ids are still merged into the same sample, as
+        the converters have always done.
+    """
+    owner = owners.setdefault(sample_id, raw_id)
+    if owner != raw_id:
+        warn(("Sample ids '%s' and '%s' are both translated to the MIENS " +
+            "compliant id '%s' and are merged into the same sample") % (owner,
+            raw_id, sample_id))
+
+# Sanitizer shared by all the converters
+SAMPLE_ID_SANITIZER = SampleIdSanitizer()
+
+def parse_sample_mapping(lines, check_collisions=False):
     """Parses the UniFrac sample mapping file (environment file)
 
     The sample mapping file is a required input for the UniFrac web interface.
     Returns a dict of OTU names mapped to sample:count dictionaries.
     This code is used to convert this file to an OTU table for QIIME
 
-    Corrects the sample ids to be MIENS compliant
-    """
-    #add the count of 1 if count info is not supplied
-    new_lines = []
-    for line in lines:
-        line = line.strip().split('\t')
-        if len(line) == 2:
-            line.append('1')
-        new_lines.append(line)
-
-    trans_table = build_sample_ids_transtable()
+    Corrects the sample ids to be MIENS compliant. If 'check_collisions' is
+    True, a warning is issued when two sample ids are corrected to the same
+    MIENS id
 
-    all_sample_names = [line[1].translate(trans_table) for line in new_lines]
-    all_sample_names = set(all_sample_names)
+    The returned dict is sparse: the sample:count dictionary of an OTU only
+    contains the samples in which the OTU has been observed.
+    """
+    owners = {} if check_collisions else None
+    # MIENS compliant id of each raw id, so each raw id is sanitized once
+    sample_names = {}
+    all_sample_names = set()
     #create a dict of dicts with the OTU name mapped to a dictionary of
     #sample names with counts
     OTU_sample_info = {}
-    for line in new_lines:
+    for line in lines:
+        line = line.strip().split('\t')
         OTU_name = line[0]
-        if OTU_name not in OTU_sample_info:
-            sample_info = dict([(i,'0') for i in all_sample_names])
-            OTU_sample_info[OTU_name] = deepcopy(sample_info)
-        sample_name = line[1].translate(trans_table)
-        count = line[2]
-        OTU_sample_info[OTU_name][sample_name] = count
+        try:
+            sample_name = sample_names[line[1]]
+        except KeyError:
+            sample_name = SAMPLE_ID_SANITIZER(line[1], owners)
+            sample_names[line[1]] = sample_name
+        #add the count of 1 if count info is not supplied
+        count = line[2] if len(line) > 2 else '1'
+        all_sample_names.add(sample_name)
+        try:
+            OTU_sample_info[OTU_name][sample_name] = count
+        except KeyError:
+            OTU_sample_info[OTU_name] = {sample_name: count}
     return OTU_sample_info, all_sample_names
 
 def sample_mapping_to_otu_table(lines):
     """Converts the UniFrac sample mapping file to an OTU table
     
     The sample mapping file is a required input for the UniFrac web interface.
-    """
-    out = ["#Full OTU Counts"]
-    header = ["#OTU ID"]
 
+    Yields the lines of the OTU table one at a time. The zero counts are only
+    filled in when each OTU row is written.
+    """
     OTU_sample_info, all_sample_names = parse_sample_mapping(lines)
-    all_sample_names = list(all_sample_names)
-    all_sample_names.sort()
-    header.extend(all_sample_names)
-    out.append('\t'.join(header))
-    for OTU in OTU_sample_info:
-        new_line = []
-        new_line.append(OTU)
-        for sample in all_sample_names:
-            new_line.append(OTU_sample_info[OTU][sample])
-        out.append('\t'.join(new_line))
-    return out
-
-def sample_mapping_to_biom_table(lines):
-    """Converts the UniFrac sample mapping file to biom table object
-    
-    The sample mapping file is a required input for the UniFrac web interface.
+    all_sample_names = sorted(all_sample_names)
 
-    Corrects the sample ids to be MIENS compliant
-    """
-    trans_table = build_sample_ids_transtable()
+    yield "#Full OTU Counts"
+    yield '\t'.join(["#OTU ID"] + all_sample_names)
+    for OTU, sample_info in OTU_sample_info.iteritems():
+        new_line = [OTU]
+        new_line.extend([sample_info.get(sample, '0')
+            for sample in all_sample_names])
+        yield '\t'.join(new_line)
 
-    data = []
+def parse_sample_mapping_to_coo(lines, owners=None):
+    """Parses the UniFrac sample mapping file into COO arrays
+
+    Inputs:
+        lines: sample mapping open file object (or list of lines)
+        owners: optional dict of {MIENS id: raw id} filled with the sample ids
+            translations, used to warn about collisions. If None, the
+            collisions are not checked
+
+    Returns:
+        rows: int32 array with the observation index of each line
+        cols: int32 array with the sample index of each line
+        values: float64 array with the count of each line
+        sample_ids: list of MIENS compliant sample ids in first-seen order
+        observation_ids: list of observation ids in first-seen order
+
+    Corrects the sample ids to be MIENS compliant. The lines of two sample ids
+    corrected to the same MIENS id are merged into the same sample.
+
+    The file is processed in a single streaming pass: sample and observation
+    ids get a dense index through a dict (in first-seen order, the raw sample
+    ids are only sanitized the first time they are seen) and the
+    (observation, sample, count) triplets are stored in typed arrays which
+    double their capacity when full, so the parsing is linear in the
+    number of lines.
+    """
     sample_ids = []
+    sample_index = {}
+    # Index of each raw sample id, so each raw id is sanitized once
+    raw_sample_index = {}
     observation_ids = []
+    observation_index = {}
+
+    capacity = COO_CHUNK_SIZE
+    rows = empty(capacity, dtype=int32)
+    cols = empty(capacity, dtype=int32)
+    values = empty(capacity, dtype=float64)
+    n_values = 0
     for line in lines:
         fields = line.strip().split()
         observation_id = fields[0]
-        sample_id = fields[1].translate(trans_table)
         count = float(fields[2])
-        
+
         try:
-            sample_idx = sample_ids.index(sample_id)
-        except ValueError:
-            sample_idx = len(sample_ids)
-            sample_ids.append(sample_id)
+            sample_idx = raw_sample_index[fields[1]]
+        except KeyError:
+            sample_id = SAMPLE_ID_SANITIZER(fields[1], owners)
+            try:
+                sample_idx = sample_index[sample_id]
+            except KeyError:
+                sample_idx = len(sample_ids)
+                sample_index[sample_id] = sample_idx
+                sample_ids.append(sample_id)
+            raw_sample_index[fields[1]] = sample_idx
         try:
-            observation_idx = observation_ids.index(observation_id)
-        except ValueError:
+            observation_idx = observation_index[observation_id]
+        except KeyError:
             observation_idx = len(observation_ids)
+            observation_index[observation_id] = observation_idx
             observation_ids.append(observation_id)
-            
-        data.append([observation_idx, sample_idx, count])
+
+        # Grow the COO buffers if they are full
+        if n_values == capacity:
+            capacity *= 2
+            rows.resize(capacity, refcheck=False)
+            cols.resize(capacity, refcheck=False)
+            values.resize(capacity, refcheck=False)
+
+        rows[n_values] = observation_idx
+        cols[n_values] = sample_idx
+        values[n_values] = count
+        n_values += 1
+
+    return (rows[:n_values], cols[:n_values], values[:n_values], sample_ids,
+        observation_ids)
+
+def find_line_start(f, offset):
+    """Returns the offset of the first line which starts at or after offset
+
+    Inputs:
+        f: file object opened in binary mode
+        offset: byte offset, greater than 0
+
+    The lines may end in '\n', '\r' or '\r\n', as in the universal newlines
+        mode. Returns the size of the file if no line starts after offset.
+    """
+    f.seek(offset - 1)
+    block_start = offset - 1
+    block = f.read(LINE_BLOCK_SIZE)
+    while block:
+        ends = [pos for pos in (block.find('\n'), block.find('\r'))
+            if pos >= 0]
+        if ends:
+            line_end = block_start + min(ends)
+            f.seek(line_end)
+            if f.read(2) == '\r\n':
+                return line_end + 2
+            return line_end + 1
+        block_start += len(block)
+        block = f.read(LINE_BLOCK_SIZE)
+    return block_start
+
+def get_chunk_boundaries(sample_mapping_fp, n_chunks):
+    """Splits a file into byte ranges aligned on newlines
+
+    Inputs:
+        sample_mapping_fp: filepath of the sample mapping file
+        n_chunks: number of ranges to split the file in
+
+    Returns a list of (start, end) byte offsets, in file order, such that
+        every range starts at the beginning of a line ('\n', '\r' and
+        '\r\n' end a line). Fewer than 'n_chunks' ranges are returned if the
+        file has not enough lines.
+    """
+    size = getsize(sample_mapping_fp)
+    boundaries = [0]
+    with open(sample_mapping_fp, 'rb') as f:
+        for i in range(1, n_chunks):
+            offset = size * i / n_chunks
+            if offset <= boundaries[-1]:
+                continue
+            # Move to the beginning of the next line
+            offset = find_line_start(f, offset)
+            if boundaries[-1] < offset < size:
+                boundaries.append(offset)
+    boundaries.append(size)
+    return zip(boundaries[:-1], boundaries[1:])
+
+def read_lines_in_range(sample_mapping_fp, start, end):
+    """Yields the lines of a file in the byte range [start, end)
+
+    The range must start at the beginning of a line (see
+        get_chunk_boundaries). The lines are split on '\n', '\r' and '\r\n',
+        as the serial parser does with the universal newlines mode, and are
+        yielded with their line ending.
+    """
+    with open(sample_mapping_fp, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        # The last line of a block may continue in the next one
+        pending = ''
+        while remaining > 0:
+            block = f.read(min(LINE_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            lines = (pending + block).splitlines(True)
+            pending = lines.pop()
+            for line in lines:
+                yield line
+        if pending:
+            yield pending
+
+def parse_sample_mapping_chunk(args):
+    """Parses a byte range of the sample mapping file into COO arrays
+
+    Inputs:
+        args: tuple of (sample_mapping_fp, start, end, check_collisions)
+
+    Returns the output of parse_sample_mapping_to_coo for the lines in the
+        range, plus the dict of {MIENS id: raw id} of its sample ids (None if
+        'check_collisions' is False).
+    """
+    sample_mapping_fp, start, end, check_collisions = args
+    owners = {} if check_collisions else None
+    result = parse_sample_mapping_to_coo(read_lines_in_range(
+        sample_mapping_fp, start, end), owners)
+    return result + (owners,)
+
+def parallel_parse_sample_mapping_to_coo(sample_mapping_fp, workers,
+    check_collisions=False):
+    """Parses the UniFrac sample mapping file into COO arrays in parallel
+
+    Inputs:
+        sample_mapping_fp: filepath of the sample mapping file
+        workers: number of processes used to parse the file
+        check_collisions: if True, a warning is issued when two sample ids
+            are corrected to the same MIENS id
+
+    Returns the same output as parse_sample_mapping_to_coo, including the
+        first-seen order of the sample and observation ids.
+
+    The file is split in byte ranges aligned on newlines, which are parsed in
+    a process pool. The per-chunk ids are then merged in file order into
+    global dense ids, and the chunk indices are remapped with a single array
+    lookup per chunk.
+    """
+    chunks = get_chunk_boundaries(sample_mapping_fp, workers)
+    pool = Pool(min(workers, len(chunks)) or 1)
+    try:
+        results = pool.map(parse_sample_mapping_chunk,
+            [(sample_mapping_fp, start, end, check_collisions)
+                for start, end in chunks])
+    finally:
+        pool.close()
+        pool.join()
+
+    owners = {}
+    sample_ids = []
+    sample_index = {}
+    observation_ids = []
+    observation_index = {}
+    all_rows = []
+    all_cols = []
+    all_values = []
+    for rows, cols, values, c_sample_ids, c_observation_ids, c_owners in \
+        results:
+        # Check for collisions between the sample ids of different chunks
+        if check_collisions:
+            for sample_id, raw_id in c_owners.iteritems():
+                check_sample_id_owner(owners, sample_id, raw_id)
+        # Get the global index of the chunk ids, adding the new ones
+        sample_remap = empty(len(c_sample_ids), dtype=int32)
+        for i, sample_id in enumerate(c_sample_ids):
+            try:
+                sample_remap[i] = sample_index[sample_id]
+            except KeyError:
+                sample_remap[i] = sample_index[sample_id] = len(sample_ids)
+                sample_ids.append(sample_id)
+        observation_remap = empty(len(c_observation_ids), dtype=int32)
+        for i, observation_id in enumerate(c_observation_ids):
+            try:
+                observation_remap[i] = observation_index[observation_id]
+            except KeyError:
+                observation_remap[i] = observation_index[observation_id] = \
+                    len(observation_ids)
+                observation_ids.append(observation_id)
+
+        all_rows.append(observation_remap[rows])
+        all_cols.append(sample_remap[cols])
+        all_values.append(values)
+
+    return (concatenate(all_rows), concatenate(all_cols),
+        concatenate(all_values), sample_ids, observation_ids)
+
+def parse_sample_mapping_fp_to_coo(sample_mapping_fp, workers=1,
+    check_collisions=False):
+    """Parses the sample mapping file into COO arrays
+
+    Inputs:
+        sample_mapping_fp: filepath of the sample mapping file
+        workers: number of processes used to parse the file
+        check_collisions: if True, a warning is issued when two sample ids
+            are corrected to the same MIENS id
+    """
+    if workers > 1:
+        return parallel_parse_sample_mapping_to_coo(sample_mapping_fp,
+            workers, check_collisions)
+    with open(sample_mapping_fp, 'U') as f:
+        return parse_sample_mapping_to_coo(f,
+            {} if check_collisions else None)
+
+def coo_to_csr(rows, cols, values, shape):
+    """Converts a set of COO arrays into CSR arrays
+
+    Inputs:
+        rows: array with the row index of each value
+        cols: array with the column index of each value
+        values: array with the values
+        shape: (number of rows, number of columns) of the matrix
+
+    Returns:
+        indptr: uint32 array with the position in 'indices' and 'data' of the
+            first value of each row, plus the number of values
+        indices: uint32 array with the column index of each value
+        data: float64 array with the values
+
+    The zero values are not stored, as biom does. The values are sorted by
+        row and column with a stable sort, so repeated cells keep their order.
+    """
+    present = values != 0
+    rows = rows[present]
+    cols = cols[present]
+    values = values[present]
+    n_rows, n_cols = shape
+    order = (rows.astype(int64) * n_cols + cols).argsort(kind='mergesort')
+    indptr = searchsorted(rows[order], arange(n_rows + 1)).astype(uint32)
+    return indptr, cols[order].astype(uint32), values[order].astype(float64)
+
+def has_csmat_csr_attributes(matrix):
+    """Returns True if 'matrix' is an empty CSMat with the expected internals
+
+    Inputs:
+        matrix: empty matrix of the biom sparse backend
+    """
+    return (all([hasattr(matrix, name) for name in CSMAT_CSR_ATTRIBUTES])
+        and matrix._order == 'coo' and not matrix.hasUpdates())
+
+def csr_to_sparse_obj(indptr, indices, data, shape):
+    """Builds the biom sparse matrix of a set of CSR arrays
+
+    Inputs:
+        indptr, indices, data: CSR arrays as returned by coo_to_csr
+        shape: (number of rows, number of columns) of the matrix
+
+    Returns a matrix of the sparse backend used by biom, built from the arrays
+        without converting every value into a Python object. The CSMat
+        backend keeps the CSR arrays as they are, and the ScipySparseMat
+        backend takes them as COO arrays.
+
+    The CSR arrays are assigned to the CSMat attributes listed in
+        CSMAT_CSR_ATTRIBUTES. If the biom version in use does not have them,
+        the matrix is built through the public CSMat.bulkCOOUpdate instead,
+        which is slower but gives the same matrix.
+    """
+    n_rows, n_cols = shape
+    rows = arange(n_rows).repeat(diff(indptr))
+    if SparseObj.__name__ == 'ScipySparseMat':
+        return SparseObj(n_rows, n_cols, dtype=float,
+            data=(data, (rows, indices)))
+
+    matrix = SparseObj(n_rows, n_cols, dtype=float)
+    if not has_csmat_csr_attributes(matrix):
+        matrix.bulkCOOUpdate(rows, indices, data)
+        matrix.convert('csr')
+        return matrix
+    matrix._pkd_ax = indptr
+    matrix._unpkd_ax = indices
+    matrix._values = data
+    matrix._order = 'csr'
+    return matrix
+
+def coo_to_sparse_obj(rows, cols, values, shape):
+    """Builds the biom sparse matrix of a set of COO arrays
+
+    Inputs:
+        rows: array with the row index of each value
+        cols: array with the column index of each value
+        values: array with the values
+        shape: (number of rows, number of columns) of the matrix
+
+    See coo_to_csr and csr_to_sparse_obj.
+    """
+    indptr, indices, data = coo_to_csr(rows, cols, values, shape)
+    return csr_to_sparse_obj(indptr, indices, data, shape)
+
+def coo_to_biom_table(rows, cols, values, sample_ids, observation_ids):
+    """Builds a biom table object from COO arrays
+
+    Inputs:
+        rows: array with the observation index of each value
+        cols: array with the sample index of each value
+        values: array with the values
+        sample_ids: list of sample ids
+        observation_ids: list of observation ids
+
+    The arrays are handed to biom as a sparse matrix (see coo_to_sparse_obj).
+    """
+    data = coo_to_sparse_obj(rows, cols, values,
+        (len(observation_ids), len(sample_ids)))
+    return table_factory(data, sample_ids, observation_ids)
+
+def sample_mapping_to_biom_table(lines, check_collisions=False):
+    """Converts the UniFrac sample mapping file to biom table object
     
-    return table_factory(data,sample_ids,observation_ids)
\ No newline at end of file
+    The sample mapping file is a required input for the UniFrac web interface.
+
+    Corrects the sample ids to be MIENS compliant. The lines of two sample ids
+    corrected to the same MIENS id are merged into the same sample. If
+    'check_collisions' is True, a warning is issued for those sample ids
+    """
+    return coo_to_biom_table(*parse_sample_mapping_to_coo(lines,
+        {} if check_collisions else None))
@@ -0,0 +1,71 @@
+// Client-side image map for the FastUniFrac heatmaps.
+//
+// Instead of one AREA tag per cell, every heatmap ships a small data file
+// which calls heatmapRegister with the geometry of the cells, the sample ids,
+// the sample descriptions and the cell values. The cell under the mouse is
+// computed from the mouse coordinates and its label is shown with overlib.
+//
+// The values are either a full matrix ("values") or the upper triangle of a
+// symmetric matrix stored row by row ("condensed").
+
+var heatmapData = {};
+var heatmapLastCell = {};
+
+function heatmapRegister(name, data) {
+    heatmapData[name] = data;
+}
+
+function heatmapGetValue(data, row, col) {
+    if (!data.condensed)
+        return data.values[row][col];
+    if (row >= col)
+        return null;
+    var n = data.ver.length;
+    return data.condensed[n * row - row * (row + 1) / 2 + col - row - 1];
+}
+
+function heatmapGetCell(data, x, y) {
+    var col = Math.round((x - data.x0) / data.dx);
+    var row = Math.round((y - data.y0) / data.dy);
+    if (row < 0 || row >= data.ver.length || col < 0 || col >= data.hor.length)
+        return null;
+    if (heatmapGetValue(data, row, col) === null)
+        return null;
+    return [row, col];
+}
+
+function heatmapGetLabel(data, row, col) {
+    var sample1 = data.ver[row];
+    var sample2 = data.hor[col];
+    return "<b>" + sample1 + " vs " + sample2 + ":</b> " +
+        heatmapGetValue(data, row, col) +
+        "<br><br><i>" + sample1 + ":</i> " + data.desc[sample1] +
+        "<br><br><i>" + sample2 + ":</i> " + data.desc[sample2];
+}
+
+function heatmapOver(e, name) {
+    var data = heatmapData[name];
+    if (!data)
+        return true;
+    e = e || window.event;
+    var img = e.target || e.srcElement;
+    var x = e.offsetX, y = e.offsetY;
+    if (x === undefined) {
+        var rect = img.getBoundingClientRect();
+        x = e.clientX - rect.left;
+        y = e.clientY - rect.top;
+    }
+    var cell = heatmapGetCell(data, x, y);
+    var key = cell === null ? null : cell.join(",");
+    if (key === heatmapLastCell[name])
+        return true;
+    heatmapLastCell[name] = key;
+    if (cell === null)
+        return nd();
+    return overlib(heatmapGetLabel(data, cell[0], cell[1]));
+}
+
+function heatmapOut(name) {
+    heatmapLastCell[name] = null;
+    return nd();
+}
@@ -0,0 +1,173 @@
+// Tile viewer for the FastUniFrac tiled heatmaps.
+//
+// The heatmap is stored as a pyramid of fixed-size tiles: the level z is
+// tile_size * 2^z pixels wide and the level 0 is an overview of the whole
+// matrix. Only the tiles visible in the viewport are loaded. The overview is
+// stretched behind them, so there is always something on screen.
+//
+// The cell values are stored in blocks of rows, which are loaded the first
+// time the mouse is over one of their rows. The values of a symmetric matrix
+// are the upper triangle stored row by row ("condensed"), as in heatmap_map.js.
+
+var heatmapTiles = null;
+var heatmapTilesLevel = 0;
+var heatmapTilesLoaded = {};
+var heatmapTilesBlocks = {};
+var heatmapTilesCell = null;
+
+function heatmapTilesRegister(data) {
+    heatmapTiles = data;
+}
+
+function heatmapTilesValues(block, values) {
+    heatmapTilesBlocks[block] = values;
+    // Show the tooltip of the cell which was waiting for this block
+    var cell = heatmapTilesCell;
+    if (cell !== null &&
+        Math.floor(cell[0] / heatmapTiles.block_rows) === block)
+        heatmapTilesShow(cell[0], cell[1]);
+}
+
+function heatmapTilesLoadBlock(block) {
+    heatmapTilesBlocks[block] = null;
+    var script = document.createElement("script");
+    script.type = "text/javascript";
+    script.src = heatmapTiles.path + "values/" + block + ".js";
+    document.getElementsByTagName("head")[0].appendChild(script);
+}
+
+// Returns the value of a cell, null if the cell has no value or undefined if
+// its block is not loaded yet
+function heatmapTilesGetValue(row, col) {
+    if (heatmapTiles.condensed && row >= col)
+        return null;
+    var block = Math.floor(row / heatmapTiles.block_rows);
+    if (!(block in heatmapTilesBlocks))
+        heatmapTilesLoadBlock(block);
+    var values = heatmapTilesBlocks[block];
+    if (values === null)
+        return undefined;
+    var start = block * heatmapTiles.block_rows;
+    if (!heatmapTiles.condensed)
+        return values[row - start][col];
+    var n = heatmapTiles.n_rows;
+    var offset = n * start - start * (start + 1) / 2;
+    return values[n * row - row * (row + 1) / 2 + col - row - 1 - offset];
+}
+
+function heatmapTilesShow(row, col) {
+    // The tooltip is shown once the block of the cell is loaded
+    var value = heatmapTilesGetValue(row, col);
+    if (value === undefined || value === null || isNaN(value))
+        return nd();
+    var sample1 = heatmapTiles.ver[row];
+    var sample2 = heatmapTiles.hor[col];
+    return overlib("<b>" + sample1 + " vs " + sample2 + ":</b> " + value +
+        "<br><br><i>" + sample1 + ":</i> " + heatmapTiles.desc[sample1] +
+        "<br><br><i>" + sample2 + ":</i> " + heatmapTiles.desc[sample2]);
+}
+
+function heatmapTilesLevelSize(level) {
+    return heatmapTiles.tile_size * Math.pow(2, level);
+}
+
+function heatmapTilesCellSize(level) {
+    var n_cells = Math.max(heatmapTiles.n_rows, heatmapTiles.n_cols);
+    return heatmapTilesLevelSize(level) / n_cells;
+}
+
+function heatmapTilesSetLevel(level) {
+    var viewport = document.getElementById("tiles_viewport");
+    var canvas = document.getElementById("tiles_canvas");
+    level = Math.max(0, Math.min(heatmapTiles.levels - 1, level));
+    // Keep the center of the viewport
+    var old_size = heatmapTilesLevelSize(heatmapTilesLevel);
+    var cx = (viewport.scrollLeft + viewport.clientWidth / 2) / old_size;
+    var cy = (viewport.scrollTop + viewport.clientHeight / 2) / old_size;
+
+    heatmapTilesLevel = level;
+    heatmapTilesLoaded = {};
+    while (canvas.firstChild)
+        canvas.removeChild(canvas.firstChild);
+    var cell = heatmapTilesCellSize(level);
+    var width = Math.ceil(heatmapTiles.n_cols * cell);
+    var height = Math.ceil(heatmapTiles.n_rows * cell);
+    canvas.style.width = width + "px";
+    canvas.style.height = height + "px";
+    canvas.style.backgroundColor = heatmapTiles.background;
+    canvas.style.backgroundImage = "url('" + heatmapTiles.path + "0/0_0.png')";
+    canvas.style.backgroundSize = width + "px " + height + "px";
+
+    var size = heatmapTilesLevelSize(level);
+    viewport.scrollLeft = cx * size - viewport.clientWidth / 2;
+    viewport.scrollTop = cy * size - viewport.clientHeight / 2;
+    document.getElementById("tiles_level").innerHTML =
+        "Zoom level " + (level + 1) + " of " + heatmapTiles.levels;
+    heatmapTilesUpdate();
+}
+
+function heatmapTilesUpdate() {
+    var viewport = document.getElementById("tiles_viewport");
+    var canvas = document.getElementById("tiles_canvas");
+    var ts = heatmapTiles.tile_size;
+    var level = heatmapTilesLevel;
+    var cell = heatmapTilesCellSize(level);
+    var n_tile_rows = Math.ceil(Math.ceil(heatmapTiles.n_rows * cell) / ts);
+    var n_tile_cols = Math.ceil(Math.ceil(heatmapTiles.n_cols * cell) / ts);
+    var r0 = Math.floor(viewport.scrollTop / ts);
+    var r1 = Math.min(n_tile_rows - 1,
+        Math.floor((viewport.scrollTop + viewport.clientHeight - 1) / ts));
+    var c0 = Math.floor(viewport.scrollLeft / ts);
+    var c1 = Math.min(n_tile_cols - 1,
+        Math.floor((viewport.scrollLeft + viewport.clientWidth - 1) / ts));
+    for (var r = r0; r <= r1; r++) {
+        for (var c = c0; c <= c1; c++) {
+            var key = r + "_" + c;
+            if (heatmapTilesLoaded[key])
+                continue;
+            heatmapTilesLoaded[key] = true;
+            var img = document.createElement("img");
+            img.style.left = (c * ts) + "px";
+            img.style.top = (r * ts) + "px";
+            // Tiles without values are not written
+            img.onerror = function() { this.style.display = "none"; };
+            img.src = heatmapTiles.path + level + "/" + key + ".png";
+            canvas.appendChild(img);
+        }
+    }
+}
+
+function heatmapTilesZoom(step) {
+    heatmapTilesSetLevel(heatmapTilesLevel + step);
+    return false;
+}
+
+function heatmapTilesOver(e) {
+    e = e || window.event;
+    var canvas = document.getElementById("tiles_canvas");
+    var rect = canvas.getBoundingClientRect();
+    var cell = heatmapTilesCellSize(heatmapTilesLevel);
+    var col = Math.floor((e.clientX - rect.left) / cell);
+    var row = Math.floor((e.clientY - rect.top) / cell);
+    if (row < 0 || row >= heatmapTiles.n_rows || col < 0 ||
+        col >= heatmapTiles.n_cols) {
+        heatmapTilesCell = null;
+        return nd();
+    }
+    heatmapTilesCell = [row, col];
+    return heatmapTilesShow(row, col);
+}
+
+function heatmapTilesOut() {
+    heatmapTilesCell = null;
+    return nd();
+}
+
+function heatmapTilesInit() {
+    var viewport = document.getElementById("tiles_viewport");
+    var canvas = document.getElementById("tiles_canvas");
+    viewport.onscroll = heatmapTilesUpdate;
+    canvas.onmousemove = heatmapTilesOver;
+    canvas.onmouseout = heatmapTilesOut;
+    heatmapTilesSetLevel(0);
+}
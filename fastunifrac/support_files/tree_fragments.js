@@ -0,0 +1,30 @@
+// Lazily expanded FastUniFrac ASCII trees.
+//
+// The page shows only the top levels of the tree. Each collapsed subtree is a
+// line (with id "t" + the postorder position of its root) whose link calls
+// treeExpand. The subtree is pre-rendered in a fragment file, a script which
+// calls treeFragment with the html lines of the subtree and the table of its
+// tooltips (see tree_tooltips.js). The fragment is loaded with a script tag,
+// so the page also works when it is opened from the local disk.
+
+function treeExpand(dir, id) {
+    var line = document.getElementById("t" + id);
+    if (line && !line.getAttribute("data-loading")) {
+        line.setAttribute("data-loading", "1");
+        var script = document.createElement("script");
+        script.type = "text/javascript";
+        script.src = dir + "/" + id + ".js";
+        document.getElementsByTagName("head")[0].appendChild(script);
+    }
+    return false;
+}
+
+function treeFragment(id, html, data) {
+    treeRegister(data);
+    var line = document.getElementById("t" + id);
+    if (!line)
+        return;
+    var fragment = document.createElement("span");
+    fragment.innerHTML = html;
+    line.parentNode.replaceChild(fragment, line);
+}
@@ -0,0 +1,57 @@
+// Delegated tooltips for the FastUniFrac ASCII trees.
+//
+// Instead of an inline overlib call on every glyph and sample id, the compact
+// trees ship a single table, registered with treeRegister, which holds the
+// jackknife support of each node and the description of each sample. The
+// glyphs are tagged with the index of their node ("data-n") and the sample
+// ids with the "s" class. A single handler on the tree looks up and formats
+// the tooltip of the element under the mouse. The tables of the fragments of
+// the lazily expanded trees are merged into the table of the page.
+
+var treeData = null;
+
+function treeRegister(data) {
+    if (!treeData) {
+        treeData = data;
+        return;
+    }
+    var key;
+    for (key in data.desc)
+        treeData.desc[key] = data.desc[key];
+    for (key in data.support)
+        treeData.support[key] = data.support[key];
+}
+
+function treeFormat(value) {
+    return value === null ? "nan" : value.toFixed(3);
+}
+
+function treeGetLabel(target) {
+    var node = target.getAttribute ? target.getAttribute("data-n") : null;
+    if (node !== null) {
+        var fraction = treeData.support[node];
+        var count = fraction === null ? null : treeData.trees * fraction;
+        return "<b>Jackknife Count:</b> " + treeFormat(count) +
+            "<br><b>Jackknife Fraction:</b> " + treeFormat(fraction);
+    }
+    if (target.className === "s") {
+        var sample = target.textContent || target.innerText;
+        return "<b>Sample ID:</b> " + sample +
+            "<br><b>Description:</b> " + treeData.desc[sample];
+    }
+    return null;
+}
+
+function treeOver(e) {
+    if (!treeData)
+        return true;
+    e = e || window.event;
+    var label = treeGetLabel(e.target || e.srcElement);
+    if (label === null)
+        return nd();
+    return overlib(label);
+}
+
+function treeOut(e) {
+    return nd();
+}
@@ -10,11 +10,11 @@ __maintainer__ = "Cathy Lozupone"
 __email__ = "lozupone@colorado.edu"
 __status__ = "Development"
 
-from fastunifrac.sample_id_map_otu_table_conversion import \
-    sample_mapping_to_biom_table
+from fastunifrac.otu_table_cache import (sample_mapping_fp_to_biom_file,
+    DEFAULT_MAX_CACHE_SIZE)
 from qiime.util import make_option
 from qiime.util import parse_command_line_parameters
-from qiime.format import format_biom_table
+from os import mkdir
 
 
 script_info={}
@@ -27,6 +27,12 @@ script_info['script_usage']=[]
 script_info['script_usage'].append(("Example:",
     "Convert a UniFrac sample mapping (environment) file into a biom-formatted"+
     " OTU table: ","%prog -i otu_table.sample_mapping.txt -o otu_table.biom"))
+script_info['script_usage'].append(("Cached conversion:",
+    "Convert a UniFrac sample mapping (environment) file into a biom-formatted"+
+    " OTU table, reusing the conversion stored in 'cache_dir' if the same file"+
+    " has already been converted: ",
+    "%prog -i otu_table.sample_mapping.txt -o otu_table.biom" +
+    " --cache_dir=cache_dir"))
 
 script_info['output_description']="The result of this script is an OTU table."
 
@@ -36,6 +42,18 @@ script_info['required_options']=[
     make_option('-o', '--output_fp',type='new_filepath',
         help='path to output file')
 ]
+script_info['optional_options']=[
+    make_option('--cache_dir', type='new_dirpath', default=None,
+        help='directory where the converted tables are cached, keyed by the'
+            ' contents of the sample mapping file [default: no cache]'),
+    make_option('--max_cache_size', type='int',
+        default=DEFAULT_MAX_CACHE_SIZE / (1024 ** 2),
+        help='maximum size of the cache directory in MB; the least recently'
+            ' used tables are removed first [default: %default]'),
+    make_option('--workers', type='int', default=1,
+        help='number of processes used to parse the sample mapping file;'
+            ' useful for multi-gigabyte files [default: %default]')
+]
 
 script_info['version'] = __version__
 
@@ -45,10 +63,16 @@ def main():
     sample_mapping_fp = opts.sample_mapping_fp
     output_fp = opts.output_fp
     verbose = opts.verbose
-    
-    sample_mapping_file = open(sample_mapping_fp, 'U')
-    result = sample_mapping_to_biom_table(sample_mapping_file)
-    open(output_fp, 'w').write(format_biom_table(result))
+    cache_dir = opts.cache_dir
+
+    if cache_dir is not None:
+        try:
+            mkdir(cache_dir)
+        except OSError:
+            pass
+
+    sample_mapping_fp_to_biom_file(sample_mapping_fp, output_fp, cache_dir,
+        opts.max_cache_size * 1024 ** 2, opts.workers)
 
 if __name__ == "__main__":
     main()
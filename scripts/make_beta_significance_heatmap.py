@@ -39,7 +39,30 @@ script_info['required_options'] = [
     make_option('--output_dir', type="new_dirpath",
                 help='A directory which will contain the images and scripts')
 ]
-script_info['optional_options'] = []
+script_info['optional_options'] = [
+    make_option('--scalable', action='store_true', default=False,
+                help='Show the labels of the heatmap cells with a client-side' +
+                ' script instead of an image map area per cell. Recommended' +
+                ' for a large number of samples [default: %default]'),
+    make_option('--image_formats', type='string', default='png,eps.gz',
+                help='Comma-separated list of the formats of the heatmap' +
+                ' images. It must contain png, which is shown in the html' +
+                ' page. Supported formats: png, eps, svg and pdf; any of' +
+                ' them but png can be gzipped adding .gz' +
+                ' [default: %default]'),
+    make_option('--workers', type='int', default=2,
+                help='Number of processes used to render the raw and' +
+                ' corrected values heatmaps. By default, a pool of two' +
+                ' processes is forked to render both heatmaps at the same' +
+                ' time; use 1 to render them in this process' +
+                ' [default: %default]'),
+    make_option('--no_binary', action='store_false', dest='use_binary',
+                default=True,
+                help='Do not store the parsed beta significance output in a' +
+                ' binary file. By default, it is written next to the input' +
+                ' file (<input_fp>.npz) and loaded by the next runs, as long' +
+                ' as it is newer than the input file')
+]
 script_info['version'] = __version__
 
 if __name__ == '__main__':
@@ -54,4 +77,6 @@ if __name__ == '__main__':
     except OSError:
         pass
 
-    make_beta_significance_heatmap(bs_fp, mapping_fp, html_fp, output_dir)
\ No newline at end of file
+    make_beta_significance_heatmap(bs_fp, mapping_fp, html_fp, output_dir,
+        opts.scalable, opts.image_formats.split(','), opts.workers,
+        opts.use_binary)
\ No newline at end of file
@@ -40,7 +40,19 @@ script_info['required_options'] = [
                 help='Output directory which will contain the scripts' + 
                     ' for the html file')
 ]
-script_info['optional_options'] = []
+script_info['optional_options'] = [
+    make_option('--compact', action='store_true', default=False,
+                help='Store the pop up messages of the tree in a single' +
+                    ' table read by tree_tooltips.js, instead of inlining' +
+                    ' them in every node and sample id. Use it for large' +
+                    ' trees [default: %default]'),
+    make_option('--lazy_levels', type='int', default=None,
+                help='Show only the top LAZY_LEVELS levels of the tree. The' +
+                    ' collapsed subtrees are written as fragment files in' +
+                    ' the output directory and loaded when they are' +
+                    ' expanded. Implies --compact. Use it for trees with' +
+                    ' tens of thousands of tips [default: %default]')
+]
 script_info['version'] = __version__
 
 if __name__ == '__main__':
@@ -64,4 +76,4 @@ if __name__ == '__main__':
 
     # Generate the HTML file
     make_interactive_sample_id_tree_file(tree, mapping_data, html_fp,
-        output_dir)
+        output_dir, opts.compact, opts.lazy_levels)
@@ -12,6 +12,7 @@ __status__ = "Development"
 from qiime.util import parse_command_line_parameters, make_option
 from fastunifrac.make_distance_matrix_heatmap import \
     make_distance_matrix_heatmap
+from fastunifrac.distance_matrix_cache import DM_DTYPES
 import os
 
 script_info = {}
@@ -39,7 +40,30 @@ script_info['required_options'] = [
     make_option('--output_dir', type="new_dirpath",
                 help='The directory which will contain the images and scripts')
 ]
-script_info['optional_options'] = []
+script_info['optional_options'] = [
+    make_option('--scalable', action='store_true', default=False,
+                help='Show the labels of the heatmap cells with a client-side' +
+                ' script instead of an image map area per cell. Recommended' +
+                ' for a large number of samples [default: %default]'),
+    make_option('--image_formats', type='string', default='png,eps.gz',
+                help='Comma-separated list of the formats of the heatmap' +
+                ' images. It must contain png, which is shown in the html' +
+                ' page. Supported formats: png, eps, svg and pdf; any of' +
+                ' them but png can be gzipped adding .gz' +
+                ' [default: %default]'),
+    make_option('--tiled', action='store_true', default=False,
+                help='Store the heatmap as a pyramid of image tiles which' +
+                ' are loaded on demand by the html page. Recommended for' +
+                ' distance matrices with thousands of samples' +
+                ' [default: %default]'),
+    make_option('--dtype', type='choice', choices=DM_DTYPES,
+                default='float64',
+                help='Data type of the distance matrix values. They are' +
+                ' stored in a binary file next to the distance matrix file,' +
+                ' which is memory-mapped by the next runs; float32 halves' +
+                ' its size. Valid choices are: ' + ', '.join(DM_DTYPES) +
+                ' [default: %default]')
+]
 script_info['version'] = __version__
 
 if __name__ == '__main__':
@@ -54,5 +78,6 @@ if __name__ == '__main__':
     except OSError:
         pass
 
-    make_distance_matrix_heatmap(open(dm_fp, 'U'), open(mapping_fp, 'U'),
-        html_fp, output_dir)
\ No newline at end of file
+    make_distance_matrix_heatmap(dm_fp, open(mapping_fp, 'U'), html_fp,
+        output_dir, opts.scalable, opts.image_formats.split(','), opts.tiled,
+        opts.dtype)
\ No newline at end of file
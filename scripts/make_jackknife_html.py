@@ -12,7 +12,7 @@ __status__ = "Development"
 from qiime.util import parse_command_line_parameters, make_option
 from qiime.parse import parse_newick, PhyloNode, parse_mapping_file_to_dict
 from fastunifrac.newick_to_asciiArt import make_jackknife_tree_html_file
-from fastunifrac.parse import parse_jackknife_support_file
+from fastunifrac.parse import parse_jackknife_support_arrays
 import os
 
 script_info = {}
@@ -41,7 +41,19 @@ script_info['required_options'] = [
     make_option('--output_dir', type="new_dirpath",
                 help='Output directory which will contains scripts and images')
 ]
-script_info['optional_options'] = []
+script_info['optional_options'] = [
+    make_option('--compact', action='store_true', default=False,
+                help='Store the pop up messages of the tree in a single' +
+                    ' table read by tree_tooltips.js, instead of inlining' +
+                    ' them in every node and sample id. Use it for large' +
+                    ' trees [default: %default]'),
+    make_option('--lazy_levels', type='int', default=None,
+                help='Show only the top LAZY_LEVELS levels of the tree. The' +
+                    ' collapsed subtrees are written as fragment files in' +
+                    ' the output directory and loaded when they are' +
+                    ' expanded. Implies --compact. Use it for trees with' +
+                    ' tens of thousands of tips [default: %default]')
+]
 script_info['version'] = __version__
 
 # Dict which contains the color legend
@@ -67,7 +79,7 @@ if __name__ == '__main__':
         pass
 
     # Parse jackknife support file
-    support = parse_jackknife_support_file(open(support_fp, 'U'))
+    support = parse_jackknife_support_arrays(open(support_fp, 'U'))
 
     # Parse jackknife named nodes tree file
     tree = parse_newick(open(tree_fp, 'U'), PhyloNode)
@@ -77,4 +89,4 @@ if __name__ == '__main__':
 
     # Generate the html file
     make_jackknife_tree_html_file(tree, support, DICT_TRANS_VALUES,
-        mapping_data, html_fp, output_dir)
\ No newline at end of file
+        mapping_data, html_fp, output_dir, opts.compact, opts.lazy_levels)
\ No newline at end of file
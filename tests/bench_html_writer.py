@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+__author__ = "Jose Antonio Navas Molina"
+__copyright__ = "Copyright 2013, The FastUniFrac Project"
+__credits__ = ["Jose Antonio Navas Molina"]
+__license__ = "GPL"
+__version__ = "1.7.0-dev"
+__maintainer__ = "Jose Antonio Navas Molina"
+__email__ = "josenavasmolina@gmail.com"
+__status__ = "Development"
+
+"""Benchmark of the peak memory of the streamed HTML writers
+
+Usage: python bench_html_writer.py [n_rows]
+
+Writes the sample counts page of a synthetic mapping file with n_rows samples
+(100,000 by default), once building the whole page in a string and once
+streaming it to the file with render_to_file. Each one runs in its own
+process, and the peak RSS is measured over the RSS the process had once the
+mapping data was built (Linux only).
+"""
+
+from sys import argv
+from os import remove
+from time import time
+from resource import getrusage, RUSAGE_SELF
+from multiprocessing import Process, Queue
+from qiime.util import load_qiime_config, get_tmp_filename
+from fastunifrac.html_writer import render_to_file
+from fastunifrac.make_sample_counts_html import (get_html_page_string,
+    write_html_page)
+
+def get_map_dict(n_rows):
+    """Returns the mapping data of 'n_rows' synthetic samples"""
+    return dict(("Sample%d" % i, {'NumIndividuals': str(i % 1000),
+        'Description': "Description of the synthetic sample %d" % i})
+        for i in xrange(n_rows))
+
+def get_rss():
+    """Returns the current RSS of the process in KB"""
+    for line in open('/proc/self/status'):
+        if line.startswith('VmRSS:'):
+            return int(line.split()[1])
+
+def write_page_string(map_dict, html_fp):
+    """Builds the whole page in memory and writes it"""
+    out = open(html_fp, 'w')
+    out.write(get_html_page_string(map_dict))
+    out.close()
+
+def write_page_streamed(map_dict, html_fp):
+    """Streams the page to the file"""
+    render_to_file(write_html_page, html_fp, map_dict)
+
+def measure(function, n_rows, html_fp, queue):
+    """Puts in 'queue' the seconds and the peak RSS increase (in KB) of
+        function(map_dict, html_fp)
+    """
+    map_dict = get_map_dict(n_rows)
+    rss = get_rss()
+    start = time()
+    function(map_dict, html_fp)
+    queue.put((time() - start, getrusage(RUSAGE_SELF).ru_maxrss - rss))
+
+def main(n_rows=100000):
+    tmp_dir = load_qiime_config()['temp_dir'] or '/tmp/'
+    html_fp = get_tmp_filename(tmp_dir=tmp_dir, suffix='.html')
+    print "Sample counts page with %d rows" % n_rows
+    print "%10s %10s %16s" % ("", "seconds", "peak RSS (MB)")
+    try:
+        for label, function in [("string", write_page_string),
+            ("streamed", write_page_streamed)]:
+            queue = Queue()
+            process = Process(target=measure, args=(function, n_rows,
+                html_fp, queue))
+            process.start()
+            seconds, rss = queue.get()
+            process.join()
+            print "%10s %10.3f %16.1f" % (label, seconds, rss / 1024.0)
+    finally:
+        remove(html_fp)
+
+if __name__ == '__main__':
+    main(*map(int, argv[1:]))
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+__author__ = "Jose Antonio Navas Molina"
+__copyright__ = "Copyright 2013, The FastUniFrac Project"
+__credits__ = ["Jose Antonio Navas Molina"]
+__license__ = "GPL"
+__version__ = "1.7.0-dev"
+__maintainer__ = "Jose Antonio Navas Molina"
+__email__ = "josenavasmolina@gmail.com"
+__status__ = "Development"
+
+"""Benchmark of the memory used by consecutive heatmap renders
+
+Usage: python bench_make_heatmap.py [n_renders] [n_samples]
+
+Draws n_renders (1,000 by default) png heatmaps of random matrices through a
+single HeatmapRenderer, alternating two figure sizes (n_samples and
+n_samples + 10 samples, 20 by default), and prints the RSS of the process
+every 100 renders (Linux only). The same renders are also drawn with pylab
+figures which are never closed, as plot_heatmap used to do, in their own
+process so the memory of one run does not hide the other.
+
+300 renders with Python 2.7 and matplotlib 1.5.3:
+
+            renders    seconds RSS growth (MB)
+  renderer      100       10.6           15.6
+  renderer      200       20.8           15.6
+  renderer      300       31.9           15.6
+     pylab      100       34.5          672.4
+     pylab      200       69.3         1344.1
+     pylab      300      105.7         2015.0
+
+The renderer stays flat after its first figures, while every pylab figure
+keeps about 6.7 MB alive.
+"""
+
+from sys import argv
+from os.path import join
+from time import time
+from shutil import rmtree
+from tempfile import mkdtemp
+from multiprocessing import Process
+from numpy.random import RandomState
+from matplotlib import use
+use('Agg', warn=False)
+from matplotlib.pyplot import figure, imshow, colorbar
+from matplotlib.cm import get_cmap
+from qiime.util import load_qiime_config
+from fastunifrac.make_heatmap import (HeatmapRenderer, plot_heatmap,
+    get_info_from_dict, get_figure_size, make_plot_array, HEADERS_VER,
+    HEADERS_HOR, HEATMAP_DPI)
+
+TRANS_VALUES = {(None, None): (0, ""), (0.0, 0.25): (1, "(0-25%)"),
+    (0.25, 0.5): (2, "(25-50%)"), (0.5, 0.75): (3, "(50-75%)"),
+    (0.75, 1.0): (4, "(75-100%)")}
+
+def get_rss():
+    """Returns the current RSS of the process in KB"""
+    for line in open('/proc/self/status'):
+        if line.startswith('VmRSS:'):
+            return int(line.split()[1])
+
+def get_heatmaps(n_samples, seed=0):
+    """Returns the headers and a random matrix for the two figure sizes"""
+    prng = RandomState(seed)
+    result = []
+    for n in [n_samples, n_samples + 10]:
+        samples = ["Sample%d" % i for i in range(n)]
+        headers = {HEADERS_HOR: samples, HEADERS_VER: samples}
+        result.append((headers, prng.random_sample((n, n)).tolist()))
+    return result
+
+def plot_heatmap_pylab(plot_name, headers, matrix, trans_values, output_dir):
+    """Draws the png heatmap with pylab figures, as plot_heatmap used to do"""
+    n_values, boundaries, ticks, ticklabels = get_info_from_dict(trans_values)
+    fig = figure(figsize=get_figure_size(headers))
+    plot = imshow(make_plot_array(matrix, trans_values),
+        interpolation='nearest', cmap=get_cmap('spectral', n_values))
+    ax = fig.axes[0]
+    ax.set_xticks(range(len(headers[HEADERS_HOR])))
+    ax.set_xticklabels(headers[HEADERS_HOR], rotation=90)
+    ax.set_yticks(range(len(headers[HEADERS_VER])))
+    ax.set_yticklabels(headers[HEADERS_VER])
+    cb = colorbar(boundaries=boundaries, ticks=ticks, orientation='horizontal')
+    cb.set_ticklabels(ticklabels)
+    fig.savefig(join(output_dir, plot_name + '.png'), dpi=HEATMAP_DPI,
+        format='png')
+
+def bench_renders(label, n_renders, n_samples, output_dir):
+    """Prints the RSS every 100 renders of 'n_renders' heatmaps"""
+    heatmaps = get_heatmaps(n_samples)
+    renderer = HeatmapRenderer()
+    start_rss = get_rss()
+    start = time()
+    for i in xrange(n_renders):
+        headers, matrix = heatmaps[i % 2]
+        if label == 'renderer':
+            plot_heatmap("heatmap", headers, matrix, TRANS_VALUES, output_dir,
+                renderer=renderer, image_formats=['png'])
+        else:
+            plot_heatmap_pylab("heatmap", headers, matrix, TRANS_VALUES,
+                output_dir)
+        if (i + 1) % 100 == 0:
+            print "%10s %8d %10.1f %14.1f" % (label, i + 1, time() - start,
+                (get_rss() - start_rss) / 1024.0)
+    renderer.close()
+
+def main(n_renders=1000, n_samples=20):
+    tmp_dir = load_qiime_config()['temp_dir'] or '/tmp/'
+    output_dir = mkdtemp(dir=tmp_dir)
+    print "%10s %8s %10s %14s" % ("", "renders", "seconds", "RSS growth (MB)")
+    try:
+        for label in ['renderer', 'pylab']:
+            process = Process(target=bench_renders, args=(label, n_renders,
+                n_samples, output_dir))
+            process.start()
+            process.join()
+    finally:
+        rmtree(output_dir)
+
+if __name__ == '__main__':
+    main(*map(int, argv[1:]))
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+__author__ = "Jose Antonio Navas Molina"
+__copyright__ = "Copyright 2013, The FastUniFrac Project"
+__credits__ = ["Jose Antonio Navas Molina"]
+__license__ = "GPL"
+__version__ = "1.7.0-dev"
+__maintainer__ = "Jose Antonio Navas Molina"
+__email__ = "josenavasmolina@gmail.com"
+__status__ = "Development"
+
+"""Benchmark of the size and the parse time of the compact jackknife trees
+
+Usage: python bench_newick_to_asciiArt.py [n_tips ...]
+
+Builds the jackknife tree page of a random binary tree for each number of
+tips (100, 1,000 and 5,000 by default), once with the inline pop up messages
+and once in compact mode. For each page it prints its size, the time taken
+by HTMLParser to parse it (as a proxy of the time a browser spends parsing
+it) and the number of elements and inline event handlers it has. The last
+columns compare each page against the inline one.
+
+The trees whose compact page is not TARGET_REDUCTION times smaller than the
+inline one are listed at the end, together with the reduction the compact
+page would reach if its glyph tags took no space at all. The spaces, the
+sample ids and their descriptions are in both pages, which bounds the
+reduction.
+"""
+
+import re
+from sys import argv
+from time import time
+from HTMLParser import HTMLParser
+from numpy.random import RandomState
+from qiime.parse import parse_newick, PhyloNode
+from fastunifrac.newick_to_asciiArt import get_jackknife_tree_html_string
+
+# Expected size reduction of the compact pages
+TARGET_REDUCTION = 5.0
+# Number of times each page is parsed. The best time is reported
+PARSE_REPEATS = 3
+# Glyph tags of the compact pages (see COMPACT_GLYPH_HTML)
+COMPACT_GLYPH_RE = re.compile(r'<b class=c\d+ data-n=\d+>([^<]*)</b>')
+
+TRANS_VALUES = {(None, None) : ("#FFFFFF", ""),
+            (None, 0.5): ("#dddddd", "< 50%"),
+            (0.5, 0.7): ("#99CCFF", "50-70%"),
+            (0.7, 0.9): ("#82FF8B", "70-90%"),
+            (0.9, 0.999): ("#F8FE83", "90-99.9%"),
+            (0.999, None): ("#FF8582", "> 99.9%")}
+
+NUM_TREES_CONSIDERED = 100
+
+class ElementCounter(HTMLParser):
+    """Counts the elements and the inline event handlers of a page"""
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.elements = 0
+        self.handlers = 0
+
+    def handle_starttag(self, tag, attrs):
+        self.elements += 1
+        self.handlers += len([name for name, value in attrs
+            if name.startswith('on')])
+
+def get_random_tree(n_tips, seed=0):
+    """Returns a random binary tree with jackknife supports as node names
+        and the mapping data of its tips
+    """
+    prng = RandomState(seed)
+    subtrees = ["Sample%d:%.3f" % (i, prng.uniform(0.01, 1.0))
+        for i in range(n_tips)]
+    while len(subtrees) > 1:
+        i, j = sorted(prng.permutation(len(subtrees))[:2])
+        right = subtrees.pop(j)
+        left = subtrees.pop(i)
+        subtrees.append("(%s,%s)%.2f:%.3f" % (left, right,
+            prng.randint(0, NUM_TREES_CONSIDERED + 1) /
+            float(NUM_TREES_CONSIDERED), prng.uniform(0.01, 1.0)))
+    # The root has no branch length, as in the jackknife named nodes trees
+    tree = parse_newick(subtrees[0].rpartition(':')[0] + ";", PhyloNode)
+    mapping_data = [dict([("Sample%d" % i,
+        {'Description': "Description of the random sample %d" % i})
+        for i in range(n_tips)]), ""]
+    return tree, mapping_data
+
+def parse_page(html):
+    """Returns the best parse time of 'html' and its element counts"""
+    best = None
+    for i in range(PARSE_REPEATS):
+        counter = ElementCounter()
+        start = time()
+        counter.feed(html)
+        counter.close()
+        elapsed = time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, counter.elements, counter.handlers
+
+def main(*all_n_tips):
+    all_n_tips = all_n_tips or (100, 1000, 5000)
+    print "%6s %8s %12s %10s %9s %9s %8s %8s" % ("tips", "mode", "bytes",
+        "parse (s)", "elements", "handlers", "size", "parse")
+    shortfall = []
+    for n_tips in all_n_tips:
+        tree, mapping_data = get_random_tree(n_tips)
+        results = {}
+        for mode, compact in [("inline", False), ("compact", True)]:
+            html = get_jackknife_tree_html_string(tree, NUM_TREES_CONSIDERED,
+                TRANS_VALUES, mapping_data, compact=compact)
+            results[mode] = (len(html),) + parse_page(html)
+        untagged_size = len(COMPACT_GLYPH_RE.sub(r'\1', html))
+        for mode in ["inline", "compact"]:
+            size, seconds, elements, handlers = results[mode]
+            print "%6d %8s %12d %10.3f %9d %9d %7.1fx %7.1fx" % (n_tips,
+                mode, size, seconds, elements, handlers,
+                results["inline"][0] / float(size),
+                results["inline"][1] / seconds)
+        reduction = results["inline"][0] / float(results["compact"][0])
+        if reduction < TARGET_REDUCTION:
+            shortfall.append((n_tips, reduction,
+                results["inline"][0] / float(untagged_size)))
+    for n_tips, reduction, bound in shortfall:
+        print ("Below the %.0fx target: %d tips, %.1fx smaller (%.1fx "
+            "without any glyph tag)") % (TARGET_REDUCTION, n_tips, reduction,
+            bound)
+
+if __name__ == '__main__':
+    main(*map(int, argv[1:]))
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+__author__ = "Jose Antonio Navas Molina"
+__copyright__ = "Copyright 2013, The FastUniFrac Project"
+__credits__ = ["Jose Antonio Navas Molina"]
+__license__ = "GPL"
+__version__ = "1.7.0-dev"
+__maintainer__ = "Jose Antonio Navas Molina"
+__email__ = "josenavasmolina@gmail.com"
+__status__ = "Development"
+
+"""Benchmarks of the sample mapping file to biom table conversion
+
+Usage: python bench_sample_id_map_otu_table_conversion.py [max_lines]
+
+The synthetic sample mapping files have 10 lines per OTU and up to 1,000
+samples. The sizes go from 10^3 lines up to max_lines (10^6 by default), so
+the time per line shows whether the conversion scales linearly. The sample id
+sanitizer is measured on its hot path: a few sample ids repeated along the
+file, as in a real sample mapping file. The cache of converted tables is
+measured on a file of 200,000 lines.
+"""
+
+from sys import argv
+from time import time
+from os import remove
+from shutil import rmtree
+from tempfile import mkdtemp
+from qiime.util import load_qiime_config, get_tmp_filename
+from fastunifrac.sample_id_map_otu_table_conversion import (
+    parse_sample_mapping_fp_to_coo, coo_to_biom_table,
+    build_sample_ids_transtable, SampleIdSanitizer)
+from fastunifrac.otu_table_cache import (sample_mapping_fp_to_biom_table,
+    sample_mapping_fp_to_biom_file)
+
+def write_sample_mapping_file(fp, n_lines):
+    """Writes a synthetic sample mapping file with 'n_lines' lines"""
+    n_samples = min(1000, max(n_lines / 10, 1))
+    out = open(fp, 'w')
+    for i in xrange(n_lines):
+        out.write("OTU%d\tsample_%d\t%d\n" % (i / 10, (i * 7919) % n_samples,
+            i % 5 + 1))
+    out.close()
+
+def bench_conversion(fp):
+    """Returns the seconds spent parsing 'fp' and building its biom table"""
+    start = time()
+    coo_to_biom_table(*parse_sample_mapping_fp_to_coo(fp))
+    return time() - start
+
+def bench_sample_id_sanitizer(n_lines=10 ** 6, n_samples=1000):
+    """Returns the seconds spent sanitizing 'n_lines' sample ids
+
+    Returns the seconds spent translating each id, calling SampleIdSanitizer
+        for each id, and looking up each id in a dict which is only filled by
+        SampleIdSanitizer the first time an id is seen (as the converters do)
+    """
+    raw_ids = ["sample_%d" % ((i * 7919) % n_samples)
+        for i in xrange(n_lines)]
+    start = time()
+    trans_table = build_sample_ids_transtable()
+    for raw_id in raw_ids:
+        raw_id.translate(trans_table)
+    translate_seconds = time() - start
+
+    start = time()
+    sanitizer = SampleIdSanitizer()
+    for raw_id in raw_ids:
+        sanitizer(raw_id)
+    sanitizer_seconds = time() - start
+
+    start = time()
+    sanitizer = SampleIdSanitizer()
+    sample_ids = {}
+    for raw_id in raw_ids:
+        try:
+            sample_ids[raw_id]
+        except KeyError:
+            sample_ids[raw_id] = sanitizer(raw_id)
+    return translate_seconds, sanitizer_seconds, time() - start
+
+def bench_cache(fp, output_fp, tmp_dir):
+    """Returns the seconds spent converting 'fp' through an empty cache and
+        through the cache filled by the first conversion, as
+        [(miss table, hit table), (miss biom file, hit biom file)]
+    """
+    result = []
+    for function, args in [(sample_mapping_fp_to_biom_table, (fp,)),
+        (sample_mapping_fp_to_biom_file, (fp, output_fp))]:
+        cache_dir = mkdtemp(dir=tmp_dir)
+        try:
+            seconds = []
+            for i in range(2):
+                start = time()
+                function(*args + (cache_dir,))
+                seconds.append(time() - start)
+        finally:
+            rmtree(cache_dir)
+        result.append(tuple(seconds))
+    return result
+
+def main(max_lines=10 ** 6):
+    print "Sanitizing 10^6 sample ids (seconds):"
+    print "%.3f translating each id\n%.3f calling SampleIdSanitizer for each " \
+        "id\n%.3f sanitizing each distinct id once\n" % \
+        bench_sample_id_sanitizer()
+
+    tmp_dir = load_qiime_config()['temp_dir'] or '/tmp/'
+    fp = get_tmp_filename(tmp_dir=tmp_dir)
+    print "%10s %10s %12s" % ("lines", "seconds", "us per line")
+    n_lines = 10 ** 3
+    try:
+        while n_lines <= max_lines:
+            write_sample_mapping_file(fp, n_lines)
+            seconds = bench_conversion(fp)
+            print "%10d %10.3f %12.2f" % (n_lines, seconds,
+                seconds * 1e6 / n_lines)
+            n_lines *= 10
+
+        output_fp = get_tmp_filename(tmp_dir=tmp_dir)
+        write_sample_mapping_file(fp, 200000)
+        (table_miss, table_hit), (file_miss, file_hit) = bench_cache(fp,
+            output_fp, tmp_dir)
+        remove(output_fp)
+        print "\nCached conversion of 200,000 lines (seconds):"
+        print "%10s %10s %10s" % ("", "miss", "hit")
+        print "%10s %10.3f %10.3f" % ("table", table_miss, table_hit)
+        print "%10s %10.3f %10.3f" % ("biom file", file_miss, file_hit)
+    finally:
+        remove(fp)
+
+if __name__ == '__main__':
+    main(*map(int, argv[1:]))
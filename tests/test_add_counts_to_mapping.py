@@ -52,6 +52,37 @@ class AddCountsToMappingTest(TestCase):
         f.close()
         self.assertEqual(obs, exp_mapping_file_otu.splitlines(True))
 
+    def test_add_counts_to_mapping_no_MIENS(self):
+        """NumIndividuals is added for non MIENS compliant sample ids"""
+        out_fp = get_tmp_filename(tmp_dir=self.tmp_dir, suffix='.txt')
+        self._paths_to_clean_up = [out_fp]
+        # The biom table contains the MIENS compliant version of the ids
+        biom = biom_table.replace('"sample1"', '"sample.1"').splitlines()
+        mapping = mapping_file.replace('sample1\t', 'sample_1\t').splitlines()
+        add_counts_to_mapping(biom, mapping, False, out_fp)
+        f = open(out_fp, 'U')
+        obs = f.readlines()
+        f.close()
+        exp = exp_mapping_file_seqs.replace('sample1\t', 'sample_1\t')
+        self.assertEqual(obs, exp.splitlines(True))
+
+    def test_add_counts_to_mapping_raw_ids(self):
+        """The mapping sample ids are looked up as they are first"""
+        out_fp = get_tmp_filename(tmp_dir=self.tmp_dir, suffix='.txt')
+        self._paths_to_clean_up = [out_fp]
+        # Two ids which only differ in non MIENS characters
+        biom = biom_table.replace('"sample1"', '"sample_1"').replace(
+            '"sample2"', '"sample#1"').splitlines()
+        mapping = mapping_file.replace('sample1\t', 'sample_1\t').replace(
+            'sample2\t', 'sample#1\t').splitlines()
+        add_counts_to_mapping(biom, mapping, False, out_fp)
+        f = open(out_fp, 'U')
+        obs = f.readlines()
+        f.close()
+        exp = exp_mapping_file_seqs.replace('sample1\t', 'sample_1\t').replace(
+            'sample2\t', 'sample#1\t')
+        self.assertEqual(obs, exp.splitlines(True))
+
 mapping_file = """#SampleID\tBarcodeSequence\tLinkerPrimerSequence\tDescription
 #Comments
 #One comment more
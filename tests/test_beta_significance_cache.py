@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+__author__ = "Jose Antonio Navas Molina"
+__copyright__ = "Copyright 2013, The FastUniFrac Project"
+__credits__ = ["Jose Antonio Navas Molina"]
+__license__ = "GPL"
+__version__ = "1.7.0-dev"
+__maintainer__ = "Jose Antonio Navas Molina"
+__email__ = "josenavasmolina@gmail.com"
+__status__ = "Development"
+
+from cogent.util.unit_test import TestCase, main
+from qiime.util import load_qiime_config
+from os import listdir, utime
+from os.path import join, getmtime
+from shutil import rmtree
+from tempfile import mkdtemp
+from fastunifrac.beta_significance_cache import (get_binary_fp,
+    is_binary_up_to_date, write_pairwise_binary, load_pairwise_binary,
+    load_beta_significance_output_pairwise)
+from fastunifrac.parse import parse_beta_significance_output_pairwise_columns
+
+class BetaSignificanceCacheTest(TestCase):
+    def setUp(self):
+        """Set up some test variables"""
+        self.qiime_config = load_qiime_config()
+        self.tmp_dir = self.qiime_config['temp_dir'] or '/tmp/'
+        self.bs_dir = mkdtemp(dir=self.tmp_dir)
+        self.bs_fp = join(self.bs_dir, 'bs.txt')
+        self.write_bs_file(bs_lines)
+        self.exp = parse_beta_significance_output_pairwise_columns(
+            bs_lines.splitlines())
+
+    def tearDown(self):
+        """Cleans up the environment once the tests finish"""
+        rmtree(self.bs_dir)
+
+    def write_bs_file(self, content):
+        """Writes 'content' to the beta significance output file"""
+        f = open(self.bs_fp, 'w')
+        f.write(content)
+        f.close()
+
+    def assertColumnsEqual(self, obs, exp):
+        """Checks that two parsed beta significance outputs are equal"""
+        self.assertEqual(obs[0], exp[0])
+        for obs_array, exp_array in zip(obs[1:4], exp[1:4]):
+            self.assertEqual(obs_array.dtype, exp_array.dtype)
+            self.assertEqual(obs_array.tolist(), exp_array.tolist())
+        self.assertEqual(obs[4], exp[4])
+
+    def test_write_pairwise_binary(self):
+        """The binary file is written next to the beta significance output"""
+        self.assertFalse(is_binary_up_to_date(self.bs_fp))
+        write_pairwise_binary(self.bs_fp, *self.exp)
+        self.assertTrue(is_binary_up_to_date(self.bs_fp))
+        # No temporary files are left
+        self.assertEqual(sorted(listdir(self.bs_dir)), ['bs.txt',
+            'bs.txt.npz'])
+        self.assertColumnsEqual(load_pairwise_binary(self.bs_fp), self.exp)
+
+        # A newer text file makes the binary file out of date
+        mtime = getmtime(get_binary_fp(self.bs_fp))
+        utime(self.bs_fp, (mtime + 10, mtime + 10))
+        self.assertFalse(is_binary_up_to_date(self.bs_fp))
+
+    def test_load_beta_significance_output_pairwise(self):
+        """The binary file is written once and then loaded"""
+        obs = load_beta_significance_output_pairwise(self.bs_fp)
+        self.assertColumnsEqual(obs, self.exp)
+        self.assertTrue(is_binary_up_to_date(self.bs_fp))
+        mtime = getmtime(get_binary_fp(self.bs_fp))
+
+        # The text file is not parsed again
+        self.write_bs_file("not a beta significance output")
+        utime(self.bs_fp, (mtime - 10, mtime - 10))
+        obs = load_beta_significance_output_pairwise(self.bs_fp)
+        self.assertColumnsEqual(obs, self.exp)
+
+        # A corrupted binary file is written again
+        self.write_bs_file(bs_lines)
+        f = open(get_binary_fp(self.bs_fp), 'w')
+        f.write("not a binary file")
+        f.close()
+        utime(self.bs_fp, (mtime - 10, mtime - 10))
+        obs = load_beta_significance_output_pairwise(self.bs_fp)
+        self.assertColumnsEqual(obs, self.exp)
+        self.assertColumnsEqual(load_pairwise_binary(self.bs_fp), self.exp)
+
+    def test_load_beta_significance_output_pairwise_no_binary(self):
+        """No binary file is read or written if use_binary is False"""
+        obs = load_beta_significance_output_pairwise(self.bs_fp,
+            use_binary=False)
+        self.assertColumnsEqual(obs, self.exp)
+        self.assertEqual(listdir(self.bs_dir), ['bs.txt'])
+
+        # An existing binary file is ignored
+        write_pairwise_binary(self.bs_fp, *self.exp)
+        self.write_bs_file("#Comment\nSample1\tSample2\ns1\ts2\n")
+        mtime = getmtime(get_binary_fp(self.bs_fp))
+        utime(self.bs_fp, (mtime - 10, mtime - 10))
+        self.assertRaises(ValueError, load_beta_significance_output_pairwise,
+            self.bs_fp, use_binary=False)
+
+bs_lines = """#Comment with the name of the test realized
+Sample1\tSample2\tp value\tp value (Bonferroni corrected)
+s1\ts2\t0.01\t0.15
+s1\ts3\t0.0\t<=1.0e-02
+s1\ts4\t0.02\t0.3
+s2\ts3\t0.82\t1.0
+s2\ts4\t0.4\t1.0
+s3\ts4\t0.0\t<=1.0e-02
+"""
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+__author__ = "Jose Antonio Navas Molina"
+__copyright__ = "Copyright 2013, The FastUniFrac Project"
+__credits__ = ["Jose Antonio Navas Molina"]
+__license__ = "GPL"
+__version__ = "1.7.0-dev"
+__maintainer__ = "Jose Antonio Navas Molina"
+__email__ = "josenavasmolina@gmail.com"
+__status__ = "Development"
+
+from cogent.util.unit_test import TestCase, main
+from numpy import array, arange, nan
+from numpy.ma import masked_array
+from fastunifrac.condensed_matrix import (get_condensed_size, condensed_index,
+    CondensedMatrix)
+
+class CondensedMatrixTest(TestCase):
+    def setUp(self):
+        """Set up some test variables"""
+        self.matrix = [[0, 1, 2, 3],
+        [1, 0, 4, 5],
+        [2, 4, 0, 6],
+        [3, 5, 6, 0]]
+
+        self.upper_triangle = [[None, 1, 2, 3],
+        [None, None, 4, 5],
+        [None, None, None, 6],
+        [None, None, None, None]]
+
+    def test_get_condensed_size(self):
+        """The number of values above the diagonal is computed correctly"""
+        self.assertEqual(get_condensed_size(0), 0)
+        self.assertEqual(get_condensed_size(1), 0)
+        self.assertEqual(get_condensed_size(4), 6)
+        self.assertEqual(get_condensed_size(5000), 12497500)
+
+    def test_condensed_index(self):
+        """The cells are stored row by row"""
+        self.assertEqual(condensed_index(4, 0, 1), 0)
+        self.assertEqual(condensed_index(4, 0, 3), 2)
+        self.assertEqual(condensed_index(4, 1, 2), 3)
+        self.assertEqual(condensed_index(4, 2, 3), 5)
+        self.assertEqual(condensed_index(4, array([0, 1]),
+            array([2, 3])).tolist(), [1, 4])
+
+    def test_init(self):
+        """The number of values must match the size of the matrix"""
+        cm = CondensedMatrix(4, [1, 2, 3, 4, 5, 6])
+        self.assertEqual(cm.n, 4)
+        self.assertEqual(cm.shape, (4, 4))
+        self.assertEqual(len(cm), 4)
+        self.assertEqual(cm.values.dtype, float)
+        self.assertRaises(ValueError, CondensedMatrix, 4, [1, 2, 3])
+
+    def test_from_matrix(self):
+        """The upper triangle is condensed correctly"""
+        cm = CondensedMatrix.from_matrix(self.matrix)
+        self.assertEqual(cm.values.tolist(), [1, 2, 3, 4, 5, 6])
+        self.assertEqual(cm.tolist(), self.upper_triangle)
+
+        cm = CondensedMatrix.from_matrix(array([[0.0]]))
+        self.assertEqual(cm.values.tolist(), [])
+        self.assertEqual(cm.tolist(), [[None]])
+
+    def test_get_value(self):
+        """Only the cells above the diagonal have a value"""
+        cm = CondensedMatrix(4, [1, 2, 3, 4, nan, 6])
+        self.assertEqual(cm.get_value(1, 2), 4)
+        self.assertEqual(cm.get_value(2, 1), None)
+        self.assertEqual(cm.get_value(2, 2), None)
+        self.assertEqual(cm.get_value(1, 3), None)
+
+    def test_get_cells(self):
+        """The cells with a value are listed row by row"""
+        cm = CondensedMatrix(4, [1, 2, 3, 4, nan, 6])
+        rows, cols = cm.get_cells()
+        self.assertEqual(rows.tolist(), [0, 0, 0, 1, 2])
+        self.assertEqual(cols.tolist(), [1, 2, 3, 2, 3])
+
+    def test_expand(self):
+        """The condensed vectors are expanded to the full matrix"""
+        cm = CondensedMatrix.from_matrix(self.matrix)
+        obs = cm.expand(fill_value=-1)
+        self.assertEqual(obs.tolist(), [[-1, 1, 2, 3],
+            [-1, -1, 4, 5],
+            [-1, -1, -1, 6],
+            [-1, -1, -1, -1]])
+
+        obs = cm.expand(arange(6), 0)
+        self.assertEqual(obs.dtype, arange(6).dtype)
+        self.assertEqual(obs.tolist(), [[0, 0, 1, 2],
+            [0, 0, 3, 4],
+            [0, 0, 0, 5],
+            [0, 0, 0, 0]])
+
+        obs = cm.expand(masked_array(arange(6), mask=[0, 1, 0, 0, 0, 1]), 9)
+        self.assertEqual(obs.tolist(), [[9, 0, None, 2],
+            [9, 9, 3, 4],
+            [9, 9, 9, None],
+            [9, 9, 9, 9]])
+
+    def test_iter_row_blocks(self):
+        """The upper triangle is read in blocks of rows"""
+        cm = CondensedMatrix(5, arange(10))
+        obs = [(start, stop, values.tolist())
+            for start, stop, values in cm.iter_row_blocks(2)]
+        self.assertEqual(obs, [(0, 2, [0, 1, 2, 3, 4, 5, 6]),
+            (2, 4, [7, 8, 9])])
+        obs = [(start, stop, values.tolist())
+            for start, stop, values in cm.iter_row_blocks(3)]
+        self.assertEqual(obs, [(0, 3, [0, 1, 2, 3, 4, 5, 6, 7, 8]),
+            (3, 5, [9])])
+        self.assertEqual(list(CondensedMatrix(1, []).iter_row_blocks()), [])
+
+    def test_expand_blocks(self):
+        """The results of each block are expanded to the full matrix"""
+        cm = CondensedMatrix(5, arange(10))
+        for block_rows in [1, 2, 3, 10]:
+            obs = cm.expand_blocks(lambda values: values * 2, -1, int,
+                block_rows)
+            self.assertEqual(obs.tolist(), cm.expand(arange(10) * 2,
+                -1).tolist())
+
+if __name__ == '__main__':
+    main()
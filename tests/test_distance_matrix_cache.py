@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+__author__ = "Jose Antonio Navas Molina"
+__copyright__ = "Copyright 2013, The FastUniFrac Project"
+__credits__ = ["Jose Antonio Navas Molina"]
+__license__ = "GPL"
+__version__ = "1.7.0-dev"
+__maintainer__ = "Jose Antonio Navas Molina"
+__email__ = "josenavasmolina@gmail.com"
+__status__ = "Development"
+
+from cogent.util.unit_test import TestCase, main
+from qiime.util import load_qiime_config
+from qiime.parse import parse_distmat
+from os import listdir, utime
+from os.path import join, exists, getmtime
+from shutil import rmtree
+from tempfile import mkdtemp
+from numpy import memmap, zeros
+from fastunifrac.condensed_matrix import CondensedMatrix
+from fastunifrac.distance_matrix_cache import (get_binary_fps,
+    parse_distmat_header, parse_distmat_to_condensed, is_binary_up_to_date,
+    write_distmat_binary, load_distmat_binary, load_distmat)
+
+class DistanceMatrixCacheTest(TestCase):
+    def setUp(self):
+        """Set up some test variables"""
+        self.qiime_config = load_qiime_config()
+        self.tmp_dir = self.qiime_config['temp_dir'] or '/tmp/'
+        self.dm_dir = mkdtemp(dir=self.tmp_dir)
+        self.dm_fp = join(self.dm_dir, 'dm.txt')
+        f = open(self.dm_fp, 'w')
+        f.write(dm_lines)
+        f.close()
+
+    def tearDown(self):
+        """Cleans up the environment once the tests finish"""
+        rmtree(self.dm_dir)
+
+    def test_parse_distmat_header(self):
+        """The sample ids are parsed from the header"""
+        self.assertEqual(parse_distmat_header("\ta\tb \tc\n"), ['a', 'b', 'c'])
+
+    def test_parse_distmat_to_condensed(self):
+        """The upper triangle of the distance matrix is parsed correctly"""
+        sample_ids, values = parse_distmat_to_condensed(dm_lines.splitlines())
+        self.assertEqual(sample_ids, ['a', 'b', 'c', 'd'])
+        self.assertEqual(values.tolist(), [0.1, 0.2, 0.3, 0.4, 0.5, 0.6])
+
+        # Same values than the full matrix parser
+        header, matrix = parse_distmat(dm_lines.splitlines())
+        exp = CondensedMatrix.from_matrix(matrix).values
+        self.assertEqual(values.tolist(), exp.tolist())
+
+        # Blank lines and line endings are ignored
+        sample_ids, values = parse_distmat_to_condensed(
+            (dm_lines.replace('\n', '\r\n') + '\n').splitlines(True))
+        self.assertEqual(values.tolist(), [0.1, 0.2, 0.3, 0.4, 0.5, 0.6])
+
+        # The values can be stored in a given array
+        out = zeros(6, dtype='float32')
+        sample_ids, values = parse_distmat_to_condensed(
+            dm_lines.splitlines(), out)
+        self.assertTrue(values is out)
+        self.assertFloatEqual(out.tolist(), [0.1, 0.2, 0.3, 0.4, 0.5, 0.6])
+
+    def test_parse_distmat_to_condensed_errors(self):
+        """The malformed distance matrices are detected"""
+        lines = dm_lines.splitlines()
+        self.assertRaises(ValueError, parse_distmat_to_condensed, [])
+        self.assertRaises(ValueError, parse_distmat_to_condensed, lines[1:])
+        self.assertRaises(ValueError, parse_distmat_to_condensed, lines[:-1])
+        self.assertRaises(ValueError, parse_distmat_to_condensed,
+            lines + lines[-1:])
+        self.assertRaises(ValueError, parse_distmat_to_condensed,
+            lines[:1] + ["a\t0\t0.1\t0.2"] + lines[2:])
+
+    def test_write_distmat_binary(self):
+        """The binary files are written next to the distance matrix"""
+        values_fp, ids_fp = get_binary_fps(self.dm_fp)
+        self.assertFalse(is_binary_up_to_date(self.dm_fp))
+        write_distmat_binary(self.dm_fp, 'float32')
+        self.assertTrue(is_binary_up_to_date(self.dm_fp))
+        # No temporary files are left
+        self.assertEqual(sorted(listdir(self.dm_dir)), ['dm.txt',
+            'dm.txt.condensed.npy', 'dm.txt.ids.npy'])
+
+        sample_ids, matrix = load_distmat_binary(self.dm_fp)
+        self.assertEqual(sample_ids, ['a', 'b', 'c', 'd'])
+        self.assertTrue(isinstance(matrix.values, memmap))
+        self.assertEqual(matrix.values.dtype, 'float32')
+        self.assertFloatEqual(matrix.values.tolist(),
+            [0.1, 0.2, 0.3, 0.4, 0.5, 0.6])
+
+        # A newer distance matrix makes the binary files out of date
+        mtime = getmtime(values_fp)
+        utime(self.dm_fp, (mtime + 10, mtime + 10))
+        self.assertFalse(is_binary_up_to_date(self.dm_fp))
+
+    def test_load_distmat(self):
+        """The binary files are written once and then memory-mapped"""
+        values_fp, ids_fp = get_binary_fps(self.dm_fp)
+        sample_ids, matrix = load_distmat(self.dm_fp)
+        self.assertEqual(sample_ids, ['a', 'b', 'c', 'd'])
+        self.assertEqual(matrix.values.tolist(), [0.1, 0.2, 0.3, 0.4, 0.5,
+            0.6])
+        self.assertTrue(isinstance(matrix.values, memmap))
+        mtime = getmtime(values_fp)
+
+        # The text file is not parsed again
+        f = open(self.dm_fp, 'w')
+        f.write("not a distance matrix")
+        f.close()
+        utime(self.dm_fp, (mtime - 10, mtime - 10))
+        sample_ids, matrix = load_distmat(self.dm_fp)
+        self.assertEqual(matrix.values.tolist(), [0.1, 0.2, 0.3, 0.4, 0.5,
+            0.6])
+
+        # A different data type rewrites the binary files
+        f = open(self.dm_fp, 'w')
+        f.write(dm_lines)
+        f.close()
+        utime(self.dm_fp, (mtime - 10, mtime - 10))
+        sample_ids, matrix = load_distmat(self.dm_fp, 'float32')
+        self.assertEqual(matrix.values.dtype, 'float32')
+
+dm_lines = """\ta\tb\tc\td
+a\t0\t0.1\t0.2\t0.3
+b\t0.1\t0\t0.4\t0.5
+c\t0.2\t0.4\t0\t0.6
+d\t0.3\t0.5\t0.6\t0
+"""
+
+if __name__ == '__main__':
+    main()
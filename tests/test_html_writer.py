@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+__author__ = "Jose Antonio Navas Molina"
+__copyright__ = "Copyright 2013, The FastUniFrac Project"
+__credits__ = ["Jose Antonio Navas Molina"]
+__license__ = "GPL"
+__version__ = "1.7.0-dev"
+__maintainer__ = "Jose Antonio Navas Molina"
+__email__ = "josenavasmolina@gmail.com"
+__status__ = "Development"
+
+from cogent.util.unit_test import TestCase, main
+from qiime.util import load_qiime_config, get_tmp_filename
+from os import remove, path
+from StringIO import StringIO
+from fastunifrac.html_writer import (BufferedHtmlWriter, split_template,
+    write_template, render_to_string, render_to_file)
+
+class HtmlWriterTest(TestCase):
+    def setUp(self):
+        """Set up some test variables"""
+        self.qiime_config = load_qiime_config()
+        self.tmp_dir = self.qiime_config['temp_dir'] or '/tmp/'
+        self.html_fp = get_tmp_filename(tmp_dir=self.tmp_dir, suffix='.html')
+        self.template = """<div style="width: 33%%;">%s</div>\n<p>%s</p>\n"""
+
+        self._paths_to_clean_up = []
+
+    def tearDown(self):
+        """Cleans up the environment once the tests finish"""
+        map(remove, self._paths_to_clean_up)
+
+    def test_buffered_html_writer(self):
+        """The strings are written in chunks of at least buffer_size"""
+        out = StringIO()
+        writer = BufferedHtmlWriter(out, buffer_size=10)
+        writer.write("abcd")
+        writer.write("efgh")
+        self.assertEqual(out.getvalue(), "")
+        writer.writelines(["ij", "kl"])
+        self.assertEqual(out.getvalue(), "abcdefghij")
+        writer.flush()
+        self.assertEqual(out.getvalue(), "abcdefghijkl")
+        writer.flush()
+        self.assertEqual(out.getvalue(), "abcdefghijkl")
+
+    def test_split_template(self):
+        """The template is split in its literal pieces"""
+        obs = split_template(self.template)
+        self.assertEqual(obs, ['<div style="width: 33%;">', '</div>\n<p>',
+            '</p>\n'])
+
+    def test_write_template(self):
+        """The output is the same as the template formatting"""
+        def write_rows(writer):
+            for i in range(3):
+                writer.write("<b>%d</b>" % i)
+        exp = self.template % ("<b>0</b><b>1</b><b>2</b>", "a%b")
+
+        out = StringIO()
+        writer = BufferedHtmlWriter(out)
+        write_template(writer, self.template, write_rows, "a%b")
+        writer.flush()
+        self.assertEqual(out.getvalue(), exp)
+
+        out = StringIO()
+        writer = BufferedHtmlWriter(out, buffer_size=1)
+        write_template(writer, self.template,
+            ("<b>%d</b>" % i for i in range(3)), "a%b")
+        self.assertEqual(out.getvalue(), exp)
+
+        self.assertRaises(ValueError, write_template, writer, self.template,
+            "a")
+
+    def test_render_to_string(self):
+        """The written html code is returned as a string"""
+        obs = render_to_string(write_template, self.template, "a", "b")
+        self.assertEqual(obs, self.template % ("a", "b"))
+
+    def test_render_to_file(self):
+        """The written html code is stored in the file"""
+        self._paths_to_clean_up = [self.html_fp]
+        render_to_file(write_template, self.html_fp, self.template, "a", "b")
+        self.assertEqual(open(self.html_fp).read(), self.template % ("a", "b"))
+
+        # A failed write does not leave a partial file
+        self._paths_to_clean_up = []
+        self.assertRaises(ValueError, render_to_file, write_template,
+            self.html_fp, self.template, "a")
+        self.assertFalse(path.exists(self.html_fp))
+
+if __name__ == '__main__':
+    main()
@@ -12,10 +12,18 @@ __status__ = "Development"
 from cogent.util.unit_test import TestCase, main
 from qiime.util import load_qiime_config, get_tmp_filename
 from os import remove
+from numpy import array, isnan, nan
 from fastunifrac.make_html_heatmap import (LD_NAME, LD_HEADERS, LD_HEADERS_VER,
     LD_HEADERS_HOR, LD_MATRIX, LD_TRANSFORM_VALUES, LD_TABLE_TITLE)
 from fastunifrac.make_beta_significance_heatmap import (
-    generate_headers_and_matrix, generate_dict_data, generate_data_make_html)
+    generate_headers_and_matrices_from_columns, generate_headers_and_matrices,
+    generate_headers_and_matrix,
+    generate_dict_data, generate_data_make_html, generate_data_make_html_from_fp)
+
+def nan_to_none(matrix):
+    """Returns the list of lists of 'matrix' with None instead of NaN"""
+    return [[None if isnan(value) else value for value in row]
+        for row in matrix.tolist()]
 
 class MakeBetaSignificanceHeatmapTest(TestCase):
     def setUp(self):
@@ -73,6 +81,47 @@ class MakeBetaSignificanceHeatmapTest(TestCase):
         self.assertRaises(ValueError, generate_headers_and_matrix,
             self.dict_data, 2)
 
+    def test_generate_headers_and_matrices(self):
+        """Both matrices are built in a single pass over the pairs"""
+        obs_headers, obs_raw, obs_corr = generate_headers_and_matrices(
+            self.dict_data)
+        exp_headers = {LD_HEADERS_VER: ['s1', 's2', 's3'],
+            LD_HEADERS_HOR: ['s1', 's2', 's3', 's4']}
+        self.assertEqual(obs_headers, exp_headers)
+        self.assertEqual(nan_to_none(obs_raw), [[None, 0.01, 0.0, 0.02],
+            [None, None, 0.82, 0.4],
+            [None, None, None, 0.0]])
+        self.assertEqual(nan_to_none(obs_corr), [[None, 0.15, 0.01, 0.3],
+            [None, None, 1.0, 1.0],
+            [None, None, None, 0.01]])
+
+        # The pairs do not need to be complete nor sorted
+        dict_data = {('s3', 's4'): (0.0, 0.01), ('s1', 's3'): (0.0, 0.01),
+            ('s1', 's2'): (0.01, 0.15)}
+        obs_headers, obs_raw, obs_corr = generate_headers_and_matrices(
+            dict_data)
+        self.assertEqual(obs_headers, {LD_HEADERS_VER: ['s1', 's3'],
+            LD_HEADERS_HOR: ['s1', 's2', 's3', 's4']})
+        self.assertEqual(nan_to_none(obs_raw), [[None, 0.01, 0.0, None],
+            [None, None, None, 0.0]])
+        self.assertEqual(nan_to_none(obs_corr), [[None, 0.15, 0.01, None],
+            [None, None, None, 0.01]])
+
+    def test_generate_headers_and_matrices_from_columns(self):
+        """The matrices are built from the parsed columns"""
+        sample_ids = ['s4', 's1', 's3', 's2']
+        pairs = array([[1, 3], [2, 0], [1, 2]])
+        p_values = array([[0.01, 0.15], [0.0, 0.01], [0.0, 0.01]])
+        obs_headers, obs_raw, obs_corr = \
+            generate_headers_and_matrices_from_columns(sample_ids, pairs,
+                p_values)
+        self.assertEqual(obs_headers, {LD_HEADERS_VER: ['s1', 's3'],
+            LD_HEADERS_HOR: ['s1', 's2', 's3', 's4']})
+        self.assertEqual(nan_to_none(obs_raw), [[None, 0.01, 0.0, None],
+            [None, None, None, 0.0]])
+        self.assertEqual(nan_to_none(obs_corr), [[None, 0.15, 0.01, None],
+            [None, None, None, 0.01]])
+
     def test_generate_dict_data(self):
         """The dictionary with the plot data is generated correctly"""
         obs_dict_data = generate_dict_data(self.name, self.headers,
@@ -109,9 +158,9 @@ class MakeBetaSignificanceHeatmapTest(TestCase):
         dict_raw = {LD_NAME: "Raw values",
             LD_HEADERS: {LD_HEADERS_VER: ['s1', 's2', 's3'],
                 LD_HEADERS_HOR: ['s1', 's2', 's3', 's4']},
-            LD_MATRIX : [[None, 0.01, 0.0, 0.02],
-                [None, None, 0.82, 0.4],
-                [None, None, None, 0.0]],
+            LD_MATRIX : array([[nan, 0.01, 0.0, 0.02],
+                [nan, nan, 0.82, 0.4],
+                [nan, nan, nan, 0.0]]),
             LD_TRANSFORM_VALUES: {(None, None) : (0, ""),
                 (None, 0.001): (1, "(<0.001)\nHighly\nsignificant"),
                 (0.001, 0.01): (2, "(0.001-0.01)\nSignificant"),
@@ -123,9 +172,9 @@ class MakeBetaSignificanceHeatmapTest(TestCase):
         dict_corr = {LD_NAME: "Corrected values",
             LD_HEADERS: {LD_HEADERS_VER: ['s1', 's2', 's3'],
                 LD_HEADERS_HOR: ['s1', 's2', 's3', 's4']},
-            LD_MATRIX : [[None, 0.15, 0.01, 0.3],
-                [None, None, 1.0, 1.0],
-                [None, None, None, 0.01]],
+            LD_MATRIX : array([[nan, 0.15, 0.01, 0.3],
+                [nan, nan, 1.0, 1.0],
+                [nan, nan, nan, 0.01]]),
             LD_TRANSFORM_VALUES: {(None, None) : (0, ""),
                 (None, 0.001): (1, "(<0.001)\nHighly\nsignificant"),
                 (0.001, 0.01): (2, "(0.001-0.01)\nSignificant"),
@@ -138,6 +187,20 @@ class MakeBetaSignificanceHeatmapTest(TestCase):
 
         self.assertEqual(obs_list_data, exp_list_data)
 
+    def test_generate_data_make_html_from_fp(self):
+        """The list of dicts is the same when loaded through the binary file"""
+        out = open(self.input_file, 'w')
+        out.write(bs_file_content)
+        out.close()
+
+        self._paths_to_clean_up = [self.input_file, self.input_file + '.npz']
+
+        exp_list_data = generate_data_make_html(open(self.input_file, 'U'))
+        # The first call writes the binary file and the second one loads it
+        for i in range(2):
+            obs_list_data = generate_data_make_html_from_fp(self.input_file)
+            self.assertEqual(obs_list_data, exp_list_data)
+
 bs_file_content = """#Comment with the name of the test realized
 Sample1\tSample2\tp value\tp value (Bonferroni corrected)
 s1\ts2\t0.01\t0.15
@@ -10,6 +10,7 @@ __email__ = "josenavasmolina@gmail.com"
 __status__ = "Development"
 
 from cogent.util.unit_test import TestCase, main
+from numpy import array, nan
 from fastunifrac.make_html_heatmap import (LD_NAME, LD_HEADERS, LD_HEADERS_VER,
     LD_HEADERS_HOR, LD_MATRIX, LD_TRANSFORM_VALUES, LD_TABLE_TITLE)
 from fastunifrac.make_distance_matrix_heatmap import (get_upper_triangle,
@@ -66,6 +67,15 @@ class MakeDistanceMatrixHeatmapTest(TestCase):
         data = [1, 2, 3]
         self.assertRaises(ValueError, compute_quartiles, data)
 
+    def test_compute_quartiles_unsorted(self):
+        """The quartiles do not depend on the order of the data"""
+        data = array([9, 1, 7, 3, 5, 2, 8, 4, 6])
+        self.assertEqual(compute_quartiles(data), (2.5, 5, 7.5))
+        self.assertEqual(data.tolist(), [9, 1, 7, 3, 5, 2, 8, 4, 6])
+
+        data = [6, 5, 4, 3, 2, 1, 1, 6]
+        self.assertEqual(compute_quartiles(data), (1.5, 3.5, 5.5))
+
     def test_make_quartiles(self):
         """The dict with the quartile ranges are computed correctly"""
         obs_quart = make_quartiles(self.upper_triangle)
@@ -77,6 +87,10 @@ class MakeDistanceMatrixHeatmapTest(TestCase):
         }
         self.assertEqual(obs_quart, exp_quart)
 
+        obs_quart = make_quartiles(array([[nan, 1, 2, 3], [nan, nan, 4, 5],
+            [nan, nan, nan, 6], [nan, nan, nan, nan]]))
+        self.assertEqual(obs_quart, exp_quart)
+
     def test_generate_trans_values_dict(self):
         """The transformation dictionary is generated correctly"""
         obs_trans_values = generate_trans_values_dict(self.upper_triangle)
@@ -111,6 +125,9 @@ class MakeDistanceMatrixHeatmapTest(TestCase):
             (None, None): (0, "")}
         exp_data[LD_TABLE_TITLE] = "Distance matrix"
 
+        # The matrix is stored in condensed form
+        self.assertEqual(obs_data.pop(LD_MATRIX).tolist(),
+            exp_data.pop(LD_MATRIX))
         self.assertEqual(obs_data, exp_data)
 
 dm_lines = """\ta\tb\tc\td
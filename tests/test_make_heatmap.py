@@ -12,8 +12,18 @@ __status__ = "Development"
 from cogent.util.unit_test import TestCase, main
 from qiime.util import load_qiime_config
 from os import path, remove, mkdir, rmdir
+from numpy.random import RandomState
+from fastunifrac.condensed_matrix import CondensedMatrix
 from fastunifrac.make_heatmap import (get_info_from_dict, get_matrix_value,
-    make_plot_data, plot_heatmap, HEADERS_VER, HEADERS_HOR)
+    IntervalClassifier, make_plot_array, make_plot_data, plot_heatmap,
+    HeatmapRenderer, split_image_format, HEADERS_VER, HEADERS_HOR)
+from gzip import GzipFile
+from fastunifrac.make_beta_significance_heatmap import \
+    DICT_TRANS_VALUES as BS_TRANS_VALUES
+from fastunifrac.make_unifrac_significance_each_sample_html import \
+    DICT_TRANS_VALUES as US_TRANS_VALUES
+from fastunifrac.make_distance_matrix_heatmap import \
+    generate_trans_values_dict
 
 class MakeHeatmapTest(TestCase):
     def setUp(self):
@@ -99,6 +109,103 @@ class MakeHeatmapTest(TestCase):
         self.assertEqual(make_plot_data(self.matrix_ns, self.trans_values),
             result_matrix)
 
+    def test_interval_classifier(self):
+        """The intervals are sorted and classify single values"""
+        classifier = IntervalClassifier(self.trans_values)
+        self.assertEqual(classifier.lower, [0.0, 0.25, 0.5, 0.75])
+        self.assertEqual(classifier.upper, [0.25, 0.5, 0.75, 1.0])
+        self.assertEqual(classifier.plot_values, [1, 2, 3, 4])
+        for value in [None, 0.15, 0.35, 0.65, 0.85, 0.0, 0.25, 0.5, 0.75,
+            1.0, 1.5, -1.0]:
+            self.assertEqual(classifier(value),
+                get_matrix_value(value, self.trans_values))
+
+        classifier = IntervalClassifier(US_TRANS_VALUES)
+        self.assertEqual(classifier.lower[0], -float('inf'))
+        self.assertEqual(classifier.upper[-1], float('inf'))
+        self.assertEqual(classifier.plot_values, ["#FF8582", "#F8FE83",
+            "#82FF8B", "#99CCFF", "#dddddd"])
+        self.assertEqual(classifier(None), "#FFFFFF")
+        self.assertEqual(classifier(0.0), "#FF8582")
+        self.assertEqual(classifier(0.05), "#82FF8B")
+        self.assertEqual(classifier(1.0), "#dddddd")
+
+        # Empty intervals are ignored
+        trans_values = {(None, None): (0, ""), (0.0, 0.5): (1, ""),
+            (0.5, 0.5): (2, ""), (0.5, 1.0): (3, "")}
+        classifier = IntervalClassifier(trans_values)
+        self.assertEqual(classifier.plot_values, [1, 3])
+        self.assertEqual(classifier(0.5), 1)
+
+    def test_interval_classifier_invalid(self):
+        """Overlapping intervals are rejected"""
+        trans_values = {(None, None): (0, ""), (0.0, 0.5): (1, ""),
+            (0.4, 1.0): (2, "")}
+        self.assertRaises(ValueError, IntervalClassifier, trans_values)
+        trans_values = {(None, None): (0, ""), (None, 0.5): (1, ""),
+            (None, 1.0): (2, "")}
+        self.assertRaises(ValueError, IntervalClassifier, trans_values)
+
+    def test_interval_classifier_gaps(self):
+        """The values in a gap between intervals are not classified"""
+        trans_values = {(None, None): (0, ""), (0.0, 0.5): (1, ""),
+            (0.6, 1.0): (2, "")}
+        classifier = IntervalClassifier(trans_values)
+        for value in [None, 0.3, 0.5, 0.55, 0.6, 0.7, 1.0]:
+            self.assertEqual(classifier(value),
+                get_matrix_value(value, trans_values))
+        self.assertEqual(classifier(0.55), None)
+        self.assertEqual(classifier.classify_indices([0.3, 0.55, 0.6,
+            0.7]).tolist(), [0, -1, -1, 1])
+        obs = make_plot_array([[None, 0.3], [0.55, 0.7]], trans_values)
+        self.assertEqual(obs.tolist(), [[0, 1], [None, 2]])
+
+    def test_interval_classifier_classify(self):
+        """Whole matrices are classified at once"""
+        classifier = IntervalClassifier(self.trans_values)
+        obs = classifier.classify([[None, 0.0, 0.1], [0.25, 0.9, 2.0]])
+        self.assertEqual(obs.tolist(), [[0, None, 1], [1, 4, None]])
+        self.assertEqual(obs.mask.tolist(), [[False, True, False],
+            [False, False, True]])
+
+    def test_interval_classifier_classify_indices(self):
+        """The positions of the plot values are computed at once"""
+        classifier = IntervalClassifier(self.trans_values)
+        obs = classifier.classify_indices([[None, 0.0, 0.1], [0.25, 0.9,
+            2.0]])
+        self.assertEqual(obs.tolist(), [[4, -1, 0], [0, 3, -1]])
+
+    def test_make_plot_array(self):
+        """The plot array matches the value by value translation"""
+        prng = RandomState(42)
+        values = prng.uniform(-0.1, 1.1, size=(20, 20))
+        # Values at the interval boundaries
+        values[0, :] = [0.0, 0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 0.7, 0.75,
+            0.9, 0.999, 1.0, 0.5, 0.5, 0.5, 0.5, 0.5, 0.5, 0.5, 0.5]
+        matrix = values.tolist()
+        for i in range(20):
+            for j in range(i + 1):
+                matrix[i][j] = None
+
+        for trans_values in [self.trans_values, BS_TRANS_VALUES,
+            US_TRANS_VALUES, JACKKNIFE_TRANS_VALUES,
+            generate_trans_values_dict(matrix)]:
+            exp = [[get_matrix_value(v, trans_values) for v in row]
+                for row in matrix]
+            self.assertEqual(make_plot_array(matrix, trans_values).tolist(),
+                exp)
+            self.assertEqual(make_plot_data(matrix, trans_values), exp)
+
+        # Values out of every interval are masked
+        obs = make_plot_array([[None, -1.0, 0.5, 2.0]], self.trans_values)
+        self.assertEqual(obs.mask.tolist(), [[False, True, False, True]])
+
+        # The condensed matrices give the same plot array
+        condensed = CondensedMatrix.from_matrix(values)
+        trans_values = generate_trans_values_dict(condensed)
+        self.assertEqual(make_plot_array(condensed, trans_values).tolist(),
+            make_plot_array(matrix, trans_values).tolist())
+
     def test_plot_heatmap(self):
         """The heatmap images are generated correctly"""
         png_img_fp = path.join(self.output_dir, self.plot_name + '.png')
@@ -141,11 +248,138 @@ class MakeHeatmapTest(TestCase):
         self.assertTrue(path.exists(eps_gz_fp_ns),
             'The eps file was not created in the appropiate location')
 
+    def test_split_image_format(self):
+        """The image formats are validated and split"""
+        self.assertEqual(split_image_format('png'), ('png', False))
+        self.assertEqual(split_image_format('eps.gz'), ('eps', True))
+        self.assertEqual(split_image_format('svg'), ('svg', False))
+        self.assertRaises(ValueError, split_image_format, 'png.gz')
+        self.assertRaises(ValueError, split_image_format, 'jpg')
+
+    def test_plot_heatmap_image_formats(self):
+        """The images are written in the requested formats"""
+        png_img_fp = path.join(self.output_dir, self.plot_name + '.png')
+        eps_gz_fp = path.join(self.output_dir, self.plot_name + '.eps.gz')
+        svg_fp = path.join(self.output_dir, self.plot_name + '.svg')
+        svg_gz_fp = path.join(self.output_dir, self.plot_name + '.svg.gz')
+
+        self._dirs_to_clean_up = [self.output_dir]
+        mkdir(self.output_dir)
+
+        # The eps is really gzipped
+        self._paths_to_clean_up = [png_img_fp, eps_gz_fp]
+        plot_heatmap(self.plot_name, self.headers, self.matrix,
+            self.trans_values, self.output_dir)
+        eps = GzipFile(eps_gz_fp).read()
+        self.assertTrue(eps.startswith('%!PS-Adobe'))
+        self.assertEqual(open(png_img_fp, 'rb').read(8), '\x89PNG\r\n\x1a\n')
+        map(remove, self._paths_to_clean_up)
+
+        # Png only
+        self._paths_to_clean_up = [png_img_fp]
+        plot_heatmap(self.plot_name, self.headers, self.matrix,
+            self.trans_values, self.output_dir, image_formats=['png'])
+        self.assertTrue(path.exists(png_img_fp))
+        self.assertFalse(path.exists(eps_gz_fp))
+        map(remove, self._paths_to_clean_up)
+
+        # Several formats through a renderer
+        self._paths_to_clean_up = [svg_fp, svg_gz_fp]
+        renderer = HeatmapRenderer()
+        plot_heatmap(self.plot_name, self.headers, self.matrix,
+            self.trans_values, self.output_dir, renderer, ['svg', 'svg.gz'])
+        renderer.close()
+        self.assertFalse(path.exists(png_img_fp))
+        self.assertTrue(open(svg_fp).read().startswith('<?xml'))
+        self.assertTrue(GzipFile(svg_gz_fp).read().startswith('<?xml'))
+
+        self.assertRaises(ValueError, plot_heatmap, self.plot_name,
+            self.headers, self.matrix, self.trans_values, self.output_dir,
+            image_formats=['bmp'])
+
+    def test_heatmap_renderer(self):
+        """The renderer reuses the figures of the same size"""
+        renderer = HeatmapRenderer(max_figures=1)
+        width, height, canvas, plot = renderer.render(self.headers,
+            self.matrix, self.trans_values)
+        self.assertEqual((width, height), (10, 10))
+        self.assertEqual(canvas.figure.get_size_inches().tolist(), [10, 10])
+        self.assertEqual(plot.get_array().tolist(),
+            make_plot_data(self.matrix, self.trans_values))
+
+        # Same headers and translation dict: only the image data changes
+        matrix = [[None, 0.3, 0.3, 0.3],
+            [None, None, 0.3, 0.3],
+            [None, None, None, 0.3],
+            [None, None, None, None]]
+        width, height, canvas2, plot2 = renderer.render(self.headers,
+            matrix, self.trans_values)
+        self.assertTrue(canvas2 is canvas)
+        self.assertTrue(plot2 is plot)
+        self.assertEqual(plot.get_array().tolist(),
+            make_plot_data(matrix, self.trans_values))
+
+        # Same size but different headers: the figure is redrawn
+        width, height, canvas3, plot3 = renderer.render(self.headers_ns,
+            self.matrix_ns, self.trans_values)
+        self.assertTrue(canvas3 is canvas)
+        self.assertFalse(plot3 is plot)
+        self.assertEqual(len(canvas.figure.axes), 2)
+
+        # A different size uses a new figure and releases the old one
+        headers = {HEADERS_HOR: ['S%d' % i for i in range(20)],
+            HEADERS_VER: ['S%d' % i for i in range(20)]}
+        width, height, canvas4, plot4 = renderer.render(headers,
+            [[0.1] * 20] * 20, self.trans_values)
+        self.assertEqual((width, height), (7, 7))
+        self.assertFalse(canvas4 is canvas)
+        self.assertEqual(canvas.figure.axes, [])
+
+        renderer.close()
+        self.assertEqual(canvas4.figure.axes, [])
+
+    def test_heatmap_renderer_reused_template(self):
+        """A reused figure gives the same image as a fresh renderer"""
+        first_fp = path.join(self.output_dir, 'first.png')
+        fresh_fp = path.join(self.output_dir, 'fresh.png')
+        self._paths_to_clean_up = [first_fp, fresh_fp]
+        self._dirs_to_clean_up = [self.output_dir]
+        mkdir(self.output_dir)
+
+        # The second matrix only has values of the first two intervals
+        matrix = [[None, 0.1, 0.3, 0.2],
+            [None, None, 0.4, 0.1],
+            [None, None, None, 0.3],
+            [None, None, None, None]]
+        renderer = HeatmapRenderer()
+        renderer.render(self.headers, self.matrix, self.trans_values)
+        width, height, canvas, plot = renderer.render(self.headers, matrix,
+            self.trans_values)
+        renderer.save(canvas, 'first', self.output_dir, ['png'])
+        renderer.close()
+
+        fresh_renderer = HeatmapRenderer()
+        width, height, fresh_canvas, fresh_plot = fresh_renderer.render(
+            self.headers, matrix, self.trans_values)
+        fresh_renderer.save(fresh_canvas, 'fresh', self.output_dir, ['png'])
+        fresh_renderer.close()
+
+        self.assertEqual(plot.get_clim(), fresh_plot.get_clim())
+        self.assertEqual(open(first_fp, 'rb').read(),
+            open(fresh_fp, 'rb').read())
+
 matrix = [[None, 0.1, 0.9, 0.5],
     [None, None, 0.8, 0.7],
     [None, None, None, 0.4],
     [None, None, None, None]]
 
+JACKKNIFE_TRANS_VALUES = {(None, None) : ("#FFFFFF", ""),
+            (None, 0.5): ("#dddddd", "< 50%"),
+            (0.5, 0.7): ("#99CCFF", "50-70%"),
+            (0.7, 0.9): ("#82FF8B", "70-90%"),
+            (0.9, 0.999): ("#F8FE83", "90-99.9%"),
+            (0.999, None): ("#FF8582", "> 99.9%")}
+
 not_a_square_matrix = [[None, 0.1, 0.9, 0.5],
     [None, None, 0.8, 0.7],
     [None, None, None, 0.4]]
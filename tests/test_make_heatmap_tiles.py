@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+__author__ = "Jose Antonio Navas Molina"
+__copyright__ = "Copyright 2013, The FastUniFrac Project"
+__credits__ = ["Jose Antonio Navas Molina"]
+__license__ = "GPL"
+__version__ = "1.7.0-dev"
+__maintainer__ = "Jose Antonio Navas Molina"
+__email__ = "josenavasmolina@gmail.com"
+__status__ = "Development"
+
+from cogent.util.unit_test import TestCase, main
+from qiime.util import load_qiime_config
+from os import listdir
+from os.path import join, exists
+from shutil import rmtree
+from tempfile import mkdtemp
+from json import loads
+from matplotlib.image import imread
+from numpy import nan
+from fastunifrac.make_heatmap import HEADERS_VER, HEADERS_HOR
+from fastunifrac.make_heatmap_tiles import (get_num_levels, get_color_codes,
+    get_pixel_cells, render_tile, write_tiles, get_json_values,
+    write_value_blocks, make_tiled_heatmap)
+from fastunifrac.condensed_matrix import CondensedMatrix
+
+class MakeHeatmapTilesTest(TestCase):
+    def setUp(self):
+        """Set up some test variables"""
+        self.qiime_config = load_qiime_config()
+        self.tmp_dir = self.qiime_config['temp_dir'] or '/tmp/'
+        self.output_dir = mkdtemp(dir=self.tmp_dir)
+
+        self.matrix = [[None, 0.1, 0.9, 0.5],
+            [None, None, 0.8, 0.7],
+            [None, None, None, 0.4],
+            [None, None, None, None]]
+
+        self.trans_values = {}
+        self.trans_values[(None, None)] = (0, "")
+        self.trans_values[(0.0, 0.25)] = (1, "(0-25%)")
+        self.trans_values[(0.25, 0.5)] = (2, "(25-50%)")
+        self.trans_values[(0.5, 0.75)] = (3, "(50-75%)")
+        self.trans_values[(0.75, 1.0)] = (4, "(75-100%)")
+
+        samples = ["Sample1", "Sample2", "Sample3", "Sample4"]
+        self.headers = {HEADERS_HOR: samples, HEADERS_VER: samples}
+        self.mapping_data = [dict([(s, {'Description': s + ' description'})
+            for s in samples]), ""]
+
+    def tearDown(self):
+        """Cleans up the environment once the tests finish"""
+        rmtree(self.output_dir)
+
+    def test_get_num_levels(self):
+        """The deepest level shows the cells big enough"""
+        self.assertEqual(get_num_levels(4, 256, 8), 1)
+        self.assertEqual(get_num_levels(64, 256, 8), 2)
+        self.assertEqual(get_num_levels(3000, 256, 8), 7)
+        self.assertEqual(get_num_levels(3000, 256, 1), 4)
+
+    def test_get_color_codes(self):
+        """The cells are coded by their position in the plot values"""
+        codes, colors = get_color_codes(self.matrix, self.trans_values)
+        self.assertEqual(codes.tolist(), [[5, 1, 4, 2],
+            [5, 5, 4, 3],
+            [5, 5, 5, 2],
+            [5, 5, 5, 5]])
+        self.assertEqual(colors.shape, (6, 4))
+        # The last color is transparent
+        self.assertEqual(colors[-1].tolist(), [0, 0, 0, 0])
+        self.assertEqual(colors[:-1, 3].tolist(), [255] * 5)
+
+        # Values out of the intervals are not drawn either
+        codes, colors = get_color_codes([[None, 2.0]], self.trans_values)
+        self.assertEqual(codes.tolist(), [[5, 5]])
+
+    def test_get_pixel_cells(self):
+        """The pixels are mapped to the cells"""
+        self.assertEqual(get_pixel_cells(0, 8, 8, 4).tolist(),
+            [0, 0, 1, 1, 2, 2, 3, 3])
+        self.assertEqual(get_pixel_cells(2, 4, 4, 8).tolist(), [4, 6])
+
+    def test_render_tile(self):
+        """The tiles are rendered with the cell colors"""
+        codes, colors = get_color_codes(self.matrix, self.trans_values)
+        tile = render_tile(codes, colors, 8, 0, 0, 4)
+        self.assertEqual(tile.shape, (4, 4, 4))
+        self.assertEqual(tile[0, 2].tolist(), colors[1].tolist())
+        self.assertEqual(tile[1, 3].tolist(), colors[1].tolist())
+        # The lower left tile only shows None values
+        self.assertEqual(render_tile(codes, colors, 8, 1, 0, 4), None)
+        # Border tiles are cropped
+        codes, colors = get_color_codes([[0.1, 0.2, 0.3]], self.trans_values)
+        tile = render_tile(codes, colors, 8, 0, 1, 4)
+        self.assertEqual(tile.shape, (3, 4, 4))
+
+    def test_write_tiles(self):
+        """The tile pyramid is written without the empty tiles"""
+        matrix = [[None if j <= i else 0.1 for j in range(40)]
+            for i in range(40)]
+        codes, colors = get_color_codes(matrix, self.trans_values)
+        levels = write_tiles(codes, colors, self.output_dir, 32, 4)
+        self.assertEqual(levels, 3)
+        self.assertEqual(sorted(listdir(self.output_dir)), ['0', '1', '2'])
+        self.assertEqual(listdir(join(self.output_dir, '0')), ['0_0.png'])
+        # The level 2 has 4x4 tiles, but only the upper triangle is written
+        self.assertEqual(len(listdir(join(self.output_dir, '2'))), 10)
+        self.assertFalse(exists(join(self.output_dir, '2', '1_0.png')))
+        self.assertEqual(imread(join(self.output_dir, '2',
+            '0_3.png')).shape, (32, 32, 4))
+
+    def read_values_block(self, tiles_dir, block):
+        """Returns the values registered by a block file"""
+        values_js = open(join(tiles_dir, 'values', '%d.js' % block)).read()
+        prefix = 'heatmapTilesValues(%d, ' % block
+        self.assertTrue(values_js.startswith(prefix))
+        return loads(values_js[len(prefix):-3])
+
+    def test_get_json_values(self):
+        """The NaN values are replaced by None"""
+        self.assertEqual(get_json_values([0.1, nan, None]), [0.1, None, None])
+        self.assertEqual(get_json_values([[None, 0.5], [nan, None]]),
+            [[None, 0.5], [None, None]])
+
+    def test_write_value_blocks(self):
+        """The values are written in blocks of rows"""
+        write_value_blocks(self.matrix, self.output_dir, 3)
+        self.assertEqual(sorted(listdir(join(self.output_dir, 'values'))),
+            ['0.js', '1.js'])
+        self.assertEqual(self.read_values_block(self.output_dir, 0),
+            self.matrix[:3])
+        self.assertEqual(self.read_values_block(self.output_dir, 1),
+            self.matrix[3:])
+
+        # The blocks of a CondensedMatrix are slices of its condensed vector
+        matrix = CondensedMatrix(4, [0.1, 0.9, nan, 0.8, 0.7, 0.4])
+        write_value_blocks(matrix, self.output_dir, 2)
+        self.assertEqual(self.read_values_block(self.output_dir, 0),
+            [0.1, 0.9, None, 0.8, 0.7])
+        self.assertEqual(self.read_values_block(self.output_dir, 1), [0.4])
+
+    def test_make_tiled_heatmap(self):
+        """The tiled heatmap and its html page are generated"""
+        html_fp = join(self.output_dir, 'index.html')
+        make_tiled_heatmap("Distance matrix", self.headers, self.matrix,
+            self.trans_values, self.mapping_data, "Distance matrix", html_fp,
+            self.output_dir)
+        for name in ['index.html', 'overlib.js', 'heatmap_tiles.js',
+            join('Distance matrix_tiles', '0', '0_0.png')]:
+            self.assertTrue(exists(join(self.output_dir, name)),
+                '%s was not created in the appropiate location' % name)
+
+        html = open(html_fp).read()
+        self.assertTrue('src="Distance matrix_tiles/tiles.js"' in html)
+        self.assertTrue('(75-100%)' in html)
+
+        tiles_js = open(join(self.output_dir, 'Distance matrix_tiles',
+            'tiles.js')).read()
+        self.assertTrue(tiles_js.startswith('heatmapTilesRegister('))
+        tiles_data = loads(tiles_js[len('heatmapTilesRegister('):-3])
+        self.assertEqual(tiles_data['levels'], 1)
+        self.assertEqual(tiles_data['n_rows'], 4)
+        self.assertEqual(tiles_data['path'], 'Distance matrix_tiles/')
+        self.assertEqual(tiles_data['desc']['Sample3'], 'Sample3 description')
+        self.assertFalse(tiles_data['condensed'])
+        tiles_dir = join(self.output_dir, 'Distance matrix_tiles')
+        self.assertEqual(self.read_values_block(tiles_dir, 0), self.matrix)
+
+    def test_make_tiled_heatmap_condensed(self):
+        """The tiles data of a CondensedMatrix carry its values"""
+        matrix = CondensedMatrix.from_matrix([[0.0, 0.1, 0.9, 0.5],
+            [0.1, 0.0, 0.8, 0.7],
+            [0.9, 0.8, 0.0, nan],
+            [0.5, 0.7, nan, 0.0]])
+        html_fp = join(self.output_dir, 'index.html')
+        make_tiled_heatmap("Distance matrix", self.headers, matrix,
+            self.trans_values, self.mapping_data, "Distance matrix", html_fp,
+            self.output_dir)
+        tiles_dir = join(self.output_dir, 'Distance matrix_tiles')
+        tiles_js = open(join(tiles_dir, 'tiles.js')).read()
+        tiles_data = loads(tiles_js[len('heatmapTilesRegister('):-3])
+        self.assertTrue(tiles_data['condensed'])
+        values = self.read_values_block(tiles_dir, 0)
+        self.assertEqual(values, [0.1, 0.9, 0.5, 0.8, 0.7, None])
+        # Looked up as heatmap_tiles.js does, the diagonal and the lower
+        # triangle are masked
+        n = tiles_data['n_rows']
+        full = [[values[n * i - i * (i + 1) / 2 + j - i - 1] if i < j
+            else None for j in range(n)] for i in range(n)]
+        self.assertEqual(full, matrix.tolist())
+        self.assertEqual(full[1][0], None)
+        self.assertEqual(full[0][1], 0.1)
+
+if __name__ == '__main__':
+    main()
@@ -12,11 +12,16 @@ __status__ = "Development"
 from cogent.util.unit_test import TestCase, main
 from fastunifrac.make_heatmap import plot_heatmap
 from qiime.util import load_qiime_config, get_tmp_filename
-from os import path, remove, mkdir, rmdir
+from os import path, remove, mkdir, rmdir, listdir
 from fastunifrac.make_html_heatmap import (get_coords, generate_xmap,
-    make_html_file, get_html_table_string, get_html_page_string, LD_NAME,
-    LD_HEADERS, LD_HEADERS_VER, LD_HEADERS_HOR, LD_MATRIX, LD_TRANSFORM_VALUES,
+    make_html_file, get_html_table_string, get_html_page_string,
+    get_cell_geometry, write_map_data_file, get_download_links,
+    render_heatmap, render_heatmaps, LD_NAME, LD_HEADERS,
+    LD_HEADERS_VER, LD_HEADERS_HOR, LD_MATRIX, LD_TRANSFORM_VALUES,
     LD_TABLE_TITLE)
+from json import loads
+from numpy import nan
+from fastunifrac.condensed_matrix import CondensedMatrix
 
 class MakeHtmlHeatmapTest(TestCase):
     def setUp(self):
@@ -131,6 +136,12 @@ class MakeHtmlHeatmapTest(TestCase):
         self.assertEqual(all_xcoords, result_all_xcoords)
         self.assertEqual(all_ycoords, result_all_ycoords)
 
+        # The condensed matrices give the same coordinates and labels
+        condensed = CondensedMatrix.from_matrix([[nan if v is None else v
+            for v in row] for row in data[LD_MATRIX]])
+        self.assertEqual(get_coords(data[LD_HEADERS], condensed, plot,
+            self.mapping_data), (all_cids, all_xcoords, all_ycoords))
+
     def test_generate_xmap(self):
         """The AREA tag is generated correctly"""
         data = self.list_data_single_plot[0]
@@ -154,6 +165,137 @@ class MakeHtmlHeatmapTest(TestCase):
         self.assertEqual(img_width, 800)
         self.assertEqual(xmap, result_xmap)
 
+    def test_get_cell_geometry(self):
+        """The image coordinates of the cells are retrieved correctly"""
+        data = self.list_data_single_plot[0]
+
+        plot_output_dir = path.join(self.tmp_dir, "plot_dir")
+        png_img_fp = path.join(plot_output_dir, data[LD_NAME] + '.png')
+        eps_gz_fp = path.join(plot_output_dir, data[LD_NAME] + '.eps.gz')
+
+        self._paths_to_clean_up = [png_img_fp, eps_gz_fp]
+        self._dirs_to_clean_up = [plot_output_dir]
+
+        mkdir(plot_output_dir)
+
+        width, height, plot = plot_heatmap(data[LD_NAME], data[LD_HEADERS],
+            data[LD_MATRIX], data[LD_TRANSFORM_VALUES], plot_output_dir)
+
+        x0, y0, dx, dy = get_cell_geometry(plot, 800)
+        self.assertFloatEqual((x0, y0, dx, dy), (242.0, 136.0, 112.0, 112.0))
+
+        # The geometry agrees with the coordinates of the AREA tags
+        all_cids, all_xcoords, all_ycoords = get_coords(data[LD_HEADERS],
+            data[LD_MATRIX], plot, self.mapping_data)
+        self.assertFloatEqual(all_xcoords[0], x0 + dx)
+        self.assertFloatEqual(800 - all_ycoords[0], y0)
+
+    def test_render_heatmap_scalable(self):
+        """The scalable mode only computes the geometry of the cells"""
+        data = self.list_data_single_plot[0]
+
+        plot_output_dir = path.join(self.tmp_dir, "plot_dir")
+        png_img_fp = path.join(plot_output_dir, data[LD_NAME] + '.png')
+        eps_gz_fp = path.join(plot_output_dir, data[LD_NAME] + '.eps.gz')
+
+        self._paths_to_clean_up = [png_img_fp, eps_gz_fp]
+        self._dirs_to_clean_up = [plot_output_dir]
+
+        mkdir(plot_output_dir)
+
+        rendered = render_heatmap(data, plot_output_dir)
+        self.assertEqual(len(rendered[2]), 6)
+        scalable_rendered = render_heatmap(data, plot_output_dir,
+            scalable=True)
+        self.assertEqual(scalable_rendered[2:5], (None, None, None))
+        self.assertEqual(scalable_rendered[:2], rendered[:2])
+        self.assertFloatEqual(scalable_rendered[5], rendered[5])
+
+        # The workers do not send the cell coordinates back either
+        [worker_rendered] = render_heatmaps([data], plot_output_dir,
+            ['png', 'eps.gz'], 2, scalable=True)
+        self.assertEqual(worker_rendered[2:5], (None, None, None))
+        self.assertFloatEqual(worker_rendered[5], rendered[5])
+
+    def test_write_map_data_file(self):
+        """The data file for the client-side image map is correct"""
+        data = self.list_data_single_plot[0]
+
+        plot_output_dir = path.join(self.tmp_dir, "plot_dir")
+        png_img_fp = path.join(plot_output_dir, data[LD_NAME] + '.png')
+        eps_gz_fp = path.join(plot_output_dir, data[LD_NAME] + '.eps.gz')
+        map_data_fp = path.join(plot_output_dir, data[LD_NAME] + '_map.js')
+
+        self._paths_to_clean_up = [png_img_fp, eps_gz_fp, map_data_fp]
+        self._dirs_to_clean_up = [plot_output_dir]
+
+        mkdir(plot_output_dir)
+
+        width, height, plot = plot_heatmap(data[LD_NAME], data[LD_HEADERS],
+            data[LD_MATRIX], data[LD_TRANSFORM_VALUES], plot_output_dir)
+
+        obs = write_map_data_file(data, self.mapping_data,
+            get_cell_geometry(plot, 800), plot_output_dir)
+        self.assertEqual(obs, data[LD_NAME] + '_map.js')
+
+        contents = open(map_data_fp).read()
+        prefix = 'heatmapRegister("%s", ' % data[LD_NAME]
+        self.assertTrue(contents.startswith(prefix))
+        self.assertTrue(contents.endswith(');\n'))
+        map_data = loads(contents[len(prefix):-3])
+        self.assertFloatEqual((map_data['x0'], map_data['y0'], map_data['dx'],
+            map_data['dy']), (242.0, 136.0, 112.0, 112.0))
+        self.assertEqual(map_data['ver'], data[LD_HEADERS][LD_HEADERS_VER])
+        self.assertEqual(map_data['hor'], data[LD_HEADERS][LD_HEADERS_HOR])
+        self.assertEqual(map_data['values'], data[LD_MATRIX])
+        self.assertEqual(map_data['desc'], {
+            'Sample1': 'Sample1 test description',
+            'Sample2': 'Sample2 test description',
+            'Sample3': 'Sample3 test description',
+            'Sample4': 'Sample4 test description'})
+
+        # The condensed matrices are stored as their condensed vector
+        data = dict(data)
+        data[LD_MATRIX] = CondensedMatrix(4, [0.1, 0.9, 0.5, 0.8, nan, 0.4])
+        write_map_data_file(data, self.mapping_data,
+            get_cell_geometry(plot, 800), plot_output_dir)
+        map_data = loads(open(map_data_fp).read()[len(prefix):-3])
+        self.assertFalse('values' in map_data)
+        self.assertEqual(map_data['condensed'], [0.1, 0.9, 0.5, 0.8, None,
+            0.4])
+
+    def test_get_download_links(self):
+        """The download links point to the images but the png"""
+        self.assertEqual(get_download_links('plot', ['png', 'eps.gz']),
+            ['<a href="plot.eps.gz" >Download Figure</a>'])
+        self.assertEqual(get_download_links('plot', ['png']), [])
+        self.assertEqual(get_download_links('plot', ['png', 'svg', 'pdf']),
+            ['<a href="plot.svg" >Download Figure (svg)</a>',
+            '<a href="plot.pdf" >Download Figure (pdf)</a>'])
+
+    def test_get_html_table_string_png_only(self):
+        """The HTML table without download links is correct"""
+        data = self.list_data_single_plot[0]
+
+        png_img_fp = path.join(self.output_dir, data[LD_NAME] + '.png')
+
+        self._paths_to_clean_up = [png_img_fp]
+        self._dirs_to_clean_up = [self.output_dir]
+
+        mkdir(self.output_dir)
+
+        html_table_string = get_html_table_string(data, self.mapping_data,
+            self.output_dir, image_formats=['png'])
+        exp = result_html_table_string % (data[LD_NAME], data[LD_NAME],
+            data[LD_NAME], data[LD_NAME])
+        exp = exp.replace('<br><a href="%s.eps.gz" >Download Figure</a>' %
+            data[LD_NAME], '')
+        self.assertEqual(html_table_string, exp)
+        self.assertEqual(listdir(self.output_dir), [data[LD_NAME] + '.png'])
+
+        self.assertRaises(ValueError, get_html_table_string, data,
+            self.mapping_data, self.output_dir, image_formats=['eps.gz'])
+
     def test_get_html_table_string(self):
         """The HTML table is correct"""
         data = self.list_data_single_plot[0]
@@ -225,6 +367,34 @@ class MakeHtmlHeatmapTest(TestCase):
         self.assertTrue(path.exists(eps_gz_fp1),
             'The eps file was not created in the appropiate location')
 
+    def test_get_html_page_string_workers(self):
+        """The heatmaps rendered concurrently give the same HTML page"""
+        data = self.list_data_multiple_plots[0]
+        data1 = self.list_data_multiple_plots[1]
+
+        png_img_fp = path.join(self.output_dir, data[LD_NAME] + '.png')
+        eps_gz_fp = path.join(self.output_dir, data[LD_NAME] + '.eps.gz')
+        png_img_fp1 = path.join(self.output_dir, data1[LD_NAME] + '.png')
+        eps_gz_fp1 = path.join(self.output_dir, data1[LD_NAME] + '.eps.gz')
+
+        self._paths_to_clean_up = [png_img_fp, eps_gz_fp, png_img_fp1,
+            eps_gz_fp1]
+        self._dirs_to_clean_up = [self.output_dir]
+
+        mkdir(self.output_dir)
+
+        html_page_string = get_html_page_string(self.list_data_multiple_plots,
+            self.mapping_data, self.output_dir, workers=2)
+
+        self.assertEqual(html_page_string,
+            result_html_page_string_multiple_plot % (
+                data[LD_NAME], data[LD_NAME], data[LD_NAME], data[LD_NAME],
+                data1[LD_NAME], data1[LD_NAME], data1[LD_NAME],
+                data1[LD_NAME]))
+        for fp in self._paths_to_clean_up:
+            self.assertTrue(path.exists(fp),
+                '%s was not created in the appropiate location' % fp)
+
     def test_make_html_file(self):
         """The HTML file is generated in the correct place"""
         data = self.list_data_multiple_plots[0]
@@ -258,6 +428,34 @@ class MakeHtmlHeatmapTest(TestCase):
         self.assertTrue(path.exists(self.html_fp),
             'The html file was not created in the appropiate location')
 
+    def test_make_html_file_scalable(self):
+        """The HTML file of the scalable mode has no AREA tags"""
+        data = self.list_data_single_plot[0]
+
+        png_img_fp = path.join(self.output_dir, data[LD_NAME] + '.png')
+        eps_gz_fp = path.join(self.output_dir, data[LD_NAME] + '.eps.gz')
+        map_data_fp = path.join(self.output_dir, data[LD_NAME] + '_map.js')
+        overlib_fp = path.join(self.output_dir, 'overlib.js')
+        heatmap_map_fp = path.join(self.output_dir, 'heatmap_map.js')
+
+        self._paths_to_clean_up = [png_img_fp, eps_gz_fp, map_data_fp,
+            overlib_fp, heatmap_map_fp, self.html_fp]
+        self._dirs_to_clean_up = [self.output_dir]
+
+        mkdir(self.output_dir)
+
+        make_html_file(self.list_data_single_plot, self.mapping_data,
+            self.html_fp, self.output_dir, scalable=True)
+
+        for fp in self._paths_to_clean_up:
+            self.assertTrue(path.exists(fp),
+                '%s was not created in the appropiate location' % fp)
+
+        html = open(self.html_fp).read()
+        self.assertEqual(html, result_html_page_string_scalable % (
+            data[LD_NAME], data[LD_NAME], data[LD_NAME], data[LD_NAME],
+            data[LD_NAME]))
+
 result_all_cids = [
 '<b>Sample1 vs Sample2:</b> 0.1<br><br><i>Sample1:</i> Sample1 test description<br><br><i>Sample2:</i> Sample2 test description',
 '<b>Sample1 vs Sample3:</b> 0.9<br><br><i>Sample1:</i> Sample1 test description<br><br><i>Sample3:</i> Sample3 test description',
@@ -380,5 +578,32 @@ result_html_page_string_multiple_plot = """
 </html>
 """
 
+result_html_page_string_scalable = """
+<html>
+<head>
+<style type="text/css">
+.normal { color: black; font-family:Arial,Verdana; font-size:12; font-weight:normal;}
+.header { color: white; font-family:Arial,Verdana; font-size:12; font-weight:bold; background-color:#2C3143;}
+.row_header { color: black; font-family:Arial,Verdana; font-size:12; font-weight:bold; background-color:#C1C9E5;}
+</style>
+<script type="text/javascript" src="overlib.js"></script>
+<title>Fastunifrac</title>
+</head>
+<body>
+<div id="overDiv" style="position:absolute; visibility:hidden; z-index:1000;"></div>
+<script type="text/javascript" src="heatmap_map.js"></script>
+<table cellpading=0 cellspacing=0 border=1>
+<tr><th align=center colspan=3 border=0 class="header">Example table title</th></tr>
+<tr>
+<td class="normal" align=center border=0><img src="%s.png" border="0" width="800" height="800" onmousemove="return heatmapOver(event, '%s');" onmouseout="return heatmapOut('%s');" />
+<script type="text/javascript" src="%s_map.js"></script>
+<br><a href="%s.eps.gz" >Download Figure</a></td>
+</tr>
+</table>
+<br><br>
+</body>
+</html>
+"""
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
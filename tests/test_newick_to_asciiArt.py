@@ -12,13 +12,27 @@ __status__ = "Development"
 from cogent.util.unit_test import TestCase, main
 from qiime.util import load_qiime_config, get_tmp_filename
 from qiime.parse import parse_newick, PhyloNode
-from os import remove, path
-from fastunifrac.newick_to_asciiArt import (asciiArt_length,
+from os import remove, path, listdir
+from shutil import rmtree
+from tempfile import mkdtemp
+from sys import getrecursionlimit
+from numpy import array, isnan, nan, float32
+from fastunifrac.make_heatmap import IntervalClassifier
+from fastunifrac.newick_to_asciiArt import (get_tree_layout,
+    set_layout_lengths, scale_branch_lengths, TreeLayout,
+    get_tree_layout_object, get_tree_grid, asciiArt_length,
     get_tree_by_length_string, add_interactive_sample_id,
-    make_interactive_sample_id_tree_file, get_formated_char_html,
-    get_last_char_of_html_string, remove_first_chars_of_html_string,
+    add_compact_sample_id, get_tree_data_html, get_compact_style_html,
+    make_interactive_sample_id_tree_file, get_interval_classifier,
+    get_node_support, get_formated_char_html,
+    get_html_glyphs, get_last_char_of_html_string,
+    remove_first_chars_of_html_string, get_glyph_palette, get_glyph_grid,
+    get_glyph_line_html, GLYPH_DTYPE, PLAIN_GLYPH,
     asciiArt_length_html, draw_jackknife_tree_html, get_legend_table_html,
-    get_jackknife_tree_html_string, make_jackknife_tree_html_file)
+    get_jackknife_tree_html_string, make_jackknife_tree_html_file,
+    get_layout_children, get_layout_tip_counts, get_sub_layout,
+    get_fragment_prefix, get_lazy_page_grid, get_fragments_name,
+    draw_lazy_tree_html)
 
 class NewickToAsciiArtTest(TestCase):
     def setUp(self):
@@ -50,6 +64,12 @@ class NewickToAsciiArtTest(TestCase):
             'support_dict': {"node0":1.0,
                             "node1":0.8}}
 
+        self.named_newick = "((s1:0.2,s2:0.2)node1:0.6,s3:0.8)node0;"
+        self.named_tree = parse_newick(self.named_newick, PhyloNode)
+        self.support_arrays = {'trees_considered': 10,
+            'node_index': {"node0": 0, "node1": 1},
+            'support': array([1.0, 0.8], dtype=float32)}
+
         self.qiime_config = load_qiime_config()
         self.tmp_dir = self.qiime_config['temp_dir'] or '/tmp/'
         self.output_file = get_tmp_filename(tmp_dir = self.tmp_dir)
@@ -81,10 +101,12 @@ class NewickToAsciiArtTest(TestCase):
             "Example comment string for test"]
 
         self._paths_to_clean_up = []
+        self._dirs_to_clean_up = []
 
     def tearDown(self):
         """Cleans up the environment once the tests finish"""
         map(remove, self._paths_to_clean_up)
+        map(rmtree, self._dirs_to_clean_up)
 
     def test_asciiArt_length(self):
         """The ASCII lines are correct"""
@@ -95,12 +117,106 @@ class NewickToAsciiArtTest(TestCase):
         self.assertEqual(obs_lines, exp_lines)
         self.assertEqual(obs_mid, exp_mid)
 
+    def test_get_tree_layout(self):
+        """The positions of the nodes are computed correctly"""
+        layout = get_tree_layout(self.tree_scaled)
+        self.assertEqual([node.Name for node in layout['nodes']],
+            ['s1', 's2', None, 's3', None])
+        self.assertEqual(layout['x'], [77, 77, 2, 2, 0])
+        self.assertEqual(layout['length'], [25, 25, 75, 100, 2])
+        self.assertEqual(layout['mid'], [0, 1, 0, 2, 1])
+        self.assertEqual(layout['span'], [None, None, (0, 1), None, (0, 2)])
+        self.assertEqual(layout['char'], ['/', '\\', '/', '\\', '-'])
+        self.assertEqual(layout['parent'], [2, 2, 4, 4, -1])
+        self.assertEqual(layout['tips'], [0, 1, 3])
+        self.assertEqual(layout['preorder'], [4, 2, 0, 1, 3])
+
+    def test_set_layout_lengths(self):
+        """The columns are computed from the new branch lengths"""
+        layout = get_tree_layout(self.tree_scaled)
+        obs = set_layout_lengths(layout, [1, 2, 3, None, 0])
+        self.assertEqual(obs['length'], [1, 2, 3, 2, 2])
+        self.assertEqual(obs['x'], [5, 5, 2, 2, 0])
+        self.assertEqual(obs['mid'], layout['mid'])
+        # The original layout is not modified
+        self.assertEqual(layout['x'], [77, 77, 2, 2, 0])
+
+    def test_scale_branch_lengths(self):
+        """The branch lengths are scaled as cogent does, without modifying
+        the tree"""
+        for newick in [self.newick, self.jack_newick,
+            "((s1:1,s2:3)a:2,(s3:0.5,(s4:2,s5:0.1)b:1.5)c:0.0,s6:4)d;"]:
+            tree = parse_newick(newick, PhyloNode)
+            layout = get_tree_layout(tree)
+            lengths = [node.Length for node in layout['nodes']]
+            obs = scale_branch_lengths(layout, lengths)
+            self.assertEqual(tree.getNewick(with_distances=True),
+                parse_newick(newick, PhyloNode).getNewick(
+                    with_distances=True))
+            tree.scaleBranchLengths(max_length=100, ultrametric=True)
+            self.assertEqual(obs, [node.Length for node in tree.postorder()])
+
+    def test_tree_layout(self):
+        """The scaled layout is computed once and the tree is not modified"""
+        tree_layout = TreeLayout(self.tree)
+        self.assertTrue(tree_layout.tree is self.tree)
+        scaled_layout = tree_layout.get_scaled_layout()
+        self.assertEqual(scaled_layout['length'], [25, 25, 75, 100, 2])
+        self.assertEqual(scaled_layout['x'], [77, 77, 2, 2, 0])
+        self.assertTrue(tree_layout.get_scaled_layout() is scaled_layout)
+        self.assertFloatEqual(tree_layout.get_branch_scale(), 0.008)
+        self.assertEqual(self.tree.getNewick(with_distances=True),
+            "((s1:0.2,s2:0.2):0.6,s3:0.8);")
+
+        self.assertTrue(get_tree_layout_object(tree_layout) is tree_layout)
+        self.assertTrue(get_tree_layout_object(self.tree).tree is self.tree)
+
+    def test_get_tree_grid(self):
+        """The glyphs are written in the grid correctly"""
+        layout = get_tree_layout(self.tree_scaled)
+        grid, owners, widths = get_tree_grid(layout)
+        self.assertEqual(widths.tolist(), [103, 103, 103])
+        self.assertEqual([grid[row, :width].tostring() + name for row, width,
+            name in zip(range(3), widths, ['s1', 's2', 's3'])], exp_lines)
+        # The slashes show the support of their parent and the pipe the
+        # support of the node whose children it joins
+        self.assertEqual([(row, col, owners[row, col]) for row, col in
+            zip(*(owners >= 0).nonzero())], [(0, 2, 4), (0, 77, 2), (1, 1, 4),
+            (1, 77, 2), (2, 2, 4)])
+
+    def test_asciiArt_length_deep_tree(self):
+        """Trees deeper than the recursion limit are represented"""
+        depth = getrecursionlimit() + 100
+        tree = PhyloNode(Name="1.0")
+        node = tree
+        for i in range(depth):
+            node.append(PhyloNode(Name="s%d" % i, Length=1))
+            child = PhyloNode(Name="0.5", Length=1)
+            node.append(child)
+            node = child
+        node.append(PhyloNode(Name="last", Length=1))
+
+        obs_lines, obs_mid = asciiArt_length(tree)
+        self.assertEqual(len(obs_lines), depth + 1)
+        self.assertEqual(obs_mid, 0)
+        self.assertEqual(obs_lines[-1], ' ' * (depth + 1) + '\\/>last')
+
+        obs_lines, obs_mid = asciiArt_length_html(tree,
+            self.num_trees_considered, self.trans_values)
+        self.assertEqual(len(obs_lines), depth + 1)
+        self.assertTrue(obs_lines[-1].endswith('+last'))
+
     def test_get_tree_by_length_string(self):
         """The ASCII string is correct"""
         obs_string = get_tree_by_length_string(self.tree)
 
         self.assertEqual(obs_string, exp_string)
 
+        # The tree is not modified, so it can be rendered again
+        self.assertEqual(get_tree_by_length_string(self.tree), exp_string)
+        self.assertEqual(get_tree_by_length_string(TreeLayout(self.tree)),
+            exp_string)
+
     def test_add_interactive_sample_id(self):
         """The sample ID string is substituted by an HTML string correctly"""
         obs = add_interactive_sample_id(line_add_interactive_1,
@@ -111,6 +227,34 @@ class NewickToAsciiArtTest(TestCase):
             self.mapping_data, '+')
         self.assertEqual(obs, exp_add_interactive_2)
 
+    def test_add_compact_sample_id(self):
+        """The sample id is tagged with the 's' class"""
+        self.assertEqual(add_compact_sample_id(line_add_interactive_1, '>'),
+            line_add_interactive_1[:-3] + '&#62;<b class=s>s1</b>')
+
+    def test_get_tree_data_html(self):
+        """The table of the compact trees is registered correctly"""
+        obs = get_tree_data_html(self.mapping_data, ['s1'], 10,
+            array([nan, 0.8, 1.0]))
+        self.assertEqual(obs, '<script type="text/javascript">treeRegister(' +
+            '{"desc":{"s1":"s1 test description"},"support":[null,0.8,1.0],' +
+            '"trees":10});</script>')
+
+        # Without support only the descriptions are stored, and the table
+        # can not close the script tag
+        self.mapping_data[0]['s1']['Description'] = '</script>'
+        obs = get_tree_data_html(self.mapping_data, ['s1'])
+        self.assertEqual(obs, '<script type="text/javascript">treeRegister(' +
+            '{"desc":{"s1":"<\\/script>"}});</script>')
+
+    def test_get_compact_style_html(self):
+        """There is a css class for each color of the palette"""
+        obs = get_compact_style_html(["#dddddd", "#FF8582", None])
+        self.assertTrue('pre b.c0 { background-color:#dddddd; }' in obs)
+        self.assertTrue('pre b.c1 { background-color:#FF8582; }' in obs)
+        self.assertFalse('pre b.c2' in obs)
+        self.assertTrue('src="tree_tooltips.js"' in obs)
+
     def test_get_formated_char_html(self):
         """The char is formated correctly"""
         c = '/'
@@ -131,6 +275,39 @@ class NewickToAsciiArtTest(TestCase):
             self.trans_values)
         self.assertEqual(obs_string, exp_get_formated_char_html_3)
 
+        # An already built classifier can be used instead of the dict
+        classifier = get_interval_classifier(self.trans_values)
+        self.assertTrue(get_interval_classifier(classifier) is classifier)
+        obs_string = get_formated_char_html(c, self.num_trees_considered, f,
+            classifier)
+        self.assertEqual(obs_string, exp_get_formated_char_html_3)
+
+    def test_get_node_support(self):
+        """The support of the internal nodes is placed in postorder"""
+        # Postorder: s1, s2, node1, s3, node0
+        obs = get_node_support(self.named_tree, self.support_arrays)
+        self.assertEqual([None if isnan(v) else v for v in obs.tolist()],
+            [None, None, 0.8, None, 1.0])
+
+        obs = get_node_support(self.named_tree, self.support)
+        self.assertEqual([None if isnan(v) else v for v in obs.tolist()],
+            [None, None, 0.8, None, 1.0])
+
+        # Without support file the support is taken from the node names
+        obs = get_node_support(self.jack_tree)
+        self.assertEqual([None if isnan(v) else v for v in obs.tolist()],
+            [None, None, 0.8, None, 1.0])
+
+        # The nodes without support get NaN
+        obs = get_node_support(self.named_tree)
+        self.assertTrue(isnan(obs).all())
+
+    def test_get_formated_char_html_nan(self):
+        """A NaN fraction gets the color of the None values"""
+        obs_string = get_formated_char_html('/', self.num_trees_considered,
+            nan, self.trans_values)
+        self.assertTrue('BACKGROUND-COLOR:#FFFFFF' in obs_string)
+
     def test_get_last_char_of_html_string(self):
         """The last char of an HTML string is retrieved correctly"""
         html_string = """Some chars<a href="#">|</a>"""
@@ -185,6 +362,60 @@ class NewickToAsciiArtTest(TestCase):
         exp_string = ""
         self.assertEqual(obs_string, exp_string)
 
+    def test_remove_first_chars_of_html_string_long(self):
+        """Long HTML strings are handled in a single scan"""
+        html_string = """<a href="#">|</a>""" + "-" * 10000 + "s1"
+        obs_string = remove_first_chars_of_html_string(html_string, 9999)
+        self.assertEqual(obs_string, "--s1")
+
+    def test_get_html_glyphs(self):
+        """The HTML strings are split in anchors and chars"""
+        obs = get_html_glyphs("""-<a href="#">|</a> <a href="#">//</a>s""")
+        self.assertEqual(obs, ['-', '<a href="#">|</a>', ' ',
+            '<a href="#">//</a>', 's'])
+        self.assertEqual(get_html_glyphs(""), [])
+
+    def test_get_glyph_grid(self):
+        """The glyph records hold the support and the color of each char"""
+        classifier = IntervalClassifier(self.trans_values)
+        palette = get_glyph_palette(classifier)
+        self.assertEqual(palette, ["#dddddd", "#99CCFF", "#82FF8B", "#F8FE83",
+            "#FF8582", "#FFFFFF", None])
+
+        layout = get_tree_layout(self.jack_tree_scaled)
+        glyphs, widths = get_glyph_grid(layout, array([nan, nan, 0.8, nan,
+            1.0]), classifier)
+        self.assertEqual(glyphs.dtype, GLYPH_DTYPE)
+        self.assertEqual(widths.tolist(), [103, 103, 103])
+        self.assertEqual(glyphs['char'][1, :3].tolist(), ['-', '|', ' '])
+        self.assertEqual(glyphs['color'][1, :3].tolist(), [PLAIN_GLYPH, 4,
+            PLAIN_GLYPH])
+        self.assertEqual(glyphs['support'][1, 1], 1.0)
+        self.assertEqual(glyphs['color'][0, 77], 2)
+        self.assertEqual(glyphs['support'][0, 77], 0.8)
+
+    def test_get_glyph_line_html(self):
+        """The adjacent glyphs with the same support are merged"""
+        palette = ["#dddddd", "#FF8582"]
+        glyphs = array([(' ', nan, PLAIN_GLYPH, -1), ('|', 1.0, 1, 4),
+            ('/', 1.0, 1, 4), ('-', nan, PLAIN_GLYPH, -1),
+            ('-', nan, PLAIN_GLYPH, -1), ('\\', 0.4, 0, 2), ('\\', 1.0, 1, 4),
+            ('+', nan, PLAIN_GLYPH, -1)], dtype=GLYPH_DTYPE)
+        obs = get_glyph_line_html(glyphs, self.num_trees_considered, palette)
+        self.assertEqual(obs, " " +
+            exp_get_formated_char_html_3.replace(">\\<", ">|/<") + "--" +
+            exp_get_formated_char_html_1.replace(">/<", ">\\<") +
+            exp_get_formated_char_html_3 + "+")
+        self.assertEqual(get_glyph_line_html(glyphs[:0],
+            self.num_trees_considered, palette), "")
+
+        # The compact glyphs are only tagged with their color and their node
+        obs = get_glyph_line_html(glyphs, self.num_trees_considered, palette,
+            compact=True)
+        self.assertEqual(obs, ' <b class=c1 data-n=4>|/</b>--' +
+            '<b class=c0 data-n=2>\\</b>' +
+            '<b class=c1 data-n=4>\\</b>+')
+
     def test_asciiArt_length_html(self):
         """The HTML-ASCII lines are generated correctly"""
         obs_jack_lines, obs_mid = asciiArt_length_html(self.jack_tree_scaled,
@@ -202,6 +433,36 @@ class NewickToAsciiArtTest(TestCase):
 
         self.assertEqual(obs_string, exp_jack_string)
 
+        # The same layout is shared with the plain renderer
+        tree_layout = TreeLayout(self.jack_tree)
+        self.assertEqual(get_tree_by_length_string(tree_layout)[0],
+            exp_string[0])
+        obs_string = draw_jackknife_tree_html(tree_layout,
+            self.num_trees_considered, self.trans_values, self.mapping_data)
+        self.assertEqual(obs_string, exp_jack_string)
+        self.assertEqual(self.jack_tree.getNewick(with_distances=True),
+            "((s1:0.2,s2:0.2)0.8:0.6,s3:0.8)1.0;")
+
+        # The support can be taken from the parsed jackknife support file
+        obs_string = draw_jackknife_tree_html(self.named_tree,
+            self.num_trees_considered, self.trans_values, self.mapping_data,
+            self.support_arrays)
+        self.assertEqual(obs_string, exp_jack_string)
+
+    def test_draw_jackknife_tree_html_compact(self):
+        """The compact HTML-ASCII string is correct"""
+        obs_string = draw_jackknife_tree_html(self.jack_tree,
+            self.num_trees_considered, self.trans_values, self.mapping_data,
+            compact=True)
+        self.assertEqual(obs_string, exp_jack_string_compact)
+
+        # The node indices are the same with the parsed support file
+        obs_string = draw_jackknife_tree_html(self.named_tree,
+            self.num_trees_considered, self.trans_values, self.mapping_data,
+            self.support_arrays, compact=True)
+        self.assertEqual(obs_string, exp_jack_string_compact)
+        self.assertTrue(len(obs_string) < len(exp_jack_string))
+
     def test_get_legend_table_html(self):
         """The HTML table with the legend is generated correctly"""
         obs_string = get_legend_table_html(self.trans_values)
@@ -215,6 +476,14 @@ class NewickToAsciiArtTest(TestCase):
 
         self.assertEqual(obs_string, exp_html_string)
 
+        obs_string = get_jackknife_tree_html_string(self.jack_tree,
+            self.num_trees_considered, self.trans_values, self.mapping_data,
+            compact=True)
+        self.assertTrue(exp_jack_string_compact in obs_string)
+        self.assertTrue('pre b.c4 { background-color:#FF8582; }' in
+            obs_string)
+        self.assertFalse('overlib(' in obs_string)
+
     def test_make_jackknife_tree_html_file(self):
         """The HTML file is generated in the right place"""
         self._paths_to_clean_up = [self.output_file,
@@ -228,6 +497,142 @@ class NewickToAsciiArtTest(TestCase):
         self.assertTrue(path.exists(path.join(self.tmp_dir, 'overlib.js')),
             'The javascript file was not moved in the appropiate location')
 
+    def test_make_interactive_sample_id_tree_file_compact(self):
+        """The compact sample ids tree file stores the descriptions once"""
+        self._paths_to_clean_up = [self.output_file,
+            path.join(self.tmp_dir, 'overlib.js'),
+            path.join(self.tmp_dir, 'tree_tooltips.js')]
+        make_interactive_sample_id_tree_file(self.tree, self.mapping_data,
+            self.output_file, self.tmp_dir, compact=True)
+
+        obs = open(self.output_file).read()
+        self.assertTrue('&#62;<b class=s>s3</b>' in obs)
+        self.assertTrue('"s3":"s3 test description"' in obs)
+        self.assertFalse('overlib(' in obs)
+        self.assertTrue(path.exists(path.join(self.tmp_dir,
+            'tree_tooltips.js')))
+
+    def test_make_jackknife_tree_html_file_compact(self):
+        """The compact HTML file is generated with its javascript files"""
+        self._paths_to_clean_up = [self.output_file,
+            path.join(self.tmp_dir, 'overlib.js'),
+            path.join(self.tmp_dir, 'tree_tooltips.js')]
+        make_jackknife_tree_html_file(self.jack_tree, self.support,
+            self.trans_values, self.mapping_data, self.output_file,
+            self.tmp_dir, compact=True)
+
+        self.assertTrue(path.exists(self.output_file),
+            'The html file was not created in the appropiate location')
+        for js_fn in ['overlib.js', 'tree_tooltips.js']:
+            self.assertTrue(path.exists(path.join(self.tmp_dir, js_fn)),
+                'The javascript file was not moved in the appropiate location')
+
+    def test_get_layout_children(self):
+        """The children of each node are listed in order"""
+        layout = get_tree_layout(self.jack_tree)
+        self.assertEqual(get_layout_children(layout), [[], [], [0, 1], [],
+            [2, 3]])
+        self.assertEqual(get_layout_tip_counts(layout), [1, 1, 2, 1, 3])
+
+    def test_get_sub_layout(self):
+        """Only the top levels of the subtree are laid out"""
+        layout = TreeLayout(self.jack_tree).get_scaled_layout()
+        sub_layout = get_sub_layout(layout, 4, 1)
+        self.assertEqual(sub_layout['positions'], [2, 3, 4])
+        self.assertEqual(sub_layout['collapsed'], [0])
+        self.assertEqual(sub_layout['tips'], [0, 1])
+        self.assertEqual(sub_layout['mid'], [0, 1, 0])
+        self.assertEqual(sub_layout['span'], [None, None, (0, 1)])
+        self.assertEqual(sub_layout['parent'], [2, 2, -1])
+        self.assertEqual(sub_layout['x'], [layout['x'][position]
+            for position in [2, 3, 4]])
+
+        # The subtree of a node
+        sub_layout = get_sub_layout(layout, 2, 1)
+        self.assertEqual(sub_layout['positions'], [0, 1, 2])
+        self.assertEqual(sub_layout['collapsed'], [])
+        self.assertEqual(sub_layout['mid'], [0, 1, 0])
+
+        # All the levels
+        sub_layout = get_sub_layout(layout, 4, 10)
+        self.assertEqual(sub_layout['mid'], layout['mid'])
+        self.assertEqual(sub_layout['collapsed'], [])
+
+        self.assertRaises(ValueError, get_sub_layout, layout, 4, 0)
+
+    def test_get_lazy_page_grid(self):
+        """The fragments continue the pipes of the collapsed row"""
+        layout = TreeLayout(self.jack_tree).get_scaled_layout()
+        sub_layout = get_sub_layout(layout, 4, 1)
+        grid, owners, widths = get_lazy_page_grid(sub_layout)
+        self.assertEqual(grid[0, :4].tolist(), ['-', ' ', '/', '-'])
+        self.assertEqual(owners[0, :3].tolist(), [-1, -1, 4])
+
+        chars, prefix_owners = get_fragment_prefix(sub_layout, grid, owners,
+            0)
+        self.assertEqual(chars.tolist(), [[' ', ' ', ' '], ['-', ' ', '/'],
+            [' ', '|', ' ']])
+        self.assertEqual(prefix_owners.tolist(), [[-1, -1, -1], [-1, -1, 4],
+            [-1, 4, -1]])
+
+        fragment_layout = get_sub_layout(layout, 2, 1)
+        grid, owners, widths = get_lazy_page_grid(fragment_layout,
+            (chars, prefix_owners))
+        self.assertEqual([grid[row, :width].tostring()
+            for row, width in enumerate(widths)],
+            ["- " + exp_lines[0][2:-2], " " + exp_lines[1][1:-2]])
+        self.assertEqual(owners[:, :3].tolist(), [[-1, -1, 4], [-1, 4, -1]])
+        self.assertEqual(owners[0, 77], 2)
+
+    def test_draw_lazy_tree_html(self):
+        """The collapsed subtrees are written to fragment files"""
+        output_dir = mkdtemp(dir=self.tmp_dir)
+        self._dirs_to_clean_up = [output_dir]
+        obs = draw_lazy_tree_html(self.jack_tree, 1, self.mapping_data,
+            output_dir, 'tree_fragments', self.num_trees_considered,
+            self.trans_values)
+        self.assertEqual(obs, exp_lazy_string)
+        self.assertEqual(listdir(path.join(output_dir, 'tree_fragments')),
+            ['2.js'])
+        obs = open(path.join(output_dir, 'tree_fragments', '2.js')).read()
+        self.assertEqual(obs, exp_lazy_fragment)
+
+        # Without collapsed subtrees, the compact tree is drawn
+        obs = draw_lazy_tree_html(self.jack_tree, 2, self.mapping_data,
+            output_dir, 'all_levels', self.num_trees_considered,
+            self.trans_values)
+        exp = exp_jack_string_compact
+        self.assertEqual(obs[:obs.index('</pre>')], exp[:exp.index('</pre>')])
+        self.assertEqual(listdir(path.join(output_dir, 'all_levels')), [])
+
+        # Without trans_values the branches are not colored
+        obs = draw_lazy_tree_html(self.tree, 1, self.mapping_data,
+            output_dir, 'plain', self.num_trees_considered)
+        self.assertFalse('data-n' in obs)
+        self.assertTrue('[+] 2 samples' in obs)
+
+    def test_make_jackknife_tree_html_file_lazy(self):
+        """The lazy HTML file is generated with its fragments"""
+        output_dir = mkdtemp(dir=self.tmp_dir)
+        self._dirs_to_clean_up = [output_dir]
+        html_fp = path.join(output_dir, 'index.html')
+        self.assertEqual(get_fragments_name(html_fp), 'index_fragments')
+        make_jackknife_tree_html_file(self.jack_tree, self.support,
+            self.trans_values, self.mapping_data, html_fp, output_dir,
+            lazy_levels=1)
+        self.assertEqual(sorted(listdir(output_dir)), ['index.html',
+            'index_fragments', 'overlib.js', 'tree_fragments.js',
+            'tree_tooltips.js'])
+        obs = open(html_fp).read()
+        self.assertTrue('src="tree_fragments.js"' in obs)
+        self.assertTrue("treeExpand('index_fragments', 2)" in obs)
+        self.assertTrue(exp_legend_string in obs)
+
+        make_interactive_sample_id_tree_file(self.tree, self.mapping_data,
+            path.join(output_dir, 'cluster.html'), output_dir, lazy_levels=1)
+        self.assertEqual(listdir(path.join(output_dir,
+            'cluster_fragments')), ['2.js'])
+
 #########################
 # Long string variables #
 #########################
@@ -260,6 +665,22 @@ exp_jack_string = """<pre>Scale: 1 dash, slash, backslash ~ 0.0080 branch length
 -<a href="#" onmouseover="return overlib(\'<b>Jackknife Count:</b> 10.000<br><b>Jackknife Fraction:</b> 1.000\');" onmouseout="return nd();"><font style="BACKGROUND-COLOR:#FF8582">|</font></a>                                                                           <a href="#" onmouseover="return overlib(\'<b>Jackknife Count:</b> 8.000<br><b>Jackknife Fraction:</b> 0.800\');" onmouseout="return nd();"><font style="BACKGROUND-COLOR:#82FF8B">\\</font></a>------------------------&#62;<a href="#" onmouseover="return overlib(\'<b>Sample ID:</b> s2<br><b>Description:</b> s2 test description\');" onmouseout="return nd();">s2</a>
   <a href="#" onmouseover="return overlib(\'<b>Jackknife Count:</b> 10.000<br><b>Jackknife Fraction:</b> 1.000\');" onmouseout="return nd();"><font style="BACKGROUND-COLOR:#FF8582">\\</font></a>---------------------------------------------------------------------------------------------------&#62;<a href="#" onmouseover="return overlib(\'<b>Sample ID:</b> s3<br><b>Description:</b> s3 test description\');" onmouseout="return nd();">s3</a>\n</pre>"""
 
+exp_jack_string_compact = """<pre onmouseover="return treeOver(event);" onmouseout="return treeOut(event);">Scale: 1 dash, slash, backslash ~ 0.0080 branch length units<br>
+  <b class=c4 data-n=4>/</b>------------------------------------------------------------------------- <b class=c2 data-n=2>/</b>------------------------&#62;<b class=s>s1</b>
+-<b class=c4 data-n=4>|</b>                                                                           <b class=c2 data-n=2>\\</b>------------------------&#62;<b class=s>s2</b>
+  <b class=c4 data-n=4>\\</b>---------------------------------------------------------------------------------------------------&#62;<b class=s>s3</b>
+</pre>
+<script type="text/javascript">treeRegister({"desc":{"s1":"s1 test description","s2":"s2 test description","s3":"s3 test description"},"support":[null,null,0.8,null,1.0],"trees":10});</script>"""
+
+exp_lazy_string = """<pre onmouseover="return treeOver(event);" onmouseout="return treeOut(event);">Scale: 1 dash, slash, backslash ~ 0.0080 branch length units<br>
+<span id="t2">- <b class=c4 data-n=4>/</b>--------------------------------------------------------------------------&#62;<a href="#" onclick="return treeExpand('tree_fragments', 2);">[+] 2 samples</a></span>
+  <b class=c4 data-n=4>\\</b>---------------------------------------------------------------------------------------------------&#62;<b class=s>s3</b>
+</pre>
+<script type="text/javascript">treeRegister({"desc":{"s3":"s3 test description"},"support":{"4":1.0},"trees":10});</script>"""
+
+exp_lazy_fragment = """treeFragment(2, "- <b class=c4 data-n=4>/</b>------------------------------------------------------------------------- <b class=c2 data-n=2>/</b>------------------------&#62;<b class=s>s1</b>\\n <b class=c4 data-n=4>|</b>                                                                           <b class=c2 data-n=2>\\\\</b>------------------------&#62;<b class=s>s2</b>", {"desc":{"s1":"s1 test description","s2":"s2 test description"},"support":{"2":0.8,"4":1.0},"trees":10});
+"""
+
 exp_legend_string = """<table cellpadding=2 cellspacing=2 border=1>
 <tr> <td colspan=2 class="header">Color description</td></tr>
 <tr>
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+__author__ = "Jose Antonio Navas Molina"
+__copyright__ = "Copyright 2013, The FastUniFrac Project"
+__credits__ = ["Jose Antonio Navas Molina"]
+__license__ = "GPL"
+__version__ = "1.7.0-dev"
+__maintainer__ = "Jose Antonio Navas Molina"
+__email__ = "josenavasmolina@gmail.com"
+__status__ = "Development"
+
+from cogent.util.unit_test import TestCase, main
+from qiime.util import load_qiime_config, get_tmp_filename
+from os import remove, listdir, utime, stat, umask
+from stat import S_IMODE
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from numpy import array, uint32
+from fastunifrac.sample_id_map_otu_table_conversion import \
+    sample_mapping_to_biom_table
+from biom.parse import parse_biom_table
+from qiime.format import format_biom_table
+import fastunifrac.otu_table_cache
+from fastunifrac.otu_table_cache import (compute_file_digest,
+    load_cached_arrays, store_cached_arrays, get_cached_biom_fp,
+    store_cached_biom, evict_cache_entries, get_entry_size,
+    sample_mapping_fp_to_biom_table, sample_mapping_fp_to_biom_file)
+
+class OtuTableCacheTest(TestCase):
+    def setUp(self):
+        """Set up some test variables"""
+        self.qiime_config = load_qiime_config()
+        self.tmp_dir = self.qiime_config['temp_dir'] or '/tmp/'
+        self.cache_dir = mkdtemp(dir=self.tmp_dir)
+        self.input_file = get_tmp_filename(tmp_dir=self.tmp_dir)
+        out = open(self.input_file, 'w')
+        out.write(sample_mapping)
+        out.close()
+        self.arrays = {'indptr': array([0, 2, 3], dtype=uint32),
+            'indices': array([0, 1, 0], dtype=uint32),
+            'data': array([3., 2., 1.]),
+            'sample_ids': array(['sample.1', 'sample3']),
+            'observation_ids': array(['OTU1', 'OTU2'])}
+        self._paths_to_clean_up = [self.input_file]
+
+    def tearDown(self):
+        """Cleans up the environment once the tests finish"""
+        map(remove, self._paths_to_clean_up)
+        rmtree(self.cache_dir)
+
+    def test_compute_file_digest(self):
+        """The digest depends only on the file contents"""
+        obs = compute_file_digest(self.input_file)
+        self.assertEqual(obs, "16f04f025b39673093e468e97037f91f"
+            "eb1fd730ee824492742cf5f16b427a3e")
+
+    def test_store_load_cached_arrays(self):
+        """The arrays are stored and loaded back from the cache"""
+        self.assertEqual(load_cached_arrays(self.cache_dir, 'abc'), None)
+        store_cached_arrays(self.cache_dir, 'abc', self.arrays)
+        self.assertEqual(listdir(self.cache_dir), ['abc'])
+        obs = load_cached_arrays(self.cache_dir, 'abc')
+        self.assertEqual(sorted(obs.keys()), sorted(self.arrays.keys()))
+        for name in self.arrays:
+            self.assertEqual(obs[name], self.arrays[name])
+        self.assertEqual(obs['sample_ids'].tolist(), ['sample.1', 'sample3'])
+        # Storing the same entry twice keeps the first one
+        store_cached_arrays(self.cache_dir, 'abc', self.arrays)
+        self.assertEqual(listdir(self.cache_dir), ['abc'])
+
+    def test_store_get_cached_biom(self):
+        """The formatted table is added to an existing entry"""
+        self.assertEqual(get_cached_biom_fp(self.cache_dir, 'abc'), None)
+        # Nothing is stored without the entry
+        store_cached_biom(self.cache_dir, 'abc', '{}')
+        self.assertEqual(listdir(self.cache_dir), [])
+        store_cached_arrays(self.cache_dir, 'abc', self.arrays)
+        self.assertEqual(get_cached_biom_fp(self.cache_dir, 'abc'), None)
+        store_cached_biom(self.cache_dir, 'abc', '{}')
+        obs = get_cached_biom_fp(self.cache_dir, 'abc')
+        self.assertEqual(obs, join(self.cache_dir, 'abc', 'table.biom'))
+        self.assertEqual(open(obs).read(), '{}')
+
+    def test_cache_entry_permissions(self):
+        """The cache entries take the permissions allowed by the umask"""
+        old_umask = umask(022)
+        try:
+            store_cached_arrays(self.cache_dir, 'abc', self.arrays)
+            store_cached_biom(self.cache_dir, 'abc', '{}')
+        finally:
+            umask(old_umask)
+        entry_dir = join(self.cache_dir, 'abc')
+        self.assertEqual(S_IMODE(stat(entry_dir).st_mode), 0755)
+        for name in listdir(entry_dir):
+            self.assertEqual(S_IMODE(stat(join(entry_dir, name)).st_mode),
+                0644)
+
+    def test_evict_cache_entries(self):
+        """The least recently used entries are evicted first"""
+        for i, digest in enumerate(['d1', 'd2', 'd3']):
+            store_cached_arrays(self.cache_dir, digest, self.arrays)
+            utime(join(self.cache_dir, digest), (i, i))
+        # Using an entry makes it the most recently used
+        load_cached_arrays(self.cache_dir, 'd1')
+        entry_size = get_entry_size(join(self.cache_dir, 'd1'))
+
+        evict_cache_entries(self.cache_dir, entry_size * 3)
+        self.assertEqual(sorted(listdir(self.cache_dir)), ['d1', 'd2', 'd3'])
+        evict_cache_entries(self.cache_dir, entry_size * 2)
+        self.assertEqual(sorted(listdir(self.cache_dir)), ['d1', 'd3'])
+        evict_cache_entries(self.cache_dir, entry_size)
+        self.assertEqual(sorted(listdir(self.cache_dir)), ['d1'])
+
+    def test_sample_mapping_fp_to_biom_table(self):
+        """The cached conversion gives the same table"""
+        exp = sample_mapping_to_biom_table(sample_mapping.splitlines())
+
+        obs = sample_mapping_fp_to_biom_table(self.input_file)
+        self.assertEqual(obs, exp)
+        self.assertEqual(listdir(self.cache_dir), [])
+
+        obs = sample_mapping_fp_to_biom_table(self.input_file, self.cache_dir)
+        self.assertEqual(obs, exp)
+        digest = compute_file_digest(self.input_file)
+        self.assertEqual(listdir(self.cache_dir), [digest])
+        # The second conversion is read from the cache, without parsing
+        # the file
+        def parse_sample_mapping_fp_to_coo(*args):
+            raise AssertionError, "The sample mapping file was parsed"
+        parser = fastunifrac.otu_table_cache.parse_sample_mapping_fp_to_coo
+        fastunifrac.otu_table_cache.parse_sample_mapping_fp_to_coo = \
+            parse_sample_mapping_fp_to_coo
+        try:
+            obs = sample_mapping_fp_to_biom_table(self.input_file,
+                self.cache_dir)
+        finally:
+            fastunifrac.otu_table_cache.parse_sample_mapping_fp_to_coo = \
+                parser
+        self.assertEqual(obs, exp)
+        self.assertEqual(obs.SampleIds, exp.SampleIds)
+        self.assertEqual(obs.ObservationIds, exp.ObservationIds)
+        self.assertEqual(obs.observationData('OTU1').tolist(), [3., 2., 0.])
+
+        # A cache too small for a single entry is left empty
+        rmtree(join(self.cache_dir, digest))
+        obs = sample_mapping_fp_to_biom_table(self.input_file, self.cache_dir,
+            max_cache_size=0)
+        self.assertEqual(obs, exp)
+        self.assertEqual(listdir(self.cache_dir), [])
+
+    def test_sample_mapping_fp_to_biom_file(self):
+        """The formatted table is copied from the cache"""
+        exp = parse_biom_table(format_biom_table(sample_mapping_to_biom_table(
+            sample_mapping.splitlines())))
+        output_fp = get_tmp_filename(tmp_dir=self.tmp_dir, suffix='.biom')
+        self._paths_to_clean_up.append(output_fp)
+
+        sample_mapping_fp_to_biom_file(self.input_file, output_fp)
+        self.assertEqual(parse_biom_table(open(output_fp, 'U')), exp)
+        self.assertEqual(listdir(self.cache_dir), [])
+
+        sample_mapping_fp_to_biom_file(self.input_file, output_fp,
+            self.cache_dir)
+        first = open(output_fp).read()
+        self.assertEqual(parse_biom_table(first.splitlines()), exp)
+        digest = compute_file_digest(self.input_file)
+        self.assertEqual(sorted(listdir(join(self.cache_dir, digest))),
+            ['data.npy', 'indices.npy', 'indptr.npy', 'observation_ids.npy',
+            'sample_ids.npy', 'table.biom'])
+
+        # The second conversion neither parses the file nor formats the table
+        def fail(*args):
+            raise AssertionError, "The table was converted again"
+        module = fastunifrac.otu_table_cache
+        parser = module.parse_sample_mapping_fp_to_coo
+        formatter = module.format_biom_table
+        module.parse_sample_mapping_fp_to_coo = fail
+        module.format_biom_table = fail
+        try:
+            remove(output_fp)
+            sample_mapping_fp_to_biom_file(self.input_file, output_fp,
+                self.cache_dir)
+        finally:
+            module.parse_sample_mapping_fp_to_coo = parser
+            module.format_biom_table = formatter
+        self.assertEqual(open(output_fp).read(), first)
+
+sample_mapping = """OTU1\tsample_1\t3
+OTU1\tsample3\t2
+OTU2\tsample_1\t1
+OTU2\tsample2\t2
+"""
+
+if __name__ == '__main__':
+    main()
@@ -12,8 +12,11 @@ __status__ = "Development"
 from cogent.util.unit_test import TestCase, main
 from qiime.util import load_qiime_config, get_tmp_filename
 from os import remove
+from numpy import int32, float32
 from fastunifrac.parse import (parse_beta_significance_output_pairwise,
-    parse_beta_significance_output_each_sample, parse_jackknife_support_file)
+    parse_beta_significance_output_each_sample, parse_jackknife_support_file,
+    parse_jackknife_support_arrays,
+    parse_p_values, parse_beta_significance_output_pairwise_columns)
 
 class ParseTest(TestCase):
     def setUp(self):
@@ -52,6 +55,57 @@ class ParseTest(TestCase):
         self.assertEqual(obs_dict, exp_dict)
         self.assertEqual(obs_test_name, exp_test_name)
 
+    def test_parse_p_values(self):
+        """The censored p values are flagged"""
+        p_values, censored = parse_p_values(['0.01', '<=1.0e-02', '1.0\n'])
+        self.assertEqual(p_values.tolist(), [0.01, 0.01, 1.0])
+        self.assertEqual(censored.tolist(), [False, True, False])
+
+    def test_parse_beta_significance_output_pairwise_columns(self):
+        """The pairwise beta significance columnar parser works"""
+        lines = bs_lines_pairwise.splitlines(True)
+        for chunk_size in [1, 4, 100]:
+            sample_ids, pairs, p_values, censored, test_name = \
+                parse_beta_significance_output_pairwise_columns(lines,
+                    chunk_size)
+            self.assertEqual(sample_ids, ['s1', 's2', 's3', 's4'])
+            self.assertEqual(pairs.dtype, int32)
+            self.assertEqual(pairs.tolist(), [[0, 1], [0, 2], [0, 3], [1, 2],
+                [1, 3], [2, 3]])
+            self.assertEqual(p_values.tolist(), [[0.01, 0.15], [0.0, 0.01],
+                [0.02, 0.3], [0.82, 1.0], [0.4, 1.0], [0.0, 0.01]])
+            self.assertEqual(censored[:, 0].tolist(), [False] * 6)
+            self.assertEqual(censored[:, 1].tolist(), [False, True, False,
+                False, False, True])
+            self.assertEqual(test_name,
+                "Comment with the name of the test realized")
+
+        # A file without pairs gives empty columns
+        sample_ids, pairs, p_values, censored, test_name = \
+            parse_beta_significance_output_pairwise_columns(lines[:2])
+        self.assertEqual(sample_ids, [])
+        self.assertEqual(pairs.shape, (0, 2))
+        self.assertEqual(p_values.shape, (0, 2))
+        self.assertEqual(censored.shape, (0, 2))
+
+    def test_parse_beta_significance_output_pairwise_malformed(self):
+        """The pairwise parsers reject the lines without 4 fields"""
+        lines = bs_lines_pairwise.splitlines(True)
+        for bad_line in ['s1\ts5\t0.01\t0.15\textra\n', 's1\ts5\t0.01\n']:
+            bad_lines = lines[:4] + [bad_line] + lines[4:]
+            for chunk_size in [1, 100]:
+                self.assertRaises(ValueError,
+                    parse_beta_significance_output_pairwise_columns,
+                    bad_lines, chunk_size)
+            self.assertRaises(ValueError,
+                parse_beta_significance_output_pairwise, bad_lines)
+        try:
+            parse_beta_significance_output_pairwise_columns(bad_lines, 2)
+        except ValueError, e:
+            self.assertTrue('Line 5 ' in str(e))
+        else:
+            self.fail("The malformed line was accepted")
+
     def test_parse_beta_significance_output_each_sample(self):
         """The each sample beta significance parser works"""
         out = open(self.input_file, 'w')
@@ -86,6 +140,48 @@ class ParseTest(TestCase):
             }
         self.assertEqual(obs_dict, exp_dict)
 
+    def test_parse_jackknife_support_arrays(self):
+        """The jackknife support is parsed into a node index and an array"""
+        obs = parse_jackknife_support_arrays(self.support_lines)
+        self.assertEqual(obs['trees_considered'], 10)
+        self.assertEqual(obs['node_index'], {'node0': 0, 'node1': 1,
+            'node2': 2, 'node3': 3, 'node4': 4})
+        self.assertEqual(obs['support'].dtype, float32)
+        self.assertFloatEqual(obs['support'].tolist(),
+            [1.0, 0.7, 0.4, 0.7, 0.6])
+
+        # Blank lines and line endings are ignored
+        lines = (support_lines.replace('\n', '\r\n') + '\n').splitlines(True)
+        obs = parse_jackknife_support_arrays(lines, float)
+        self.assertEqual(obs['support'].tolist(), [1.0, 0.7, 0.4, 0.7, 0.6])
+
+        # A file without nodes gives an empty array
+        obs = parse_jackknife_support_arrays(self.support_lines[:2])
+        self.assertEqual(obs['node_index'], {})
+        self.assertEqual(obs['support'].tolist(), [])
+
+    def test_parse_jackknife_support_arrays_errors(self):
+        """The malformed jackknife support files are detected"""
+        self.assertRaises(ValueError, parse_jackknife_support_arrays,
+            self.support_lines[1:])
+        self.assertRaises(ValueError, parse_jackknife_support_arrays,
+            self.support_lines + ["node5"])
+        self.assertRaises(ValueError, parse_jackknife_support_arrays,
+            self.support_lines + ["node5\t0.1\t0.2"])
+        self.assertRaises(ValueError, parse_jackknife_support_arrays,
+            self.support_lines + ["node0\t0.1"])
+        self.assertRaises(ValueError, parse_jackknife_support_arrays,
+            self.support_lines + ["node5\tabc"])
+        # The field count is checked on each line, so a line with 3 fields
+        # can not make up for a line with 1 field
+        lines = self.support_lines + ["node5\t0.1\t0.2", "node6"]
+        try:
+            parse_jackknife_support_arrays(lines)
+        except ValueError, e:
+            self.assertTrue('Line %d ' % (len(lines) - 1) in str(e))
+        else:
+            self.fail("The malformed lines were accepted")
+
 bs_lines_pairwise = """#Comment with the name of the test realized
 Sample1\tSample2\tp value\tp value (Bonferroni corrected)
 s1\ts2\t0.01\t0.15
@@ -11,11 +11,18 @@ __email__ = "lozupone@colorado.edu"
 __status__ = "Development"
 
 from cogent.util.unit_test import TestCase,main
-from numpy import array
-from biom.table import table_factory
+from qiime.util import load_qiime_config, get_tmp_filename
+from os import remove
+from warnings import catch_warnings, simplefilter
+from numpy import array, int32
+from biom.table import table_factory, SparseObj
+import fastunifrac.sample_id_map_otu_table_conversion
 from fastunifrac.sample_id_map_otu_table_conversion import (
-    parse_sample_mapping, sample_mapping_to_otu_table,
-    sample_mapping_to_biom_table)
+    SampleIdSanitizer, parse_sample_mapping, sample_mapping_to_otu_table,
+    sample_mapping_to_biom_table, parse_sample_mapping_to_coo,
+    coo_to_sparse_obj, coo_to_biom_table, has_csmat_csr_attributes,
+    get_chunk_boundaries, read_lines_in_range,
+    parallel_parse_sample_mapping_to_coo, parse_sample_mapping_fp_to_coo)
 
 class SampleIdMapOtuTableConversionTests(TestCase):
     """"""
@@ -31,13 +38,82 @@ class SampleIdMapOtuTableConversionTests(TestCase):
         self.SampleMapping2 = ["OTU1\tsample1", "OTU1\tsample3", \
         "OTU2\tsample1", "OTU2\tsample2"]
 
+        self.SampleMappingCollision = ["OTU1\tsample_1\t3",
+        "OTU1\tsample#1\t2"]
+
+        self.qiime_config = load_qiime_config()
+        self.tmp_dir = self.qiime_config['temp_dir'] or '/tmp/'
+        self.input_file = get_tmp_filename(tmp_dir=self.tmp_dir)
+        self._paths_to_clean_up = []
+
+    def tearDown(self):
+        """Cleans up the environment once the tests finish"""
+        map(remove, self._paths_to_clean_up)
+
+    def _write_input_file(self, lines, newline='\n'):
+        """Writes 'lines' to the input file"""
+        out = open(self.input_file, 'wb')
+        out.write(newline.join(lines) + newline)
+        out.close()
+        self._paths_to_clean_up = [self.input_file]
+
+    def test_sample_id_sanitizer(self):
+        """SampleIdSanitizer translates and caches the sample ids"""
+        sanitizer = SampleIdSanitizer(max_size=2)
+        self.assertEqual(sanitizer('sample_1'), 'sample.1')
+        self.assertEqual(sanitizer('sample.1'), 'sample.1')
+        self.assertEqual(sanitizer('sample1'), 'sample1')
+        self.assertEqual(sanitizer('sample_1'), 'sample.1')
+        # The cache size is bounded
+        for i in range(10):
+            sanitizer('s#%d' % i)
+        self.assertTrue(len(sanitizer._current) <= 2)
+        self.assertTrue(len(sanitizer._old) <= 2)
+        self.assertEqual(sanitizer('s#0'), 's.0')
+
+    def test_sample_id_sanitizer_collisions(self):
+        """SampleIdSanitizer warns about collisions within the same file"""
+        sanitizer = SampleIdSanitizer()
+        owners = {}
+        self.assertEqual(sanitizer('sample_1', owners), 'sample.1')
+        self.assertEqual(sanitizer('sample_1', owners), 'sample.1')
+        self.assertEqual(owners, {'sample.1': 'sample_1'})
+        caught = catch_warnings(record=True)
+        with caught as w:
+            simplefilter('always')
+            self.assertEqual(sanitizer('sample#1', owners), 'sample.1')
+            self.assertEqual(len(w), 1)
+            self.assertTrue("'sample_1' and 'sample#1'" in str(w[0].message))
+            # Different files do not collide
+            self.assertEqual(sanitizer('sample#1', {}), 'sample.1')
+            self.assertEqual(len(w), 1)
+
+    def test_sample_id_collisions_are_merged(self):
+        """The sample ids corrected to the same MIENS id are merged"""
+        caught = catch_warnings(record=True)
+        with caught as w:
+            simplefilter('always')
+            OTU_sample_info, all_sample_names = parse_sample_mapping(
+                self.SampleMappingCollision)
+            self.assertEqual(OTU_sample_info, {'OTU1': {'sample.1': '2'}})
+            table = sample_mapping_to_biom_table(self.SampleMappingCollision)
+            self.assertEqual(table.SampleIds, ('sample.1',))
+            # Both lines are kept in the merged sample, in file order
+            self.assertEqual(table._data.items(), [((0, 0), 3.),
+                ((0, 0), 2.)])
+            # The collisions are only checked on request
+            self.assertEqual(len(w), 0)
+            parse_sample_mapping(self.SampleMappingCollision, True)
+            sample_mapping_to_biom_table(self.SampleMappingCollision, True)
+            self.assertEqual(len(w), 2)
+
     def test_parse_sample_mapping(self):
         """parse_sample_mapping works"""
         lines = self.SampleMapping
         obs_OTU_sample_info, obs_all_sample_names = parse_sample_mapping(lines)
         exp_OTU_sample_info = {
-            'OTU2': {'sample1': '1', 'sample3': '0', 'sample2': '2'},
-            'OTU1': {'sample1': '3', 'sample3': '2', 'sample2': '0'}
+            'OTU2': {'sample1': '1', 'sample2': '2'},
+            'OTU1': {'sample1': '3', 'sample3': '2'}
         }
         exp_all_sample_names = set(['sample1', 'sample3', 'sample2'])
         self.assertEqual(obs_OTU_sample_info, exp_OTU_sample_info)
@@ -46,8 +122,8 @@ class SampleIdMapOtuTableConversionTests(TestCase):
         lines = self.SampleMappingNoMIENS
         obs_OTU_sample_info, obs_all_sample_names = parse_sample_mapping(lines)
         exp_OTU_sample_info = {
-            'OTU2': {'sample.1': '1', 'sample.3': '0', 'sample.2': '2'},
-            'OTU1': {'sample.1': '3', 'sample.3': '2', 'sample.2': '0'}
+            'OTU2': {'sample.1': '1', 'sample.2': '2'},
+            'OTU1': {'sample.1': '3', 'sample.3': '2'}
         }
         exp_all_sample_names = set(['sample.1', 'sample.3', 'sample.2'])
         self.assertEqual(obs_OTU_sample_info, exp_OTU_sample_info)
@@ -56,8 +132,8 @@ class SampleIdMapOtuTableConversionTests(TestCase):
         lines = self.SampleMapping2
         obs_OTU_sample_info, obs_all_sample_names = parse_sample_mapping(lines)
         exp_OTU_sample_info = {
-            'OTU2': {'sample1': '1', 'sample3': '0', 'sample2': '1'},
-            'OTU1': {'sample1': '1', 'sample3': '1', 'sample2': '0'}
+            'OTU2': {'sample1': '1', 'sample2': '1'},
+            'OTU1': {'sample1': '1', 'sample3': '1'}
         }
         exp_all_sample_names = set(['sample1', 'sample3', 'sample2'])
         self.assertEqual(obs_OTU_sample_info, exp_OTU_sample_info)
@@ -66,17 +142,23 @@ class SampleIdMapOtuTableConversionTests(TestCase):
     def test_sample_mapping_to_otu_table(self):
         """sample_mapping_to_otu_table works"""
         lines = self.SampleMapping
-        result = sample_mapping_to_otu_table(lines)
+        result = list(sample_mapping_to_otu_table(lines))
         self.assertEqual(result, ['#Full OTU Counts',\
          '#OTU ID\tsample1\tsample2\tsample3', 'OTU2\t1\t2\t0', \
         'OTU1\t3\t0\t2'])
 
         lines = self.SampleMappingNoMIENS
-        result = sample_mapping_to_otu_table(lines)
+        result = list(sample_mapping_to_otu_table(lines))
         self.assertEqual(result, ['#Full OTU Counts',\
          '#OTU ID\tsample.1\tsample.2\tsample.3', 'OTU2\t1\t2\t0', \
         'OTU1\t3\t0\t2'])
 
+        lines = self.SampleMapping2
+        result = list(sample_mapping_to_otu_table(lines))
+        self.assertEqual(result, ['#Full OTU Counts',\
+         '#OTU ID\tsample1\tsample2\tsample3', 'OTU2\t1\t1\t0', \
+        'OTU1\t1\t0\t1'])
+
     def test_sample_mapping_to_biom_table(self):
         """sample_mapping_to_biom_table works"""
         lines = self.SampleMapping
@@ -93,5 +175,142 @@ class SampleIdMapOtuTableConversionTests(TestCase):
                             ['OTU1','OTU2'])
         self.assertEqual(actual.sortBySampleId(), exp.sortBySampleId())
 
+    def test_sample_mapping_to_biom_table_ids_order(self):
+        """sample_mapping_to_biom_table keeps the first-seen id order"""
+        lines = self.SampleMapping
+        actual = sample_mapping_to_biom_table(lines)
+        self.assertEqual(actual.SampleIds, ('sample1', 'sample3', 'sample2'))
+        self.assertEqual(actual.ObservationIds, ('OTU1', 'OTU2'))
+
+        # Buffers are grown when the number of lines exceeds their capacity
+        lines = ["OTU%d\tsample%d\t%d" % (i % 7, i % 5, i + 1)
+            for i in range(35)] * 300
+        actual = sample_mapping_to_biom_table(lines)
+        self.assertEqual(actual.SampleIds,
+            tuple(['sample%d' % i for i in range(5)]))
+        self.assertEqual(actual.ObservationIds,
+            tuple(['OTU%d' % i for i in range(7)]))
+
+    def test_coo_to_sparse_obj(self):
+        """The sparse matrix is built from the COO arrays"""
+        rows = array([2, 0, 2, 0, 1], dtype=int32)
+        cols = array([1, 2, 0, 0, 1], dtype=int32)
+        values = array([5., 1., 4., 3., 0.])
+        obs = coo_to_sparse_obj(rows, cols, values, (4, 3))
+        self.assertEqual(obs.shape, (4, 3))
+        # The zero values are not stored
+        self.assertEqual(obs.size, 4)
+        self.assertEqual(sorted(obs.items()), [((0, 0), 3.), ((0, 2), 1.),
+            ((2, 0), 4.), ((2, 1), 5.)])
+
+    def test_has_csmat_csr_attributes(self):
+        """The biom CSMat still has the attributes used by csr_to_sparse_obj
+        """
+        if SparseObj.__name__ != 'CSMat':
+            return
+        self.assertTrue(has_csmat_csr_attributes(SparseObj(2, 2)),
+            "The internals of biom's CSMat have changed, so "
+            "csr_to_sparse_obj builds every table through bulkCOOUpdate. "
+            "Update CSMAT_CSR_ATTRIBUTES for this biom version.")
+
+    def test_coo_to_sparse_obj_public_api(self):
+        """The sparse matrix is the same without the CSMat attributes"""
+        rows = array([2, 0, 2, 0, 1], dtype=int32)
+        cols = array([1, 2, 0, 0, 1], dtype=int32)
+        values = array([5., 1., 4., 3., 0.])
+        exp = coo_to_sparse_obj(rows, cols, values, (4, 3))
+        module = fastunifrac.sample_id_map_otu_table_conversion
+        attributes = module.CSMAT_CSR_ATTRIBUTES
+        module.CSMAT_CSR_ATTRIBUTES = attributes + ['_missing_attribute']
+        try:
+            obs = coo_to_sparse_obj(rows, cols, values, (4, 3))
+        finally:
+            module.CSMAT_CSR_ATTRIBUTES = attributes
+        self.assertEqual(obs.shape, (4, 3))
+        self.assertEqual(obs.size, 4)
+        self.assertEqual(sorted(obs.items()), sorted(exp.items()))
+
+    def test_coo_to_biom_table(self):
+        """coo_to_biom_table matches the table built from the triplets"""
+        rows = array([1, 0, 1, 0], dtype=int32)
+        cols = array([0, 2, 1, 0], dtype=int32)
+        values = array([1., 2., 2., 3.])
+        actual = coo_to_biom_table(rows, cols, values,
+            ['sample1', 'sample3', 'sample2'], ['OTU1', 'OTU2', 'OTU3'])
+        exp = table_factory([[1, 0, 1.], [0, 2, 2.], [1, 1, 2.], [0, 0, 3.]],
+            ['sample1', 'sample3', 'sample2'], ['OTU1', 'OTU2', 'OTU3'],
+            shape=(3, 3))
+        self.assertEqual(actual, exp)
+        self.assertEqual(actual.observationData('OTU3').tolist(), [0, 0, 0])
+
+    def test_get_chunk_boundaries(self):
+        """The file is split in ranges aligned on newlines"""
+        self._write_input_file(self.SampleMapping)
+        data = open(self.input_file, 'rb').read()
+        for n_chunks in range(1, 8):
+            chunks = get_chunk_boundaries(self.input_file, n_chunks)
+            self.assertTrue(len(chunks) <= min(n_chunks, 4))
+            self.assertEqual(chunks[0][0], 0)
+            self.assertEqual(chunks[-1][1], len(data))
+            for (start, end), (next_start, next_end) in zip(chunks[:-1],
+                chunks[1:]):
+                self.assertEqual(end, next_start)
+                self.assertEqual(data[start - 1], '\n')
+            lines = []
+            for start, end in chunks:
+                lines.extend(read_lines_in_range(self.input_file, start, end))
+            self.assertEqual(''.join(lines), data)
+
+        # The '\r' and '\r\n' line endings are also newlines
+        for newline in ['\r', '\r\n']:
+            self._write_input_file(self.SampleMapping, newline)
+            data = open(self.input_file, 'rb').read()
+            for n_chunks in range(1, 8):
+                chunks = get_chunk_boundaries(self.input_file, n_chunks)
+                lines = []
+                for start, end in chunks:
+                    self.assertTrue(data[start:].startswith('OTU'))
+                    lines.extend(read_lines_in_range(self.input_file, start,
+                        end))
+                self.assertEqual(lines, [line + newline
+                    for line in self.SampleMapping])
+
+    def test_parallel_parse_sample_mapping_to_coo(self):
+        """The parallel parser gives the same result as the serial one"""
+        lines = ["OTU%d\tsample_%d\t%d" % ((i * 7) % 13, (i * 3) % 11, i)
+            for i in range(500)]
+        self._write_input_file(lines)
+        exp = parse_sample_mapping_to_coo(lines)
+        for workers in [1, 2, 3, 8]:
+            obs = parallel_parse_sample_mapping_to_coo(self.input_file,
+                workers)
+            self.assertEqual(obs[0], exp[0])
+            self.assertEqual(obs[1], exp[1])
+            self.assertEqual(obs[2], exp[2])
+            self.assertEqual(obs[3], exp[3])
+            self.assertEqual(obs[4], exp[4])
+
+        # The files with '\r' or '\r\n' line endings give the same result as
+        # the serial parser, which reads them in universal newlines mode
+        for newline in ['\r', '\r\n']:
+            self._write_input_file(lines, newline)
+            for workers in [1, 2, 3]:
+                obs = parse_sample_mapping_fp_to_coo(self.input_file, workers)
+                for obs_value, exp_value in zip(obs, exp):
+                    self.assertEqual(obs_value, exp_value)
+
+        # Collisions between different chunks are merged, and reported on
+        # request
+        self._write_input_file(self.SampleMappingCollision)
+        caught = catch_warnings(record=True)
+        with caught as w:
+            simplefilter('always')
+            obs = parallel_parse_sample_mapping_to_coo(self.input_file, 2)
+            self.assertEqual(obs[3], ['sample.1'])
+            self.assertEqual(obs[1].tolist(), [0, 0])
+            self.assertEqual(len(w), 0)
+            parallel_parse_sample_mapping_to_coo(self.input_file, 2, True)
+            self.assertEqual(len(w), 1)
+
 if __name__ =='__main__':
     main()
\ No newline at end of file